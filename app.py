@@ -1,16 +1,178 @@
 # app.py
 
 import streamlit as st
-from sqlalchemy import text
 import pandas as pd
 
 # Import the modules
-from database_utils import create_sqlite_engine
-from data_extraction import extract_and_store_data
-from data_querying import execute_query, extract_ticker_from_query
-from data_visualization import visualize_data_with_pygwalker
+from database_utils import get_engine, get_read_engine, table_exists, PARTITION_SEPARATOR
+from catalog import get_catalog
+from jobs import get_job_runner, get_job_progress, list_jobs, schedule_refresh
+from data_querying import execute_query_page, iter_query, extract_ticker_from_query, DEFAULT_PAGE_SIZE
+from data_visualization import (
+    visualize_data_with_pygwalker, prepare_for_visualization, prepare_streamed_visualization, render_fingerprint, RESAMPLE_RULES
+)
+from query_cache import query_cache, make_cache_key
+from instrumentation import metrics
+from query_guard import assess_query, QueryRejected, RunningQuery, DEFAULT_QUERY_TIMEOUT
+from panel import load_panel, panel_returns, correlation_matrix, rolling_beta, relative_performance
+from columnar_store import DEFAULT_COLUMNAR_DIR
+from intraday import INTRADAY_INTERVALS, partition_tables
+from backtest import RULES, run_backtest
 
-from pygwalker.api.streamlit import init_streamlit_comm
+@st.fragment(run_every=2)
+def show_ingestion_progress(engine):
+    """
+    Polls the job tables and shows the progress of this session's latest job and recent jobs.
+    """
+    job_id = st.session_state.get("ingest_job_id")
+    progress = get_job_progress(engine, job_id) if job_id is not None else None
+    if progress is not None:
+        st.write(f"### Ingestion job {job_id}: {progress['status']}")
+        st.progress(
+            progress["processed"] / max(progress["total"], 1),
+            text=f"{progress['processed']} of {progress['total']} tickers processed"
+        )
+        if progress["status"] == "done":
+            if progress["failed"]:
+                st.warning(f"Failed to store {progress['failed']} of {progress['total']} tickers.")
+            else:
+                st.success("Data extracted and stored successfully!")
+        st.dataframe(progress["tickers"])
+
+    st.write("### Recent Ingestion Jobs")
+    st.dataframe(list_jobs(engine))
+
+    st.write("### Stored Tickers")
+    st.dataframe(get_catalog(engine).frame(), hide_index=True)
+
+@st.fragment(run_every=0.5)
+def show_running_query():
+    """
+    Polls the session's background query, offering to cancel it, and stores its result once it finishes.
+    """
+    running = st.session_state.running_query
+    if running.done():
+        st.session_state.query_result, st.session_state.query_has_more = running.result()
+        st.session_state.running_query = None
+        st.rerun()
+
+    st.info(f"Running query... {running.elapsed:.1f} s (stopped after {DEFAULT_QUERY_TIMEOUT:g} s)")
+    if st.button("Cancel query"):
+        running.cancel()
+
+# Span columns shown for each query, in pipeline order
+QUERY_TIMING_COLUMNS = ["started_at", "query", "backend", "cached", "rows", "seconds",
+                        "sql_execute_seconds", "dataframe_build_seconds", "date_format_seconds", "error"]
+
+def show_performance_panel():
+    """
+    Sidebar panel with the most recent timings per query and per ticker, and process totals.
+    """
+    with st.sidebar.expander("Performance"):
+        queries = metrics.recent_spans(name="query", limit=20)
+        st.write("Recent queries")
+        if queries.empty:
+            st.caption("No queries run yet.")
+        else:
+            st.dataframe(queries[[col for col in QUERY_TIMING_COLUMNS if col in queries.columns]], hide_index=True)
+
+        # Seconds spent per ingestion stage for the most recently processed tickers
+        ticker_spans = metrics.recent_spans(label="ticker")
+        st.write("Recent tickers")
+        if ticker_spans.empty:
+            st.caption("No tickers ingested yet.")
+        else:
+            latest = ticker_spans.drop_duplicates("ticker")["ticker"].head(20)
+            per_ticker = ticker_spans[ticker_spans["ticker"].isin(latest)].pivot_table(
+                index="ticker", columns="name", values="seconds", aggfunc="sum"
+            )
+            st.dataframe(per_ticker.reindex(latest))
+
+        st.write("Totals")
+        st.dataframe(metrics.summary())
+        st.json(metrics.counters(), expanded=False)
+
+@st.cache_resource(show_spinner=False)
+def warm_up():
+    """
+    Opens the shared engines and loads the ticker catalog once per process, so
+    sessions after the first find them ready instead of paying for them on render.
+    """
+    engine = get_engine()
+    with get_read_engine(engine).connect() as connection:
+        connection.exec_driver_sql("SELECT 1")
+    get_catalog(engine)
+    return engine
+
+def show_panel_analytics(engine):
+    """
+    Compares several tickers on one aligned date x ticker panel.
+    """
+    available = get_catalog(engine).tickers()
+    defaults = [ticker for ticker in st.session_state.tickers_list if ticker in available]
+    tickers = st.multiselect("Tickers", available, default=defaults)
+    if len(tickers) < 2:
+        st.info("Select at least two tickers to compare.")
+        return
+
+    column_input, fill_input, window_input = st.columns(3)
+    column = column_input.selectbox("Price", ["Adj_Close", "Close", "Open", "High", "Low"])
+    fill_limit = fill_input.number_input("Forward-fill gaps up to (days)", min_value=0, value=5)
+    window = window_input.number_input("Beta window (days)", min_value=5, value=63)
+    benchmark = st.selectbox("Benchmark", tickers)
+
+    panel = load_panel(tickers, engine, column=column, fill_limit=fill_limit)
+    if panel.empty:
+        st.error("No stored prices for the selected tickers.")
+        return
+    returns = panel_returns(panel)
+
+    st.write("### Relative Performance")
+    st.line_chart(relative_performance(panel))
+
+    st.write("### Correlation of Daily Returns")
+    st.dataframe(correlation_matrix(returns).round(3))
+
+    st.write(f"### Rolling {window}-Day Beta vs {benchmark}")
+    st.line_chart(rolling_beta(returns, benchmark, window).drop(columns=benchmark))
+
+def show_backtest(engine):
+    """
+    Sweeps a signal rule's parameter grid over stored prices and shows the
+    summary statistics and the equity curves of the best parameter set.
+    """
+    available = get_catalog(engine).tickers()
+    defaults = [ticker for ticker in st.session_state.tickers_list if ticker in available]
+    tickers = st.multiselect("Tickers", available, default=defaults)
+    rule = st.selectbox("Rule", list(RULES))
+
+    # One comma-separated list of values per parameter; the grid is every combination
+    grid = {}
+    for column, (name, values) in zip(st.columns(len(RULES[rule][1])), RULES[rule][1].items()):
+        text_values = column.text_input(name, ", ".join(str(value) for value in values))
+        kind = type(values[0])
+        try:
+            grid[name] = [kind(value) for value in text_values.replace(",", " ").split()]
+        except ValueError:
+            grid[name] = []
+        if not grid[name]:
+            column.error(f"Enter {kind.__name__} values for {name}")
+
+    if st.button("Run Backtest", disabled=not tickers or not all(grid.values())):
+        with st.spinner("Running backtest..."):
+            try:
+                st.session_state.backtest_result = run_backtest(tickers, engine, rule, grid)
+            except Exception as e:
+                st.session_state.backtest_result = None
+                st.error(f"Error: {e}")
+
+    result = st.session_state.get("backtest_result")
+    if result is not None:
+        st.write("### Backtest Results")
+        best = ", ".join(f"{name}={value}" for name, value in result["best"].items())
+        st.write(f"Equity curves for the best parameters by median Sharpe ratio ({best})")
+        st.line_chart(result["equity"])
+        st.dataframe(result["summary"].round(4), hide_index=True)
 
 def main():
     # Configure Streamlit page
@@ -19,20 +181,16 @@ def main():
         layout="wide"
     )
 
-    # Initialize pygwalker communication
-    init_streamlit_comm()
-
     st.title("Stock Data Management App")
     st.sidebar.header("Options")
 
     # Sidebar options
     option = st.sidebar.selectbox("Choose an action", ["Extract Data", "Query Data"])
+    show_performance_panel()
 
-    # Create a persistent SQLite database engine
-    if "db_engine" not in st.session_state:
-        st.session_state.db_engine = create_sqlite_engine()
-
-    engine = st.session_state.db_engine
+    # Shared by every session: the writable engine is used for ingestion and
+    # queries go through its read-only pool
+    engine = warm_up()
 
     # Session state to store tickers
     if "tickers_list" not in st.session_state:
@@ -42,6 +200,20 @@ def main():
     if "query_result" not in st.session_state:
         st.session_state.query_result = None
 
+    # Session state to store the query being paged through and whether more rows remain
+    if "query_text" not in st.session_state:
+        st.session_state.query_text = None
+    if "query_has_more" not in st.session_state:
+        st.session_state.query_has_more = False
+    if "query_backend" not in st.session_state:
+        st.session_state.query_backend = "sqlite"
+
+    # Session state to store the query running in the background and its plan warnings
+    if "running_query" not in st.session_state:
+        st.session_state.running_query = None
+    if "query_warnings" not in st.session_state:
+        st.session_state.query_warnings = []
+
     # Session state to store the current selected stock
     if "current_stock" not in st.session_state:
         st.session_state.current_stock = st.session_state.tickers_list[0]
@@ -53,22 +225,50 @@ def main():
         tickers = st.text_input("Enter stock tickers (comma-separated):", ",".join(st.session_state.tickers_list))
         tickers_list = [ticker.strip().upper() for ticker in tickers.split(",")]  # Convert to uppercase
 
+        # Intraday bars are stored in monthly partitions queried as e.g. "AAPL@5m"
+        bar_size = st.selectbox("Bar size", ["1d"] + list(INTRADAY_INTERVALS))
+        options = {} if bar_size == "1d" else {"interval": bar_size}
+
+        # Ingestion runs on the process-wide background runner, so it keeps going
+        # if this page is refreshed or the session disconnects
+        runner = get_job_runner(engine)
+
         if st.button("Extract and Store Data"):
-            with st.spinner("Extracting data..."):
-                try:
-                    extract_and_store_data(tickers_list, engine)
-                    st.session_state.tickers_list = tickers_list  # Already in uppercase
-                    st.success("Data extracted and stored successfully!")
-                except Exception as e:
-                    st.error(f"Error: {e}")
+            try:
+                st.session_state.ingest_job_id = runner.submit(tickers_list, **options)
+                st.session_state.tickers_list = tickers_list  # Already in uppercase
+            except Exception as e:
+                st.error(f"Error: {e}")
+
+        with st.expander("Schedule a recurring refresh"):
+            interval_hours = st.number_input("Refresh every (hours):", min_value=1, value=24)
+            if st.button("Schedule Refresh"):
+                schedule_refresh(engine, tickers_list, interval_hours * 3600, **options)
+                st.success(f"Scheduled a refresh of {len(tickers_list)} tickers every {interval_hours} hours.")
+
+        show_ingestion_progress(engine)
 
     elif option == "Query Data":
         st.subheader("Query Stock Data")
 
+        mode = st.radio("Mode", ["SQL", "Compare tickers", "Backtest"], horizontal=True)
+        if mode == "Compare tickers":
+            show_panel_analytics(engine)
+            return
+        if mode == "Backtest":
+            show_backtest(engine)
+            return
+
         # Default query setup
         default_ticker = st.session_state.tickers_list[0] if st.session_state.tickers_list else "AAPL"
         query = st.text_area("Enter your SQL query:", f"SELECT * FROM {default_ticker} LIMIT 10")
 
+        # The columnar backend is only offered when a mirror directory is configured
+        backend = "sqlite"
+        if DEFAULT_COLUMNAR_DIR:
+            backend_label = st.radio("Query engine", ["SQLite", "Columnar (DuckDB)"], horizontal=True)
+            backend = "columnar" if backend_label == "Columnar (DuckDB)" else "sqlite"
+
         # Extract ticker and validate
         extracted_ticker = extract_ticker_from_query(query)
         if extracted_ticker:
@@ -78,35 +278,142 @@ def main():
 
         # Check if the table exists
         selected_table = st.session_state.current_stock.upper()
-        with engine.connect() as connection:
-            table_exists = connection.execute(
-                text(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{selected_table}'")
-            ).fetchone()
-
-        if not table_exists:
+        if PARTITION_SEPARATOR in selected_table:
+            ticker, interval = selected_table.split(PARTITION_SEPARATOR, 1)
+            with get_read_engine(engine).connect() as connection:
+                exists = bool(partition_tables(connection, ticker, interval.lower()))
+        else:
+            # Shared tables such as prices and indicators are not catalogued tickers
+            exists = get_catalog(engine).exists(selected_table) or table_exists(
+                get_read_engine(engine), selected_table, ignore_case=True
+            )
+        if not exists:
             st.error(f"Table `{st.session_state.current_stock}` does not exist. Please extract data first.")
             return
 
-        # Run query button
-        if st.button("Run Query"):
-            with st.spinner("Executing query..."):
-                result = execute_query(query, engine)
-                st.session_state.query_result = result
+        # Run query button: the plan is checked first, then the query runs in the
+        # background under a time budget so it can be cancelled from the page
+        if st.button("Run Query", disabled=st.session_state.running_query is not None):
+            try:
+                assessment = assess_query(query, engine) if backend == "sqlite" else {"warnings": []}
+            except QueryRejected as e:
+                st.session_state.query_result = f"Query rejected: {e}"
+                st.session_state.query_warnings = []
+            else:
+                st.session_state.query_warnings = assessment["warnings"]
+                st.session_state.query_result = None
+                st.session_state.query_text = query
+                st.session_state.query_backend = backend
+                st.session_state.query_has_more = False
+                st.session_state.running_query = RunningQuery(
+                    execute_query_page, query, engine, offset=0, limit=DEFAULT_PAGE_SIZE,
+                    backend=backend, timeout=DEFAULT_QUERY_TIMEOUT
+                )
+
+        if st.session_state.running_query is not None:
+            show_running_query()
+
+        for warning in st.session_state.query_warnings:
+            st.warning(warning)
+
+        cache_stats = query_cache.stats()
+        st.caption(
+            f"Query cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} results ({cache_stats['bytes'] / 1e6:.1f} MB)"
+        )
 
         # Display results and visualization
         if st.session_state.query_result is not None:
             if isinstance(st.session_state.query_result, pd.DataFrame):
                 st.write("### Query Results")
-                st.write(st.session_state.query_result)
+                result = st.session_state.query_result
+                duplicated = result.columns[result.columns.duplicated()].unique()
+                if len(duplicated):
+                    # Arrow cannot display repeated names, so they are numbered on screen only
+                    st.warning(
+                        f"Columns {', '.join(duplicated)} are returned more than once; alias them "
+                        "(e.g. b.Close AS Close_b) to chart them."
+                    )
+                    counts = {}
+                    labels = []
+                    for col in result.columns:
+                        labels.append(f"{col}:{counts[col]}" if col in counts else col)
+                        counts[col] = counts.get(col, 0) + 1
+                    st.write(result.set_axis(labels, axis=1))
+                else:
+                    st.write(result)
+
+                # Load the next page of rows for the query that produced the current result
+                if st.session_state.query_has_more:
+                    st.caption(f"Showing the first {len(st.session_state.query_result)} rows.")
+                    if st.button("Load more"):
+                        with st.spinner("Loading more rows..."):
+                            page, has_more = execute_query_page(
+                                st.session_state.query_text, engine,
+                                offset=len(st.session_state.query_result), limit=DEFAULT_PAGE_SIZE,
+                                backend=st.session_state.query_backend, timeout=DEFAULT_QUERY_TIMEOUT
+                            )
+                            if isinstance(page, pd.DataFrame):
+                                st.session_state.query_result = pd.concat(
+                                    [st.session_state.query_result, page], ignore_index=True
+                                )
+                                st.session_state.query_has_more = has_more
+                            else:
+                                st.error(page)
+                        st.rerun()
+
+                if len(duplicated):
+                    return
 
                 # PyGWalker Visualization Section
                 st.subheader("Interactive Visualization with PyGWalker")
 
-                # Clear the cache for PyGWalker renderer when new query is executed
-                st.cache_resource.clear()
+                # Reduce long histories before they are sent to the browser; "Daily" and
+                # no chart width keep the raw rows for drill-down
+                bars_column, width_column = st.columns(2)
+                bars = bars_column.selectbox("Bars", ["Daily"] + list(RESAMPLE_RULES))
+                chart_width = width_column.number_input(
+                    "Chart width in pixels (0 shows every point)", min_value=0, value=1200, step=100
+                )
+
+                # Only the loaded pages are held in the session, so a reduced chart of a longer
+                # result streams the whole query instead; the columnar backend cannot be streamed
+                chart_data = None
+                if (st.session_state.query_has_more and st.session_state.query_backend == "sqlite"
+                        and (bars in RESAMPLE_RULES or chart_width) and "Date" in result.columns):
+                    chart_key = make_cache_key(st.session_state.query_text, engine) + (bars, chart_width)
+                    streamed = st.session_state.get("streamed_chart")
+                    if streamed is None or streamed[0] != chart_key:
+                        with st.spinner("Charting the full result..."):
+                            try:
+                                streamed = (chart_key, prepare_streamed_visualization(
+                                    iter_query(st.session_state.query_text, engine, timeout=DEFAULT_QUERY_TIMEOUT),
+                                    resample=bars, chart_width=chart_width
+                                ), None)
+                            except Exception as e:
+                                streamed = (chart_key, None, str(e))
+                        st.session_state.streamed_chart = streamed
+                    chart_data, error = streamed[1], streamed[2]
+                    if error:
+                        st.warning(f"Could not chart the full result: {error}")
+                    else:
+                        st.caption(f"Charting {len(chart_data)} points covering every row of the result.")
+
+                if chart_data is None:
+                    chart_data = prepare_for_visualization(result, resample=bars, chart_width=chart_width)
+                    if st.session_state.query_has_more:
+                        st.caption(f"Charting only the {len(result)} loaded rows.")
+                    elif len(chart_data) < len(result):
+                        st.caption(f"Charting {len(chart_data)} of {len(result)} rows.")
+
+                # Reuse the session's renderer while the query, its data and the chart options are unchanged
+                fingerprint = render_fingerprint(
+                    st.session_state.query_text, engine, chart_data,
+                    st.session_state.query_backend, bars, chart_width
+                )
 
                 # Visualize the data
-                visualize_data_with_pygwalker(st.session_state.query_result)
+                visualize_data_with_pygwalker(chart_data, fingerprint)
 
             else:
                 st.error(st.session_state.query_result)
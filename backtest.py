@@ -0,0 +1,292 @@
+# backtest.py
+
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+from panel import load_panel, rolling_window_sum
+
+# Trading days per year, used to annualize returns and volatility
+TRADING_DAYS = 252
+
+# Fraction of the traded value charged each time a position is opened or closed
+DEFAULT_COST = 0.0005
+
+# Worker processes of the shared sweep pool
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Workers are forked from a clean server process rather than from the app, whose
+# threads make forking it unsafe; spawn is the fallback where forkserver is missing
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Grid points x tickers x bars below which a sweep runs in the calling process,
+# because starting the pool would take longer than the sweep itself
+MIN_PARALLEL_CELLS = 5_000_000
+
+# Grid points and tickers evaluated per pool task
+GRID_CHUNK = 16
+TICKER_CHUNK = 256
+
+# Rule parameters counted in bars, which must be positive integers shorter than the price history
+WINDOW_PARAMETERS = {"fast", "slow", "lookback", "window"}
+
+STAT_COLUMNS = ["total_return", "cagr", "volatility", "sharpe", "max_drawdown", "trades", "exposure"]
+
+def rolling_mean(values, window, cache=None):
+    """
+    Trailing mean of each column over `window` rows; NaN until the window holds
+    `window` prices. Computed with cumulative sums, and memoized in cache when
+    one is given, since grid points share most of their windows.
+    """
+    if cache is not None and ("mean", window) in cache:
+        return cache[("mean", window)]
+    present = ~np.isnan(values)
+    sums = rolling_window_sum(np.where(present, values, 0.0), window)
+    counts = rolling_window_sum(present.astype(float), window)
+    with np.errstate(invalid="ignore"):
+        mean = np.where(counts == window, sums / window, np.nan)
+    if cache is not None:
+        cache[("mean", window)] = mean
+    return mean
+
+def rolling_std(values, window, cache=None):
+    if cache is not None and ("std", window) in cache:
+        return cache[("std", window)]
+    present = ~np.isnan(values)
+    x = np.where(present, values, 0.0)
+    mean = rolling_mean(values, window, cache)
+    with np.errstate(invalid="ignore"):
+        std = np.sqrt(np.maximum(rolling_window_sum(x * x, window) / window - mean ** 2, 0.0))
+    if cache is not None:
+        cache[("std", window)] = std
+    return std
+
+def sma_crossover(close, fast, slow, cache=None):
+    """
+    Long while the fast moving average is above the slow one.
+    """
+    if fast >= slow:
+        return np.zeros(close.shape)
+    return (rolling_mean(close, fast, cache) > rolling_mean(close, slow, cache)).astype(float)
+
+def momentum(close, lookback, cache=None):
+    """
+    Long while the price is above its level `lookback` bars earlier.
+    """
+    positions = np.zeros(close.shape)
+    with np.errstate(invalid="ignore"):
+        positions[lookback:] = close[lookback:] > close[:-lookback]
+    return positions
+
+def mean_reversion(close, window, entry_z, cache=None):
+    """
+    Long while the price is more than entry_z standard deviations below its moving average.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (close - rolling_mean(close, window, cache)) / rolling_std(close, window, cache)
+    return (z < -entry_z).astype(float)
+
+# Signal rules and the parameter grid swept when none is given
+RULES = {
+    "sma_crossover": (sma_crossover, {"fast": [5, 10, 20, 50], "slow": [50, 100, 200]}),
+    "momentum": (momentum, {"lookback": [20, 60, 120, 250]}),
+    "mean_reversion": (mean_reversion, {"window": [10, 20, 50], "entry_z": [1.0, 1.5, 2.0]}),
+}
+
+def parameter_grid(grid):
+    """
+    Expands {"name": [values, ...]} into one dict per combination.
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+def validate_grid(rule, grid, bars):
+    """
+    Raises ValueError unless rule is known and every parameter set of the grid names
+    only the rule's parameters, with bar counts that are positive integers below `bars`.
+    """
+    if rule not in RULES:
+        raise ValueError(f"Unknown rule {rule!r}; expected one of {', '.join(RULES)}.")
+    names = set(RULES[rule][1])
+    for params in grid:
+        if set(params) != names:
+            raise ValueError(f"{rule} takes the parameters {', '.join(sorted(names))}, got {', '.join(sorted(params))}.")
+        for name, value in params.items():
+            if name not in WINDOW_PARAMETERS:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, np.integer)) or value < 1:
+                raise ValueError(f"{name} must be a positive whole number of bars, got {value!r}.")
+            if value >= bars:
+                raise ValueError(f"{name}={value} needs more than the {bars} bars of price history available.")
+
+def strategy_returns(close, positions, cost=DEFAULT_COST):
+    """
+    Per-bar strategy returns: a position decided at a bar's close earns the next
+    bar's return, and every change in position pays cost on the traded amount.
+    Returns the strategy returns, the positions held and the turnover, one row per bar after the first.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = close[1:] / close[:-1] - 1.0
+    returns[~np.isfinite(returns)] = 0.0
+    positions = np.nan_to_num(positions)
+    held = positions[:-1]
+    turnover = np.abs(np.diff(positions, axis=0, prepend=0.0))[:-1]
+    return held * returns - cost * turnover, held, turnover
+
+def summarize(close, strategy, held, turnover):
+    """
+    Summary statistics per column of a strategy return matrix, as a (columns, stats) array.
+    """
+    equity = np.cumprod(1.0 + strategy, axis=0)
+    # Years are counted over the bars where the ticker has a price
+    bars = np.maximum(np.sum(~np.isnan(close[1:]), axis=0), 1)
+    total = equity[-1] - 1.0 if len(equity) else np.zeros(close.shape[1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cagr = (1.0 + total) ** (TRADING_DAYS / bars) - 1.0
+        mean = strategy.sum(axis=0) / bars
+        std = np.sqrt(np.maximum((strategy ** 2).sum(axis=0) / bars - mean ** 2, 0.0))
+        sharpe = np.where(std > 0, mean / std * np.sqrt(TRADING_DAYS), np.nan)
+    drawdown = (equity / np.maximum.accumulate(equity, axis=0) - 1.0).min(axis=0) if len(equity) else np.zeros(close.shape[1])
+    trades = np.count_nonzero(turnover, axis=0)
+    exposure = held.sum(axis=0) / bars
+    return np.column_stack([total, cagr, std * np.sqrt(TRADING_DAYS), sharpe, drawdown, trades, exposure])
+
+def evaluate_grid(close, rule, grid, cost=DEFAULT_COST):
+    """
+    Evaluates every parameter set of the grid on every column of a price matrix
+    with array operations only. Returns a (grid points, columns, stats) array.
+    """
+    func = RULES[rule][0]
+    cache = {}
+    out = np.empty((len(grid), close.shape[1], len(STAT_COLUMNS)))
+    for i, params in enumerate(grid):
+        positions = func(close, cache=cache, **params)
+        out[i] = summarize(close, *strategy_returns(close, positions, cost))
+    return out
+
+# Shared price matrix the current worker process has mapped, by block name
+_shared = {}
+
+def shared_prices(name, shape):
+    """
+    Maps the parent's shared price matrix into a worker without copying it,
+    keeping the mapping while the parent sends tasks for the same block.
+    """
+    if _shared.get("name") != name:
+        if "memory" in _shared:
+            # The old view must go before its block can be unmapped
+            del _shared["close"]
+            _shared["memory"].close()
+        memory = shared_memory.SharedMemory(name=name)
+        _shared.update(name=name, memory=memory, close=np.ndarray(shape, dtype=np.float64, buffer=memory.buf))
+    return _shared["close"]
+
+def evaluate_block(name, shape, rule, grid, start, stop, cost):
+    return evaluate_grid(shared_prices(name, shape)[:, start:stop], rule, grid, cost)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Returns the process-wide sweep pool, starting it on first use. Kept for the
+    life of the process so only the first sweep pays for starting workers.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=DEFAULT_WORKERS, mp_context=multiprocessing.get_context(START_METHOD))
+        return _pool
+
+def reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def sweep(close, rule, grid, cost=DEFAULT_COST, workers=DEFAULT_WORKERS, min_cells=MIN_PARALLEL_CELLS):
+    """
+    Evaluates a parameter grid over a (bars, tickers) price matrix. Large sweeps
+    are split into blocks of grid points and tickers and run on the shared
+    process pool, which reads the prices from shared memory; workers=1 keeps
+    the sweep in the calling process, as do sweeps of fewer than min_cells
+    grid points x tickers x bars. Returns a (grid points, tickers, stats) array.
+    Raises ValueError for a grid validate_grid rejects, before any work is submitted.
+    """
+    validate_grid(rule, grid, close.shape[0])
+    cells = len(grid) * close.shape[0] * close.shape[1]
+    if workers <= 1 or cells < min_cells:
+        return evaluate_grid(close, rule, grid, cost)
+
+    memory = shared_memory.SharedMemory(create=True, size=max(close.nbytes, 1))
+    try:
+        np.ndarray(close.shape, dtype=np.float64, buffer=memory.buf)[:] = close
+        blocks = [
+            (g, min(g + GRID_CHUNK, len(grid)), t, min(t + TICKER_CHUNK, close.shape[1]))
+            for g in range(0, len(grid), GRID_CHUNK)
+            for t in range(0, close.shape[1], TICKER_CHUNK)
+        ]
+        out = np.empty((len(grid), close.shape[1], len(STAT_COLUMNS)))
+        pool = get_pool()
+        futures = [
+            (block, pool.submit(evaluate_block, memory.name, close.shape, rule, grid[block[0]:block[1]], block[2], block[3], cost))
+            for block in blocks
+        ]
+        try:
+            for (g0, g1, t0, t1), future in futures:
+                out[g0:g1, t0:t1] = future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); the next sweep starts a fresh pool
+            reset_pool()
+            raise
+        return out
+    finally:
+        memory.close()
+        memory.unlink()
+
+def equity_curves(panel, rule, params, cost=DEFAULT_COST):
+    """
+    Returns the equity curve (growth of one unit) of each ticker of a price panel for one parameter set.
+    """
+    close = panel.to_numpy(dtype=float)
+    positions = RULES[rule][0](close, **params)
+    strategy, _, _ = strategy_returns(close, positions, cost)
+    equity = np.vstack([np.ones((1, close.shape[1])), np.cumprod(1.0 + strategy, axis=0)])
+    return pd.DataFrame(equity, index=panel.index, columns=panel.columns)
+
+def run_backtest(tickers, engine, rule, grid=None, column="Adj_Close", start=None, end=None,
+                 cost=DEFAULT_COST, workers=DEFAULT_WORKERS):
+    """
+    Backtests a signal rule over stored prices for every combination of its
+    parameter grid (RULES' default grid when none is given) and every ticker.
+    Returns a dict with:
+      summary: one row per parameter set and ticker with the STAT_COLUMNS statistics
+      best: the parameter set with the highest median Sharpe ratio across tickers
+      equity: equity curves of every ticker under the best parameter set
+    """
+    grid = parameter_grid(grid or RULES[rule][1])
+    with span("backtest", rule=rule, tickers=len(tickers), grid=len(grid)) as record:
+        panel = load_panel(tickers, engine, column=column, start=start, end=end)
+        stats = sweep(panel.to_numpy(dtype=float), rule, grid, cost, workers)
+
+        params = pd.DataFrame(grid).loc[np.repeat(np.arange(len(grid)), panel.shape[1])].reset_index(drop=True)
+        summary = pd.concat([
+            params,
+            pd.DataFrame({"Ticker": np.tile(panel.columns.to_numpy(), len(grid))}),
+            pd.DataFrame(stats.reshape(-1, len(STAT_COLUMNS)), columns=STAT_COLUMNS),
+        ], axis=1)
+        summary["trades"] = summary["trades"].astype(int)
+
+        scores = pd.DataFrame(stats[:, :, STAT_COLUMNS.index("sharpe")]).median(axis=1)
+        best = grid[int(scores.idxmax())] if scores.notna().any() else grid[0]
+        record["rows"] = len(summary)
+    return {"summary": summary, "best": best, "equity": equity_curves(panel, rule, best, cost)}
@@ -0,0 +1,313 @@
+# benchmark.py
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from database_utils import create_sqlite_engine
+from data_extraction import extract_and_store_data
+from data_querying import execute_query, get_prices
+
+# Business days per synthetic year
+TRADING_DAYS = 252
+
+# Directory holding app.py; startup runs import it from a fresh interpreter
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Run in a fresh interpreter per repeat. The first times the import of app.py; the
+# second renders the app through Streamlit's test runner, which executes app.py the
+# way a freshly started server does, then switches to the Query Data page.
+IMPORT_SCRIPT = "import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)"
+RENDER_SCRIPT = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+started = time.perf_counter()
+at.run()
+first = time.perf_counter()
+at.sidebar.selectbox[0].select("Query Data").run()
+print(json.dumps({
+    "first_render": first - started,
+    "query_page": time.perf_counter() - first,
+    "error": at.exception[0].message if at.exception else None,
+}))
+"""
+
+def generate_synthetic_history(ticker, years, end="2024-12-31"):
+    """
+    Generates a deterministic daily OHLCV history shaped like yf.download output.
+    Prices follow a geometric random walk seeded from the ticker symbol.
+    """
+    rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+    dates = pd.bdate_range(end=end, periods=int(years * TRADING_DAYS), name="Date")
+    n = len(dates)
+
+    close = 20.0 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, n)))
+    open_ = close * np.exp(rng.normal(0.0, 0.005, n))
+    high = np.maximum(open_, close) * (1.0 + np.abs(rng.normal(0.0, 0.01, n)))
+    low = np.minimum(open_, close) * (1.0 - np.abs(rng.normal(0.0, 0.01, n)))
+    volume = rng.integers(100_000, 50_000_000, n)
+
+    return pd.DataFrame({
+        "Open": open_,
+        "High": high,
+        "Low": low,
+        "Close": close,
+        "Adj Close": close,
+        "Volume": volume,
+    }, index=dates)
+
+class SyntheticFetcher:
+    """
+    Fetcher that serves generated histories instead of calling Yahoo Finance.
+    """
+    def __init__(self, years):
+        self.years = years
+
+    def fetch(self, ticker, start=None):
+        df = generate_synthetic_history(ticker, self.years)
+        if start is not None:
+            df = df[df.index >= pd.Timestamp(start)]
+        return df
+
+def synthetic_tickers(count):
+    return [f"SYN{i:04d}" for i in range(count)]
+
+def time_call(func, repeats):
+    """
+    Calls func repeats times and returns timing statistics in milliseconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timing_stats(timings, repeats)
+
+def timing_stats(timings, repeats):
+    timings = sorted(timings)
+    return {
+        "min_ms": timings[0],
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))],
+        "repeats": repeats,
+    }
+
+def bench_ingestion(engine, tickers, fetcher, workers):
+    results = {}
+
+    started = time.perf_counter()
+    summary = extract_and_store_data(tickers, engine, fetcher=fetcher, incremental=False,
+                                     max_workers=workers, indicators=False, columnar_dir=None)
+    elapsed = time.perf_counter() - started
+    rows = sum(result["rows"] for result in summary)
+    results["full_load"] = {
+        "seconds": elapsed,
+        "rows": rows,
+        "rows_per_second": rows / elapsed,
+        "failed": sum(result["status"] == "failed" for result in summary),
+    }
+
+    # A refresh with nothing new measures the fixed cost of the incremental path
+    started = time.perf_counter()
+    extract_and_store_data(tickers, engine, fetcher=fetcher, max_workers=workers,
+                           indicators=False, columnar_dir=None)
+    results["incremental_refresh"] = {"seconds": time.perf_counter() - started}
+    return results
+
+def bench_queries(engine, tickers, repeats):
+    first, second = tickers[0], tickers[min(1, len(tickers) - 1)]
+    dates = execute_query(f'SELECT MIN(Date) AS first, MAX(Date) AS last FROM "{first}"', engine, use_cache=False)
+    last_date = pd.Timestamp(dates["last"].iloc[0])
+    range_start = (last_date - pd.DateOffset(years=1)).strftime('%Y-%m-%d')
+    point_date = (last_date - pd.offsets.BDay(10)).strftime('%Y-%m-%d')
+
+    queries = {
+        "point_lookup": f"SELECT * FROM \"{first}\" WHERE Date = '{point_date}'",
+        "date_range": f"SELECT * FROM \"{first}\" WHERE Date >= '{range_start}'",
+        "full_scan": f'SELECT * FROM "{first}"',
+        "aggregation": f"SELECT substr(Date, 1, 4) AS Year, AVG(Close) AS Avg_Close, SUM(Volume) AS Volume FROM \"{first}\" GROUP BY Year",
+        "cross_ticker_join": (
+            f'SELECT a.Date, a.Close AS Close_A, b.Close AS Close_B FROM "{first}" a '
+            f'JOIN "{second}" b ON a.Date = b.Date'
+        ),
+    }
+    results = {name: time_call(lambda query=query: execute_query(query, engine, use_cache=False), repeats)
+               for name, query in queries.items()}
+
+    results["get_prices_range"] = time_call(
+        lambda: get_prices(tickers[:10], engine, start=range_start, columns=["Close", "Volume"]), repeats
+    )
+    # Second identical execute_query call is served by the result cache
+    execute_query(queries["full_scan"], engine)
+    results["cached_full_scan"] = time_call(lambda: execute_query(queries["full_scan"], engine), repeats)
+    return results
+
+def bench_visualization(engine, ticker, repeats):
+    try:
+        from data_visualization import prepare_for_visualization
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    data = execute_query(f'SELECT * FROM "{ticker}"', engine, use_cache=False)
+    cases = {
+        "raw": {},
+        "weekly": {"resample": "Weekly"},
+        "monthly": {"resample": "Monthly"},
+        "downsample_1200px": {"chart_width": 1200},
+        "downsample_1200px_lttb": {"chart_width": 1200, "method": "lttb"},
+    }
+    results = {}
+    for name, options in cases.items():
+        timing = time_call(lambda options=options: prepare_for_visualization(data, **options), repeats)
+        timing["rows_in"] = len(data)
+        timing["rows_out"] = len(prepare_for_visualization(data, **options))
+        results[name] = timing
+    return results
+
+def bench_backtest(engine, tickers, repeats):
+    """
+    Times the default sma_crossover sweep over every synthetic ticker in the
+    calling process and on the shared process pool. The pool is started before
+    timing, so the parallel timings exclude worker startup.
+    """
+    from backtest import DEFAULT_WORKERS, RULES, get_pool, parameter_grid, sweep
+    from panel import load_panel
+
+    close = load_panel(tickers, engine).to_numpy(dtype=float)
+    grid = parameter_grid(RULES["sma_crossover"][1])
+    results = {"serial": time_call(lambda: sweep(close, "sma_crossover", grid, workers=1), repeats)}
+    if DEFAULT_WORKERS > 1:
+        get_pool()
+        # min_cells=0 uses the pool even for small benchmark panels
+        results["parallel"] = time_call(lambda: sweep(close, "sma_crossover", grid, min_cells=0), repeats)
+    for timing in results.values():
+        timing["cells"] = close.size * len(grid)
+    return results
+
+def bench_startup(repeats):
+    """
+    Times cold starts in fresh interpreters: importing app.py, the first render of
+    the app, and the first render of the Query Data page. Runs against an empty
+    database in a temporary directory.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [APP_DIR, os.environ.get("PYTHONPATH")])))
+    timings = {"import": [], "first_render": [], "query_page": []}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            for _ in range(repeats):
+                output = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT], cwd=tmp_dir, env=env,
+                                                 text=True, stderr=subprocess.PIPE)
+                timings["import"].append(float(output.strip().splitlines()[-1]) * 1000)
+
+                output = subprocess.check_output([sys.executable, "-c", RENDER_SCRIPT, os.path.join(APP_DIR, "app.py")],
+                                                 cwd=tmp_dir, env=env, text=True, stderr=subprocess.PIPE)
+                render = json.loads(output.strip().splitlines()[-1])
+                if render["error"]:
+                    return {"skipped": render["error"]}
+                timings["first_render"].append(render["first_render"] * 1000)
+                timings["query_page"].append(render["query_page"] * 1000)
+        except subprocess.CalledProcessError as e:
+            return {"skipped": e.stderr.strip().splitlines()[-1] if e.stderr.strip() else str(e)}
+    return {name: timing_stats(values, repeats) for name, values in timings.items()}
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def run_benchmarks(tickers=20, years=10, repeats=5, workers=8, db_path=None, startup=True):
+    """
+    Runs every benchmark against a fresh database filled with synthetic data
+    and returns the results as a JSON-serializable dict.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_sqlite_engine(db_path or os.path.join(tmp_dir, "bench.db"))
+        names = synthetic_tickers(tickers)
+        fetcher = SyntheticFetcher(years)
+
+        results = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "pandas": pd.__version__,
+                "tickers": tickers,
+                "years": years,
+                "repeats": repeats,
+                "workers": workers,
+            },
+        }
+        results["ingestion"] = bench_ingestion(engine, names, fetcher, workers)
+        results["queries"] = bench_queries(engine, names, repeats)
+        results["visualization"] = bench_visualization(engine, names[0], repeats)
+        results["backtest"] = bench_backtest(engine, names, repeats)
+        engine.dispose()
+    if startup:
+        results["startup"] = bench_startup(repeats)
+    return results
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def compare(current, previous):
+    """
+    Prints the relative change of every timing metric against a previous run.
+    """
+    current_flat, previous_flat = flatten(current), flatten(previous)
+    for key, value in current_flat.items():
+        if key.startswith("meta.") or key not in previous_flat:
+            continue
+        if not (key.endswith("_ms") or key.endswith("seconds") or key.endswith("rows_per_second")):
+            continue
+        before = previous_flat[key]
+        change = (value - before) / before * 100 if before else float("nan")
+        print(f"{key:55s} {before:12.3f} -> {value:12.3f} ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, queries, chart preparation, backtests and app startup on synthetic data.")
+    parser.add_argument("--tickers", type=int, default=20, help="Number of synthetic tickers")
+    parser.add_argument("--years", type=float, default=10, help="Years of daily history per ticker")
+    parser.add_argument("--repeats", type=int, default=5, help="Repetitions per timed query")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent downloads during ingestion")
+    parser.add_argument("--output", help="JSON results file (default: bench_results/<timestamp>.json)")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    parser.add_argument("--skip-startup", action="store_true", help="Skip the app import and first-render timings")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.tickers, args.years, args.repeats, args.workers, startup=not args.skip_startup)
+
+    output = args.output or os.path.join("bench_results", f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as out:
+        json.dump(results, out, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(results, json.load(previous))
+    else:
+        for key, value in flatten(results).items():
+            if not key.startswith("meta."):
+                print(f"{key:55s} {value:12.3f}")
+
+if __name__ == "__main__":
+    main()
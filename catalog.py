@@ -0,0 +1,244 @@
+# catalog.py
+
+import os
+import threading
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+from database_utils import CATALOG_TABLE, PRICES_TABLE, get_read_engine, table_exists, list_ticker_tables
+from query_cache import bump_data_version
+
+# Minimum seconds between checks for catalog changes made by other processes
+CATALOG_POLL_INTERVAL = 2.0
+
+CATALOG_COLUMNS = ["ticker", "storage", "rows", "first_date", "last_date", "last_ingest", "data_version", "bytes", "updated_at"]
+
+CREATE_CATALOG_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} (
+    ticker TEXT PRIMARY KEY,
+    storage TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    first_date TEXT,
+    last_date TEXT,
+    last_ingest REAL,
+    data_version INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER,
+    updated_at REAL NOT NULL
+)
+"""
+
+CREATE_CATALOG_INDEX = f"CREATE INDEX IF NOT EXISTS idx_{CATALOG_TABLE}_updated ON {CATALOG_TABLE} (updated_at)"
+
+def create_catalog_table(connection):
+    connection.execute(text(CREATE_CATALOG_TABLE))
+    connection.execute(text(CREATE_CATALOG_INDEX))
+
+def ticker_stats(connection, ticker):
+    """
+    Reads the storage kind, row count, date range and on-disk size of a stored ticker,
+    or returns None when the ticker is not stored.
+    """
+    kind = connection.execute(
+        text("SELECT type FROM sqlite_master WHERE name = :name AND type IN ('table', 'view')"), {"name": ticker}
+    ).scalar()
+    if kind == "table":
+        rows, first, last = connection.execute(text(f'SELECT COUNT(*), MIN("Date"), MAX("Date") FROM "{ticker}"')).one()
+        try:
+            # dbstat is optional in SQLite builds; the size includes the Date index
+            size = connection.execute(
+                text("SELECT SUM(pgsize) FROM dbstat WHERE name IN (:table, :index)"),
+                {"table": ticker, "index": f"idx_{ticker}_date"}
+            ).scalar()
+        except Exception:
+            size = None
+        return {"storage": "table", "rows": rows, "first_date": first, "last_date": last, "bytes": size}
+    if kind == "view":
+        # Views are compatibility views over the prices table, whose dates are epoch days
+        rows, first, last = connection.execute(
+            text(
+                f"SELECT COUNT(*), date(MIN(date) * 86400, 'unixepoch'), date(MAX(date) * 86400, 'unixepoch') "
+                f"FROM {PRICES_TABLE} WHERE ticker = :ticker"
+            ),
+            {"ticker": ticker}
+        ).one()
+        # Rows of the shared prices table have no per-ticker size
+        return {"storage": "prices", "rows": rows, "first_date": first, "last_date": last, "bytes": None}
+    return None
+
+def record_ingest(connection, ticker):
+    """
+    Refreshes the catalog row of a ticker that was just written, increments its
+    data version and returns the new row, or None if the ticker is not stored.
+    """
+    stats = ticker_stats(connection, ticker)
+    if stats is None:
+        return None
+    if not catalog_exists(connection):
+        # The first write to a database from before the catalog catalogs every stored ticker
+        rebuild_catalog_entries(connection)
+    now = time.time()
+    entry = {"ticker": ticker, **stats, "last_ingest": now, "updated_at": now}
+    entry["data_version"] = connection.execute(
+        text(
+            f"INSERT INTO {CATALOG_TABLE} (ticker, storage, rows, first_date, last_date, last_ingest, data_version, bytes, updated_at) "
+            f"VALUES (:ticker, :storage, :rows, :first_date, :last_date, :last_ingest, 1, :bytes, :updated_at) "
+            f"ON CONFLICT (ticker) DO UPDATE SET storage = excluded.storage, rows = excluded.rows, "
+            f"first_date = excluded.first_date, last_date = excluded.last_date, last_ingest = excluded.last_ingest, "
+            f"data_version = data_version + 1, bytes = excluded.bytes, updated_at = excluded.updated_at "
+            f"RETURNING data_version"
+        ),
+        entry
+    ).scalar_one()
+    catalog = _catalogs.get(catalog_key(connection.engine))
+    if catalog is not None:
+        catalog.update(entry)
+    return entry
+
+def catalog_exists(connection):
+    return connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": CATALOG_TABLE}
+    ).first() is not None
+
+def rebuild_catalog_entries(connection):
+    """
+    Recreates the catalog rows from the stored tickers, keeping their last ingest
+    times and moving their data versions forward.
+    """
+    now = time.time()
+    create_catalog_table(connection)
+    previous = {
+        row.ticker: row for row in connection.execute(text(f"SELECT ticker, last_ingest, data_version FROM {CATALOG_TABLE}"))
+    }
+    connection.execute(text(f"DELETE FROM {CATALOG_TABLE}"))
+    for ticker in list_ticker_tables(connection, include_views=True):
+        try:
+            stats = ticker_stats(connection, ticker)
+        except Exception:
+            # Tables without a Date column are not ticker histories
+            continue
+        if stats is None:
+            continue
+        old = previous.get(ticker)
+        connection.execute(
+            text(
+                f"INSERT INTO {CATALOG_TABLE} (ticker, storage, rows, first_date, last_date, last_ingest, data_version, bytes, updated_at) "
+                f"VALUES (:ticker, :storage, :rows, :first_date, :last_date, :last_ingest, :data_version, :bytes, :updated_at)"
+            ),
+            {
+                "ticker": ticker, **stats,
+                "last_ingest": old.last_ingest if old else None,
+                "data_version": old.data_version + 1 if old else 1,
+                "updated_at": now,
+            }
+        )
+
+def rebuild_catalog(engine):
+    """
+    Rebuilds the catalog from the schema, e.g. after tickers moved between storage layouts,
+    and reloads this process's copy.
+    """
+    with engine.begin() as connection:
+        rebuild_catalog_entries(connection)
+    catalog = _catalogs.get(catalog_key(engine))
+    if catalog is not None:
+        catalog.reload()
+
+class TickerCatalog:
+    """
+    In-memory copy of the catalog table. Loaded once per process and kept current
+    by the ingestion writer; rows changed by other processes are picked up by
+    refresh(), which also invalidates cached query results for those tickers.
+    """
+    def __init__(self, engine, poll_interval=CATALOG_POLL_INTERVAL):
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self._entries = {}
+        self._seen = 0.0
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not table_exists(self.engine, CATALOG_TABLE, include_views=False):
+            with self.engine.begin() as connection:
+                rebuild_catalog_entries(connection)
+        self._read_changes()
+
+    def reload(self):
+        with self._lock:
+            self._entries = {}
+            self._seen = 0.0
+        self._read_changes()
+
+    def _read_changes(self):
+        with get_read_engine(self.engine).connect() as connection:
+            rows = connection.execute(
+                text(f"SELECT {', '.join(CATALOG_COLUMNS)} FROM {CATALOG_TABLE} WHERE updated_at > :seen"),
+                {"seen": self._seen}
+            ).mappings().fetchall()
+        changed = []
+        with self._lock:
+            for row in rows:
+                old = self._entries.get(row["ticker"])
+                if old is not None and old["data_version"] != row["data_version"]:
+                    changed.append(row["ticker"])
+                self._entries[row["ticker"]] = dict(row)
+                self._seen = max(self._seen, row["updated_at"])
+            self._checked = time.monotonic()
+        if changed:
+            bump_data_version(*changed, PRICES_TABLE)
+
+    def refresh(self, force=False):
+        """
+        Picks up catalog rows written since the last check, at most once per poll interval.
+        """
+        if force or time.monotonic() - self._checked >= self.poll_interval:
+            self._read_changes()
+
+    def update(self, entry):
+        """
+        Stores an entry written by this process so refresh() does not treat it as an external change.
+        """
+        with self._lock:
+            self._entries[entry["ticker"]] = dict(entry)
+
+    def exists(self, ticker):
+        self.refresh()
+        return ticker.upper() in self._entries
+
+    def get(self, ticker):
+        self.refresh()
+        return self._entries.get(ticker.upper())
+
+    def tickers(self):
+        self.refresh()
+        with self._lock:
+            return sorted(self._entries)
+
+    def frame(self):
+        """
+        Returns the catalog as a DataFrame, one row per ticker.
+        """
+        self.refresh()
+        with self._lock:
+            df = pd.DataFrame.from_records(list(self._entries.values()), columns=CATALOG_COLUMNS)
+        df["last_ingest"] = pd.to_datetime(df["last_ingest"], unit="s")
+        return df.drop(columns="updated_at").sort_values("ticker").reset_index(drop=True)
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def catalog_key(engine):
+    return os.path.abspath(engine.url.database or "")
+
+def get_catalog(engine):
+    """
+    Returns the process-wide catalog for the engine's database, loading it on first use.
+    """
+    key = catalog_key(engine)
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = TickerCatalog(engine)
+        return _catalogs[key]
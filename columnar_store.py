@@ -0,0 +1,205 @@
+# columnar_store.py
+#
+# Optional columnar mirror of stocks.db. Requires pyarrow, and duckdb for the
+# analytical query backend; both are imported only when the mirror is used.
+
+import argparse
+import glob
+import os
+import threading
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+from database_utils import create_sqlite_engine, list_ticker_tables
+from query_guard import QueryInterrupted
+
+# Directory holding the mirror; ingestion only writes it when this is set
+DEFAULT_COLUMNAR_DIR = os.environ.get("STOCKS_COLUMNAR_DIR")
+
+# Seconds between checks of a running DuckDB query's budget and cancellation
+INTERRUPT_POLL_SECONDS = 0.1
+
+# Column names used by the cross-ticker prices view, matching the SQLite prices table
+LONG_COLUMN_NAMES = {
+    "Date": "date",
+    "Open": "open",
+    "High": "high",
+    "Low": "low",
+    "Close": "close",
+    "Adj_Close": "adj_close",
+    "Volume": "volume",
+}
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+    except ImportError as e:
+        raise ImportError("The columnar mirror requires pyarrow (pip install pyarrow).") from e
+    return pyarrow
+
+def import_duckdb():
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError("The analytical query backend requires duckdb (pip install duckdb).") from e
+    return duckdb
+
+def ticker_path(ticker, directory):
+    return os.path.join(directory, f"{ticker.upper()}.arrow")
+
+def list_mirrored_tickers(directory):
+    """
+    Returns the tickers that have a file in the mirror directory.
+    """
+    paths = glob.glob(os.path.join(directory, "*.arrow"))
+    return sorted(os.path.splitext(os.path.basename(path))[0] for path in paths)
+
+def read_ticker_table(ticker, directory):
+    """
+    Memory-maps the Arrow IPC file of a ticker and returns it as a pyarrow Table.
+    The column buffers point into the mapped file rather than being copied.
+    """
+    pa = import_pyarrow()
+    with pa.memory_map(ticker_path(ticker, directory), "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+def read_ticker(ticker, directory, columns=None):
+    """
+    Returns the mirrored history of a ticker as a DataFrame indexed by Date.
+    Numeric columns without nulls are converted without copying.
+    """
+    table = read_ticker_table(ticker, directory)
+    if columns is not None:
+        table = table.select(["Date"] + [col for col in columns if col != "Date"])
+    df = table.to_pandas(split_blocks=True)
+    return df.set_index("Date")
+
+def write_ticker_table(ticker, table, directory):
+    """
+    Writes a pyarrow Table for the ticker, replacing the previous file atomically.
+    """
+    pa = import_pyarrow()
+    os.makedirs(directory, exist_ok=True)
+    path = ticker_path(ticker, directory)
+    tmp_path = f"{path}.tmp"
+    # Uncompressed IPC files can be memory-mapped and read without decoding
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def frame_to_table(df):
+    """
+    Converts a frame in the stored layout (ISO Date strings) to a pyarrow Table.
+    """
+    pa = import_pyarrow()
+    df = df.copy()
+    df["Date"] = pd.to_datetime(df["Date"])
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def mirror_ticker(ticker, df, directory):
+    """
+    Brings the mirror of a ticker up to date with rows that were just written to the database.
+    Existing mirrored rows dated before the first row of df are kept, so appends only add new rows.
+    """
+    pa = import_pyarrow()
+    if df.empty:
+        return 0
+
+    table = frame_to_table(df)
+    path = ticker_path(ticker, directory)
+    if os.path.exists(path):
+        existing = read_ticker_table(ticker, directory)
+        first_date = pd.Timestamp(df["Date"].min())
+        kept = existing.filter(pa.compute.less(existing["Date"], pa.scalar(first_date, existing.schema.field("Date").type)))
+        if kept.num_rows:
+            table = pa.concat_tables([kept, table.cast(kept.schema)])
+    write_ticker_table(ticker, table, directory)
+    return table.num_rows
+
+def export_database(engine, directory, tickers=None):
+    """
+    Writes the full stored history of every ticker (or the given ones) to the mirror.
+    """
+    with engine.connect() as connection:
+        if tickers is None:
+            tickers = list_ticker_tables(connection, include_views=True)
+        for ticker in tickers:
+            df = pd.read_sql_query(text(f'SELECT * FROM "{ticker}" ORDER BY "Date"'), connection)
+            if "Date" not in df.columns:
+                continue
+            write_ticker_table(ticker, frame_to_table(df), directory)
+            print(f"Mirrored {len(df)} rows for {ticker}.")
+
+def lock_down(connection):
+    """
+    Cuts a DuckDB connection off from files, the network and extensions, so
+    COPY ... TO, read_csv('/etc/...') or ATTACH fail, and locks its settings
+    so the query cannot turn access back on.
+    """
+    connection.execute("SET enable_external_access = false")
+    connection.execute("SET lock_configuration = true")
+
+def execute_analytical_query(query, directory, timeout=None, cancel=None):
+    """
+    Runs the query with DuckDB over the memory-mapped mirror.
+    Every ticker is available as a table of the same name, and all of them
+    together as a prices view with lowercase columns and a ticker column.
+    The query can only read what is registered, and is interrupted after
+    `timeout` seconds or once `cancel` is set, raising QueryInterrupted.
+    """
+    duckdb = import_duckdb()
+    connection = duckdb.connect()
+    deadline = time.monotonic() + timeout if timeout else None
+    finished = threading.Event()
+    stopped = {}
+
+    def watch():
+        while not finished.wait(INTERRUPT_POLL_SECONDS):
+            if cancel is not None and cancel.is_set():
+                stopped["reason"] = "Query cancelled."
+            elif deadline is not None and time.monotonic() > deadline:
+                stopped["reason"] = f"Query stopped after exceeding its {timeout:g} second budget."
+            if stopped:
+                connection.interrupt()
+                return
+
+    try:
+        selects = []
+        for ticker in list_mirrored_tickers(directory):
+            table = read_ticker_table(ticker, directory)
+            connection.register(ticker, table)
+            columns = ", ".join(f'"{col}" AS {LONG_COLUMN_NAMES.get(col, col.lower())}' for col in table.column_names)
+            selects.append(f"SELECT '{ticker}' AS ticker, {columns} FROM \"{ticker}\"")
+        if selects:
+            connection.execute(f"CREATE VIEW prices AS {' UNION ALL BY NAME '.join(selects)}")
+        lock_down(connection)
+
+        watcher = threading.Thread(target=watch, daemon=True)
+        watcher.start()
+        try:
+            return connection.execute(query).df()
+        except duckdb.InterruptException as e:
+            raise QueryInterrupted(stopped.get("reason", "Query interrupted.")) from e
+        finally:
+            finished.set()
+            watcher.join()
+    finally:
+        connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Export stocks.db to the columnar mirror.")
+    parser.add_argument("--db", default="stocks.db", help="Path to the SQLite database")
+    parser.add_argument("--dir", default=DEFAULT_COLUMNAR_DIR or "columnar", help="Mirror directory")
+    parser.add_argument("tickers", nargs="*", help="Tickers to export (default: all)")
+    args = parser.parse_args()
+
+    engine = create_sqlite_engine(args.db)
+    export_database(engine, args.dir, [ticker.upper() for ticker in args.tickers] or None)
+
+if __name__ == "__main__":
+    main()
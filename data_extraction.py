@@ -1,28 +1,328 @@
 # data_extraction.py
 
-import yfinance as yf
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
+import numpy as np
+from sqlalchemy import text
+
+from database_utils import PRICES_TABLE, table_exists, create_date_index, get_read_engine, bulk_replace_table
+from catalog import record_ingest
+from columnar_store import DEFAULT_COLUMNAR_DIR, mirror_ticker
+from fetchers import YahooFetcher, YAHOO_LOOKBACK_DAYS
+from indicators import update_indicators
+from instrumentation import span, increment
+from intraday import INTRADAY_INTERVALS, prepare_intraday_data, last_bar, store_intraday_bars, apply_retention
+from price_store import stores_in_prices_table, replace_ticker_prices, upsert_ticker_prices
+from query_cache import bump_data_version
+
+# Number of already stored rows that are downloaded again on an incremental
+# refresh, so that restated history (splits, dividends) can be detected
+OVERLAP_ROWS = 5
+
+# Relative tolerance used when comparing stored and re-downloaded prices
+OVERLAP_TOLERANCE = 1e-6
+
+# Number of tickers downloaded concurrently
+DEFAULT_WORKERS = 8
+
+# Bar size of the per-ticker tables and the prices table; other sizes go to intraday partitions
+DAILY_INTERVAL = "1d"
+
+# Download attempts per ticker and the base delay (seconds) between them
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
 
-def extract_and_store_data(tickers, engine):
+class FetchError(Exception):
     """
-    Downloads stock data for the given tickers and stores it in an SQLite database.
+    Raised when a ticker could not be downloaded within the allowed attempts.
     """
-    for ticker in tickers:
-        try:
-            print(f"Downloading data for {ticker}...")
-            df = yf.download(ticker, period="max")
-            df.reset_index(inplace=True)  # Reset index to make 'Date' a column
+    def __init__(self, ticker, attempts, cause):
+        super().__init__(f"Download of {ticker} failed after {attempts} attempts: {cause}")
+        self.attempts = attempts
+
+def prepare_downloaded_data(df):
+    """
+    Turns a frame returned by a fetcher into the layout stored in the database.
+    """
+    # Newer yfinance versions return (Price, Ticker) column pairs even for one ticker
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = df.columns.get_level_values(0)
+
+    df = df.reset_index()  # Reset index to make 'Date' a column
+
+    # Format the Date column to YYYY-MM-DD
+    df['Date'] = pd.to_datetime(df['Date']).dt.strftime('%Y-%m-%d')
 
-            # Format the Date column to YYYY-MM-DD
-            df['Date'] = pd.to_datetime(df['Date']).dt.strftime('%Y-%m-%d')
+    # Rename columns to ensure consistent names
+    df.columns = [col.replace(" ", "_") for col in df.columns]
+    return df
 
-            # Rename columns to ensure consistent names
-            df.columns = [col.replace(" ", "_") for col in df.columns]
+def read_overlap_rows(ticker, engine, rows=OVERLAP_ROWS):
+    """
+    Returns the most recent stored rows for the given ticker, oldest first.
+    """
+    with engine.connect() as connection:
+        stored = pd.read_sql_query(
+            text(f'SELECT * FROM "{ticker}" ORDER BY Date DESC LIMIT :rows'),
+            connection,
+            params={"rows": rows}
+        )
+    return stored.iloc[::-1].reset_index(drop=True)
+
+def overlap_matches(stored, fresh):
+    """
+    Checks that freshly downloaded rows agree with the stored rows for the same dates.
+    """
+    # A column the stored layout does not have means the source format changed
+    if not set(fresh.columns) <= set(stored.columns):
+        return False
+
+    merged = stored.merge(fresh, on="Date", how="left", suffixes=("_stored", "_fresh"))
+    for col in fresh.columns:
+        if col == "Date":
+            continue
+        stored_values = pd.to_numeric(merged[f"{col}_stored"], errors="coerce").to_numpy(dtype=float)
+        fresh_values = pd.to_numeric(merged[f"{col}_fresh"], errors="coerce").to_numpy(dtype=float)
+        if not np.allclose(stored_values, fresh_values, rtol=OVERLAP_TOLERANCE, equal_nan=True):
+            return False
+    return True
+
+def store_full_history(ticker, df, engine):
+    """
+    Replaces the stored history of the given ticker with df.
+    Per-ticker tables are bulk loaded into a staging table and swapped in atomically.
+    """
+    if stores_in_prices_table(engine, ticker):
+        return replace_ticker_prices(engine, ticker, df)
+    with engine.begin() as connection:
+        return bulk_replace_table(connection, ticker, df)
 
-            print(f"Data for {ticker} downloaded successfully. Storing in database...")
+def append_new_rows(ticker, df, last_date, engine):
+    """
+    Upserts the rows of df dated after last_date into the ticker table.
+    """
+    new_rows = df[df['Date'] > last_date]
+    if new_rows.empty:
+        return 0
 
-            # Store data in SQLite database
-            df.to_sql(ticker.upper(), con=engine, if_exists="replace", index=False)
-            print(f"Data for {ticker} stored successfully.")
+    if stores_in_prices_table(engine, ticker):
+        return upsert_ticker_prices(engine, ticker, new_rows)
+
+    with engine.begin() as connection:
+        # Clear any rows for the same dates before inserting so reruns stay idempotent
+        connection.execute(text(f'DELETE FROM "{ticker}" WHERE Date > :last_date'), {"last_date": last_date})
+        new_rows.to_sql(ticker, con=connection, if_exists="append", index=False)
+        create_date_index(connection, ticker)
+    return len(new_rows)
+
+def fetch_with_retry(fetcher, ticker, start=None, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                     prepare=prepare_downloaded_data):
+    """
+    Fetches a ticker, retrying with exponential backoff.
+    Returns the frame converted by prepare and the number of attempts made.
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            with span("download", ticker=ticker, attempt=attempt):
+                raw = fetcher.fetch(ticker, start=start)
+            # yf.download reports most failures as an empty frame rather than raising
+            if raw is None or raw.empty:
+                raise ValueError(f"No data returned for {ticker}")
+            with span("parse", ticker=ticker, rows=len(raw)):
+                df = prepare(raw)
+            increment("rows_downloaded", len(df))
+            return df, attempt
         except Exception as e:
-            print(f"Error while processing {ticker}: {e}")
\ No newline at end of file
+            if attempt == retries:
+                raise FetchError(ticker, attempt, e) from e
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+def plan_ticker(ticker, engine, fetcher, incremental, retries, backoff, interval=DAILY_INTERVAL):
+    """
+    Downloads the data needed for one ticker and decides how it should be written.
+    Runs on a download worker thread with a read-only engine; the returned job is
+    applied by the writer.
+    """
+    job = {"ticker": ticker, "interval": interval, "mode": "replace", "data": None, "last_date": None, "attempts": 0, "error": None}
+    started = time.perf_counter()
+    try:
+        if interval != DAILY_INTERVAL:
+            plan_intraday(job, engine, fetcher, incremental, retries, backoff)
+            return job
+
+        if incremental and table_exists(engine, ticker):
+            stored = read_overlap_rows(ticker, engine)
+            if not stored.empty:
+                df, attempts = fetch_with_retry(fetcher, ticker, stored['Date'].iloc[0], retries, backoff)
+                job["attempts"] += attempts
+                if overlap_matches(stored, df):
+                    job.update(mode="append", data=df, last_date=stored['Date'].iloc[-1])
+                    return job
+                # Stored history was restated, so fall through to a full reload
+                job["mode"] = "reload"
+
+        df, attempts = fetch_with_retry(fetcher, ticker, None, retries, backoff)
+        job["attempts"] += attempts
+        job["data"] = df
+    except FetchError as e:
+        job["attempts"] += e.attempts
+        job["error"] = str(e)
+    except Exception as e:
+        job["error"] = str(e)
+    finally:
+        job["download_seconds"] = time.perf_counter() - started
+    return job
+
+def plan_intraday(job, engine, fetcher, incremental, retries, backoff):
+    """
+    Downloads intraday bars for a job: from the day of the last stored bar when
+    that is within the range Yahoo serves, otherwise everything it serves.
+    Stored bars are kept either way, so the writer only ever upserts.
+    """
+    ticker, interval = job["ticker"], job["interval"]
+    last = last_bar(engine, ticker, interval) if incremental else None
+    start = None
+    if last is not None:
+        job["mode"] = "append"
+        oldest = pd.Timestamp.now(tz="UTC").tz_localize(None) - pd.Timedelta(days=YAHOO_LOOKBACK_DAYS[interval])
+        if pd.Timestamp(last) >= oldest:
+            start = last[:10]
+    df, attempts = fetch_with_retry(fetcher, ticker, start, retries, backoff, prepare=prepare_intraday_data)
+    job["attempts"] += attempts
+    job["data"] = df
+
+def write_jobs(jobs, engine, results, columnar_dir=None, indicators=True, on_result=None):
+    """
+    Drains download jobs from the queue and writes them to the database,
+    and to the columnar mirror when a mirror directory is given.
+    Materialized indicators are brought up to date after each daily write,
+    intraday writes are followed by the retention roll-up, and on_result is
+    called with each ticker's summary as soon as it is known.
+    Runs on the single writer thread so SQLite only ever sees one writer.
+    """
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        result = {
+            "ticker": job["ticker"],
+            "status": "failed",
+            "rows": 0,
+            "attempts": job["attempts"],
+            "seconds": job["download_seconds"],
+            "error": job["error"],
+            "rows_per_second": None,
+            "bytes": 0,
+        }
+        daily = job["interval"] == DAILY_INTERVAL
+        if job["error"] is None:
+            started = time.perf_counter()
+            try:
+                with span("write", ticker=job["ticker"], mode=job["mode"]) as record:
+                    if not daily:
+                        result["rows"] = store_intraday_bars(engine, job["ticker"], job["interval"], job["data"])
+                        result["status"] = "appended" if job["mode"] == "append" else "replaced"
+                    elif job["mode"] == "append":
+                        result["rows"] = append_new_rows(job["ticker"], job["data"], job["last_date"], engine)
+                        result["status"] = "appended"
+                    else:
+                        result["rows"] = store_full_history(job["ticker"], job["data"], engine)
+                        result["status"] = "reloaded" if job["mode"] == "reload" else "replaced"
+                    record["rows"] = result["rows"]
+                result["rows_per_second"] = result["rows"] / max(time.perf_counter() - started, 1e-9)
+                # In-memory size of the written rows, as an estimate of the bytes stored
+                row_bytes = job["data"].memory_usage(index=False, deep=True).sum() / max(len(job["data"]), 1)
+                result["bytes"] = int(row_bytes * result["rows"])
+                increment("rows_written", result["rows"])
+                increment("bytes_written", result["bytes"])
+                # Invalidate cached query results that read this ticker
+                if daily:
+                    bump_data_version(job["ticker"], PRICES_TABLE)
+            except Exception as e:
+                result["error"] = str(e)
+
+            if not daily and result["status"] != "failed":
+                try:
+                    with span("retention", ticker=job["ticker"]):
+                        apply_retention(engine, job["ticker"])
+                except Exception as e:
+                    result["error"] = f"Retention not applied: {e}"
+
+            if daily and result["status"] != "failed":
+                try:
+                    with engine.begin() as connection:
+                        record_ingest(connection, job["ticker"])
+                except Exception as e:
+                    result["error"] = f"Catalog not updated: {e}"
+
+            if daily and indicators and result["status"] != "failed":
+                try:
+                    # Appended bars continue from the stored indicator state; anything else recomputes
+                    with span("indicators", ticker=job["ticker"]):
+                        update_indicators(job["ticker"], engine, full=job["mode"] != "append")
+                except Exception as e:
+                    result["error"] = f"Indicators not updated: {e}"
+
+            if daily and columnar_dir and result["status"] != "failed":
+                try:
+                    with span("mirror", ticker=job["ticker"]):
+                        mirror_ticker(job["ticker"], job["data"], columnar_dir)
+                except Exception as e:
+                    result["error"] = f"Columnar mirror not updated: {e}"
+            result["seconds"] += time.perf_counter() - started
+        results.append(result)
+        increment("tickers_failed" if result["status"] == "failed" else "tickers_stored")
+
+        if on_result is not None:
+            try:
+                on_result(result)
+            except Exception as e:
+                print(f"Error while reporting progress for {result['ticker']}: {e}")
+
+def extract_and_store_data(tickers, engine, incremental=True, fetcher=None,
+                           max_workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                           columnar_dir=DEFAULT_COLUMNAR_DIR, indicators=True, on_result=None, interval=DAILY_INTERVAL):
+    """
+    Downloads stock data for the given tickers and stores it in an SQLite database.
+    Tickers are downloaded concurrently by a pool of workers and written by a
+    single writer thread. When incremental is True, tickers that are already
+    stored only fetch the missing range instead of the full history.
+    When columnar_dir is set, written tickers are also mirrored there as Arrow files,
+    and when indicators is True their materialized indicators are updated.
+    on_result, if given, is called on the writer thread with each ticker's summary.
+    With an intraday interval (e.g. "5m") bars of that size are stored in monthly
+    partitions instead, and older months are rolled up per RETENTION_POLICIES.
+    Returns one summary dict per ticker, in input order.
+    """
+    if interval != DAILY_INTERVAL and interval not in INTRADAY_INTERVALS:
+        raise ValueError(f"Unsupported interval {interval!r}; use {DAILY_INTERVAL} or one of {', '.join(INTRADAY_INTERVALS)}.")
+    fetcher = fetcher or YahooFetcher(interval)
+    tickers = list(dict.fromkeys(ticker.strip().upper() for ticker in tickers if ticker.strip()))
+
+    # Bounded so downloads cannot run arbitrarily far ahead of the writer
+    jobs = queue.Queue(maxsize=max_workers * 2)
+    results = []
+    writer = threading.Thread(target=write_jobs, args=(jobs, engine, results, columnar_dir, indicators, on_result), daemon=True)
+    writer.start()
+
+    # Download workers only read, so they use the shared read-only pool and never
+    # wait for the writer's connection
+    reader = get_read_engine(engine)
+
+    def download(ticker):
+        jobs.put(plan_ticker(ticker, reader, fetcher, incremental, retries, backoff, interval))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(download, tickers))
+    finally:
+        jobs.put(None)
+        writer.join()
+
+    order = {ticker: i for i, ticker in enumerate(tickers)}
+    return sorted(results, key=lambda result: order[result["ticker"]])
@@ -4,30 +4,272 @@ from sqlalchemy import text
 import pandas as pd
 import re
 
-def execute_query(query, engine):
+from database_utils import PRICES_TABLE, table_exists, get_read_engine
+from price_store import EPOCH_JULIAN_DAY, PRICE_COLUMNS, uses_prices_table, uses_compact_encoding, read_compact_prices, to_epoch_days, from_epoch_days
+from query_cache import STRING_LITERAL_PATTERN, query_cache, make_cache_key
+from columnar_store import DEFAULT_COLUMNAR_DIR, execute_analytical_query
+from instrumentation import span, increment
+from query_guard import guarded_connection
+from intraday import expand_intraday_query
+
+# Rows shown per page in the Query Data page
+DEFAULT_PAGE_SIZE = 1000
+
+# Rows fetched per round trip when streaming a result
+DEFAULT_CHUNK_SIZE = 10000
+
+# Innermost parenthesised expression, removed repeatedly to leave a statement's top level
+PARENTHESES_PATTERN = re.compile(r"\([^()]*\)")
+
+def format_date_column(dates):
+    """
+    Returns the Date column formatted as YYYY-MM-DD, parsing only when it is not already in that form.
+    """
+    if dates.dtype == object or pd.api.types.is_string_dtype(dates):
+        # Dates stored by the ingestion path are already ISO strings
+        if (dates.str.len() == 10).all():
+            return dates
+    return pd.to_datetime(dates).dt.strftime('%Y-%m-%d')
+
+def tidy_result(result):
+    """
+    Cleans up column names and the Date column of a query result.
+    """
+    # Clean up column names - remove table name prefix or tuple formatting
+    result.columns = [col.split('.')[-1] if isinstance(col, str) else col[0] for col in result.columns]
+
+    # Format the Date columns, by position since a join may return more than one
+    for i, col in enumerate(result.columns):
+        if col == 'Date':
+            result.isetitem(i, format_date_column(result.iloc[:, i]))
+    return result
+
+def execute_query(query, engine, use_cache=True, backend="sqlite", columnar_dir=DEFAULT_COLUMNAR_DIR,
+                  timeout=None, cancel=None):
     """
     Executes the given SQL query on the SQLite database and returns the result as a DataFrame.
+    With backend="columnar" the query runs in DuckDB over the columnar mirror instead,
+    which suits aggregations and full-history scans.
+    Queries may only read, and are stopped after `timeout` seconds or once the
+    `cancel` event is set. Intraday series are queried by name, e.g. "AAPL@5m",
+    and read only the monthly partitions their Datetime filters can match.
+    Results are served from the process-wide query cache until a table they read is rewritten.
     """
     try:
-        print(f"Executing query: {query}")
-        with engine.connect() as connection:
-            result = pd.read_sql_query(text(query), connection)
+        with span("query", query=query, backend=backend) as record:
+            if use_cache:
+                cache_key = make_cache_key(query, engine) + (backend,)
+                cached = query_cache.get(cache_key)
+                if cached is not None:
+                    print(f"Serving cached result for query: {query}")
+                    record.update(cached=True, rows=len(cached))
+                    increment("query_cache_hits")
+                    return cached
 
-            # Clean up column names - remove table name prefix or tuple formatting
-            result.columns = [col.split('.')[-1] if isinstance(col, str) else col[0] for col in result.columns]
+            print(f"Executing query: {query}")
+            if backend == "columnar":
+                if not columnar_dir:
+                    raise ValueError("No columnar mirror configured (set STOCKS_COLUMNAR_DIR).")
+                with span("sql_execute"):
+                    result = execute_analytical_query(query, columnar_dir, timeout, cancel)
+            else:
+                with get_read_engine(engine).connect() as connection:
+                    with span("sql_execute"), guarded_connection(connection, timeout, cancel):
+                        cursor = connection.execute(text(expand_intraday_query(query, connection)))
+                        rows = cursor.fetchall()
+                    with span("dataframe_build"):
+                        result = pd.DataFrame.from_records(rows, columns=list(cursor.keys()), coerce_float=True)
+            with span("date_format"):
+                result = tidy_result(result)
 
-            # Format the Date column if it exists
-            if 'Date' in result.columns:
-                result['Date'] = pd.to_datetime(result['Date']).dt.strftime('%Y-%m-%d')
-
-        print("Query executed successfully.")
-        return result
+            print("Query executed successfully.")
+            record.update(cached=False, rows=len(result))
+            increment("queries_executed")
+            increment("query_rows", len(result))
+            if use_cache:
+                query_cache.put(cache_key, result)
+            return result
     except Exception as e:
         print(f"Error executing query: {e}")
+        increment("query_errors")
         return f"Error executing query: {e}"
 
+def is_pageable(query):
+    """
+    Returns True if the query can be wrapped in a LIMIT/OFFSET subquery.
+    """
+    return re.match(r"\s*(SELECT|WITH)\b", query, re.IGNORECASE) is not None
+
+def has_limit(query):
+    """
+    Returns True if the statement itself, rather than one of its subqueries, has a LIMIT clause.
+    """
+    query = STRING_LITERAL_PATTERN.sub("''", query)
+    while PARENTHESES_PATTERN.search(query):
+        query = PARENTHESES_PATTERN.sub(" ", query)
+    return re.search(r"\bLIMIT\b", query, re.IGNORECASE) is not None
+
+def execute_query_page(query, engine, offset=0, limit=DEFAULT_PAGE_SIZE, backend="sqlite", timeout=None, cancel=None):
+    """
+    Executes the query and returns at most `limit` rows starting at `offset`,
+    together with a flag telling whether more rows are available.
+    The page's LIMIT and OFFSET are appended to the statement itself, so its
+    columns keep the names the query gives them. Queries that cannot be paged,
+    or that set their own LIMIT, are executed in full.
+    """
+    if not is_pageable(query) or has_limit(query):
+        return execute_query(query, engine, backend=backend, timeout=timeout, cancel=cancel), False
+
+    # Fetch one extra row to find out whether another page exists; the newline ends a trailing comment
+    paged = f"{query.strip().rstrip(';')}\nLIMIT {int(limit) + 1} OFFSET {int(offset)}"
+    result = execute_query(paged, engine, backend=backend, timeout=timeout, cancel=cancel)
+    if not isinstance(result, pd.DataFrame):
+        return result, False
+    return result.iloc[:limit], len(result) > limit
+
+def iter_query(query, engine, chunk_size=DEFAULT_CHUNK_SIZE, timeout=None, cancel=None):
+    """
+    Executes the query and yields the result as DataFrames of at most chunk_size rows,
+    so that the full result is never held in memory at once. Like execute_query,
+    the query may only read and is stopped after `timeout` seconds or once `cancel` is set.
+    """
+    with get_read_engine(engine).connect() as connection:
+        with guarded_connection(connection, timeout, cancel):
+            result = connection.execution_options(stream_results=True).execute(text(expand_intraday_query(query, connection)))
+            columns = list(result.keys())
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield tidy_result(pd.DataFrame.from_records(rows, columns=columns, coerce_float=True))
+
+def get_prices(tickers, engine, start=None, end=None, columns=None):
+    """
+    Returns stored prices for the given tickers between start and end (inclusive).
+    The result is indexed by a datetime64 Date index; when a list of tickers is
+    given a Ticker column identifies the rows of each ticker.
+    """
+    engine = get_read_engine(engine)
+    single = isinstance(tickers, str)
+    tickers = [tickers.upper()] if single else [ticker.upper() for ticker in tickers]
+    columns = list(columns) if columns else [col for col in PRICE_COLUMNS if col != "Date"]
+
+    unknown = [col for col in columns if col not in PRICE_COLUMNS or col == "Date"]
+    if unknown:
+        raise ValueError(f"Unknown price columns: {', '.join(unknown)}")
+
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    long_format = uses_prices_table(engine)
+    frames = []
+    long_tickers = []
+    for ticker in tickers:
+        # Tickers that still have their own table are read from it, the rest from the prices table
+        if table_exists(engine, ticker, include_views=False):
+            frames.append(read_ticker_table_range(ticker, engine, start, end, columns))
+        elif long_format:
+            long_tickers.append(ticker)
+    if long_tickers:
+        frames.append(read_prices_table_range(long_tickers, engine, start, end, columns))
+
+    if not frames:
+        result = pd.DataFrame(columns=["Ticker"] + columns, index=pd.DatetimeIndex([], name="Date"))
+    else:
+        result = pd.concat(frames)
+        result.sort_values(["Ticker", "Date"], inplace=True, kind="stable")
+
+    if single:
+        result = result.drop(columns="Ticker")
+    return result
+
+def read_prices_table_range(tickers, engine, start, end, columns):
+    """
+    Reads a date range for several tickers from the prices table with one (ticker, date) index seek per ticker.
+    """
+    if uses_compact_encoding(engine):
+        start_day = int(to_epoch_days(pd.Series([start])).iloc[0]) if start is not None else None
+        end_day = int(to_epoch_days(pd.Series([end])).iloc[0]) if end is not None else None
+        with engine.connect() as connection:
+            df = read_compact_prices(connection, tickers, start_day, end_day, columns)
+        df.index = from_epoch_days(df.pop("Date")).rename("Date")
+        return df
+
+    params = {f"t{i}": ticker for i, ticker in enumerate(tickers)}
+    conditions = [f"ticker IN ({', '.join(':' + name for name in params)})"]
+    if start is not None:
+        conditions.append("date >= :start")
+        params["start"] = int(to_epoch_days(pd.Series([start])).iloc[0])
+    if end is not None:
+        conditions.append("date <= :end")
+        params["end"] = int(to_epoch_days(pd.Series([end])).iloc[0])
+
+    selected = ", ".join(f'{PRICE_COLUMNS[col]} AS "{col}"' for col in columns)
+    query = (
+        f'SELECT ticker AS "Ticker", date AS "Date", {selected} FROM {PRICES_TABLE} '
+        f"WHERE {' AND '.join(conditions)} ORDER BY ticker, date"
+    )
+    with engine.connect() as connection:
+        df = pd.read_sql_query(text(query), connection, params=params)
+    df.index = from_epoch_days(df.pop("Date")).rename("Date")
+    return df
+
+def window_start(ticker, engine, end, rows):
+    """
+    Returns the date `rows` bars back from end (inclusive) for a ticker, or its first
+    date when it has fewer bars, or None when it has none. Seeks backwards through
+    the Date index of the ticker's table or the prices table's (ticker, date) key,
+    so the cost depends on `rows` and not on the length of the history.
+    """
+    engine = get_read_engine(engine)
+    ticker = ticker.upper()
+    end = pd.Timestamp(end)
+    if table_exists(engine, ticker, include_views=False):
+        query = f'SELECT MIN(d) FROM (SELECT "Date" AS d FROM "{ticker}" WHERE "Date" <= :end ORDER BY "Date" DESC LIMIT :rows)'
+        params = {"end": end.strftime('%Y-%m-%d'), "rows": rows}
+    elif uses_prices_table(engine):
+        query = (
+            f"SELECT MIN(d) FROM (SELECT date AS d FROM {PRICES_TABLE} "
+            f"WHERE ticker = :ticker AND date <= :end ORDER BY date DESC LIMIT :rows)"
+        )
+        params = {"ticker": ticker, "end": int(to_epoch_days(pd.Series([end])).iloc[0]), "rows": rows}
+    else:
+        return None
+    with engine.connect() as connection:
+        first = connection.execute(text(query), params).scalar()
+    if first is None:
+        return None
+    return from_epoch_days(first) if isinstance(first, int) else pd.Timestamp(first)
+
+def read_ticker_table_range(ticker, engine, start, end, columns):
+    """
+    Reads a date range from a per-ticker table, relying on the index on its ISO Date column.
+    SQLite returns the dates as epoch days, so no strings are parsed in pandas.
+    """
+    conditions = []
+    params = {}
+    if start is not None:
+        conditions.append('"Date" >= :start')
+        params["start"] = start.strftime('%Y-%m-%d')
+    if end is not None:
+        conditions.append('"Date" <= :end')
+        params["end"] = end.strftime('%Y-%m-%d')
+
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    selected = ", ".join(f'"{col}"' for col in columns)
+    # The day gets its own name so ORDER BY still reads the Date index
+    query = (
+        f'SELECT CAST(julianday("Date") - {EPOCH_JULIAN_DAY} AS INTEGER) AS day, {selected} '
+        f'FROM "{ticker}" {where}ORDER BY "Date"'
+    )
+    with engine.connect() as connection:
+        df = pd.read_sql_query(text(query), connection, params=params)
+    df.index = from_epoch_days(df.pop("day")).rename("Date")
+    df.insert(0, "Ticker", ticker)
+    return df
+
 def extract_ticker_from_query(query):
-    match = re.search(r"FROM\s+(\w+)", query, re.IGNORECASE)
+    match = re.search(r"FROM\s+\"?(\w+(?:@\w+)?)", query, re.IGNORECASE)
     if match:
         return match.group(1).upper()  # Convert to uppercase
-    return None
\ No newline at end of file
+    return None
@@ -1,22 +1,207 @@
 # data_visualization.py
 
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
 import streamlit as st
-from pygwalker.api.streamlit import StreamlitRenderer
-
-@st.cache_resource
-def get_pyg_renderer(data) -> "StreamlitRenderer":
-    renderer = StreamlitRenderer(
-        data,
-        spec="./gw_config.json",
-        spec_io_mode="manual"
-    )
+
+from instrumentation import span
+from query_cache import make_cache_key
+
+# Bar sizes offered for resampling daily rows, as pandas offset aliases
+RESAMPLE_RULES = {"Weekly": "W-FRI", "Monthly": "ME"}
+
+# How each price column is aggregated into a coarser bar; other numeric columns keep their last value
+OHLCV_AGGREGATION = {
+    "Open": "first",
+    "High": "max",
+    "Low": "min",
+    "Close": "last",
+    "Adj_Close": "last",
+    "Volume": "sum",
+}
+
+# Points kept per horizontal pixel when downsampling to the chart width
+POINTS_PER_PIXEL = 2
+
+# Renderers kept per session, most recently used last
+RENDERER_CACHE_SIZE = 4
+
+def render_fingerprint(query, engine, data, *options):
+    """
+    Cheap identity of a chart: the query text and the data versions of the tables
+    it reads, the row count, and any preparation options. Avoids hashing the frame.
+    """
+    return make_cache_key(query, engine) + (len(data), tuple(data.columns)) + options
+
+def create_pyg_renderer(data):
+    """
+    Builds a PyGWalker renderer. pygwalker takes over a second to import, so it is
+    loaded with the first chart rather than when the app starts.
+    """
+    from pygwalker.api.streamlit import StreamlitRenderer
+    return StreamlitRenderer(data, spec="./gw_config.json", spec_io_mode="manual")
+
+def get_pyg_renderer(data, fingerprint=None) -> "StreamlitRenderer":
+    """
+    Returns the session's renderer for the fingerprint, building it on first use.
+    Renderers live in a small per-session LRU so reruns triggered by widgets reuse them.
+    """
+    if fingerprint is None:
+        return create_pyg_renderer(data)
+
+    renderers = st.session_state.setdefault("pyg_renderers", OrderedDict())
+    renderer = renderers.get(fingerprint)
+    if renderer is not None:
+        renderers.move_to_end(fingerprint)
+        return renderer
+
+    renderer = create_pyg_renderer(data)
+    renderers[fingerprint] = renderer
+    while len(renderers) > RENDERER_CACHE_SIZE:
+        renderers.popitem(last=False)
     return renderer
 
-def visualize_data_with_pygwalker(data):
+def clear_renderer_cache():
+    """
+    Drops the renderers cached for the current session only.
+    """
+    st.session_state.pop("pyg_renderers", None)
+
+def resample_ohlcv(data, rule):
+    """
+    Aggregates daily rows into coarser OHLCV bars (e.g. "W-FRI" or "ME"), per Ticker when present.
+    """
+    df = data.copy()
+    df["Date"] = pd.to_datetime(df["Date"])
+    aggregation = {
+        col: OHLCV_AGGREGATION.get(col, "last")
+        for col in df.columns
+        if col not in ("Date", "Ticker") and pd.api.types.is_numeric_dtype(df[col])
+    }
+
+    if "Ticker" in df.columns:
+        resampled = df.groupby("Ticker").resample(rule, on="Date").agg(aggregation).reset_index()
+    else:
+        resampled = df.resample(rule, on="Date").agg(aggregation).reset_index()
+
+    # Periods without any trading (e.g. before a listing) produce empty bars
+    resampled = resampled.dropna(subset=[col for col in ("Close", "Open") if col in aggregation] or None, how="all")
+    resampled["Date"] = resampled["Date"].dt.strftime('%Y-%m-%d')
+    return resampled
+
+def minmax_indices(values, n_buckets):
+    """
+    Splits values into n_buckets equal runs and returns the positions of the
+    minimum and maximum of each run, which preserves peaks and troughs.
+    """
+    n = len(values)
+    edges = np.linspace(0, n, n_buckets + 1).astype(int)
+    starts = edges[:-1][np.diff(edges) > 0]
+
+    filled = np.where(np.isnan(values), np.nanmean(values) if n else 0.0, values)
+    low = np.minimum.reduceat(filled, starts)
+    high = np.maximum.reduceat(filled, starts)
+    bucket = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, n)))
+
+    # First position in each bucket matching its min / max
+    positions = np.arange(n)
+    is_low = filled == low[bucket]
+    is_high = filled == high[bucket]
+    first_low = np.full(len(starts), n)
+    first_high = np.full(len(starts), n)
+    np.minimum.at(first_low, bucket[is_low], positions[is_low])
+    np.minimum.at(first_high, bucket[is_high], positions[is_high])
+    return np.unique(np.concatenate([first_low, first_high, [0, n - 1]]))
+
+def lttb_indices(values, n_points):
+    """
+    Largest-Triangle-Three-Buckets: keeps the point of each bucket that forms the
+    largest triangle with the previously kept point and the next bucket's average.
+    """
+    n = len(values)
+    if n_points >= n or n_points < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=float)
+    y = np.where(np.isnan(values), np.nanmean(values), values)
+    edges = np.linspace(1, n - 1, n_points - 1).astype(int)
+    kept = np.empty(n_points, dtype=int)
+    kept[0], kept[-1] = 0, n - 1
+
+    previous = 0
+    for i in range(n_points - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:max(next_end, next_start + 1)].mean()
+        avg_y = y[next_start:max(next_end, next_start + 1)].mean()
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        kept[i + 1] = previous
+    return np.unique(kept)
+
+def downsample(data, max_points, value_column="Close", method="minmax"):
+    """
+    Reduces the rows of data to roughly max_points while preserving the shape of
+    value_column, per Ticker when present. Returns data unchanged if it is small enough.
+    """
+    if value_column not in data.columns or len(data) <= max_points:
+        return data
+
+    groups = [data] if "Ticker" not in data.columns else [group for _, group in data.groupby("Ticker", sort=False)]
+    budget = max(3, max_points // len(groups))
+    kept = []
+    for group in groups:
+        values = pd.to_numeric(group[value_column], errors="coerce").to_numpy(dtype=float)
+        if len(group) <= budget:
+            kept.append(group)
+        elif method == "lttb":
+            kept.append(group.iloc[lttb_indices(values, budget)])
+        else:
+            kept.append(group.iloc[minmax_indices(values, max(1, budget // 2))])
+    return pd.concat(kept)
+
+def prepare_for_visualization(data, resample=None, chart_width=None, value_column="Close", method="minmax"):
+    """
+    Builds the frame handed to PyGWalker: optionally resampled to weekly or monthly
+    bars and reduced to the number of points the chart width can show.
+    The input frame is never modified, so the raw rows stay available for drill-down.
+    """
+    if data.empty or "Date" not in data.columns:
+        return data
+
+    with span("render_prep", rows=len(data), resample=resample, chart_width=chart_width) as record:
+        prepared = data
+        if resample in RESAMPLE_RULES:
+            prepared = resample_ohlcv(prepared, RESAMPLE_RULES[resample])
+        if chart_width:
+            prepared = downsample(prepared, int(chart_width) * POINTS_PER_PIXEL, value_column, method)
+        record["rows_out"] = len(prepared)
+    return prepared
+
+def prepare_streamed_visualization(chunks, resample=None, chart_width=None, value_column="Close", method="minmax"):
+    """
+    Builds the chart frame for a result streamed in chunks (see data_querying.iter_query),
+    reducing each chunk as it arrives so the full result is never held at once.
+    Weekly and monthly bars of the chunks are aggregated again, which is exact;
+    downsampling keeps each chunk's peaks and troughs before the final pass.
+    """
+    parts = [prepare_for_visualization(chunk, resample, chart_width, value_column, method) for chunk in chunks]
+    if not parts:
+        return pd.DataFrame()
+    return prepare_for_visualization(pd.concat(parts, ignore_index=True), resample, chart_width, value_column, method)
+
+def visualize_data_with_pygwalker(data, fingerprint=None):
     """
     Visualizes the given pandas DataFrame using PyGWalker in Streamlit.
+    Pass a fingerprint from render_fingerprint to reuse the renderer across reruns.
     """
-    renderer = get_pyg_renderer(data)
-    if not data.empty:
-        with st.container():
-            renderer.explorer()
\ No newline at end of file
+    if data.empty:
+        return
+    renderer = get_pyg_renderer(data, fingerprint)
+    with st.container():
+        renderer.explorer()
@@ -1,13 +1,196 @@
 # database_utils.py
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+import pandas as pd
 import os
+import threading
 
-def create_sqlite_engine(db_path="stocks.db"):
+# Tables that hold shared data rather than the history of a single ticker
+PRICES_TABLE = "prices"
+INDICATORS_TABLE = "indicators"
+JOBS_TABLE = "ingest_jobs"
+JOB_TICKERS_TABLE = "ingest_job_tickers"
+SCHEDULES_TABLE = "ingest_schedules"
+CATALOG_TABLE = "ticker_catalog"
+PRICE_SCALES_TABLE = "price_scales"
+ADJUSTMENTS_TABLE = "price_adjustments"
+INTRADAY_PARTITIONS_TABLE = "intraday_partitions"
+RESERVED_TABLES = {
+    PRICES_TABLE, INDICATORS_TABLE, JOBS_TABLE, JOB_TICKERS_TABLE, SCHEDULES_TABLE, CATALOG_TABLE,
+    PRICE_SCALES_TABLE, ADJUSTMENTS_TABLE, INTRADAY_PARTITIONS_TABLE,
+}
+
+# Separates ticker, bar size and month in the names of intraday partition tables,
+# e.g. "AAPL@5m@2024-06"; "AAPL@5m" names all partitions of a ticker in queries
+PARTITION_SEPARATOR = "@"
+
+DEFAULT_DB_PATH = "stocks.db"
+
+# Applied to every new connection. WAL lets readers keep reading while the
+# ingestion writer commits, and synchronous=NORMAL is safe in WAL mode.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # Negative values are KiB, i.e. 64 MB of page cache
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+# Connections kept open for the query path; each keeps its own prepared statement cache
+READ_POOL_SIZE = 8
+CACHED_STATEMENTS = 256
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def apply_pragmas(dbapi_connection, read_only):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+def create_sqlite_engine(db_path=DEFAULT_DB_PATH, read_only=False):
     """
     Creates a persistent SQLite database engine.
+    Read-only engines keep a pool of query_only connections for the query path;
+    the writable engine has a single connection so the process only ever has one writer.
     """
     if not os.path.exists(db_path):
         open(db_path, "w").close()  # Create an empty database file if it doesn't exist
-    engine = create_engine(f"sqlite:///{db_path}", echo=False)
-    return engine
\ No newline at end of file
+
+    if read_only:
+        pool_options = {"pool_size": READ_POOL_SIZE, "max_overflow": READ_POOL_SIZE}
+    else:
+        # Writers queue for the single connection instead of failing with "database is locked"
+        pool_options = {"pool_size": 1, "max_overflow": 0, "pool_timeout": 600}
+
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        echo=False,
+        connect_args={"check_same_thread": False, "cached_statements": CACHED_STATEMENTS},
+        **pool_options
+    )
+    event.listen(engine, "connect", lambda dbapi_connection, _: apply_pragmas(dbapi_connection, read_only))
+    return engine
+
+def get_engine(db_path=DEFAULT_DB_PATH, read_only=False):
+    """
+    Returns the process-wide engine for the database, creating it on first use.
+    """
+    key = (os.path.abspath(db_path), read_only)
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = create_sqlite_engine(db_path, read_only)
+        return _engines[key]
+
+def get_read_engine(engine):
+    """
+    Returns the shared read-only engine for the same database file as engine.
+    In-memory databases cannot be shared between engines and are returned as is.
+    """
+    db_path = engine.url.database
+    if engine.url.get_backend_name() != "sqlite" or not db_path or db_path == ":memory:":
+        return engine
+    return get_engine(db_path, read_only=True)
+
+def table_exists(engine, table_name, include_views=True, ignore_case=False):
+    """
+    Returns True if a table (or, by default, a view) with the given name exists in the database.
+    With ignore_case the name matches the way SQLite resolves names in queries.
+    """
+    types = "('table', 'view')" if include_views else "('table')"
+    collate = " COLLATE NOCASE" if ignore_case else ""
+    with engine.connect() as connection:
+        row = connection.execute(
+            text(f"SELECT name FROM sqlite_master WHERE type IN {types} AND name=:name{collate}"),
+            {"name": table_name}
+        ).fetchone()
+    return row is not None
+
+def begin_transaction(connection):
+    """
+    Opens the transaction of an engine.begin() block explicitly. pysqlite only
+    opens one before the first INSERT/UPDATE/DELETE, so schema changes issued
+    earlier would commit on their own and survive a rollback.
+    """
+    if not connection.connection.driver_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN")
+
+def create_date_index(connection, table_name):
+    """
+    Creates an index on the Date column of a per-ticker table so date ranges become index seeks.
+    """
+    connection.execute(text(f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_date" ON "{table_name}" ("Date")'))
+
+def list_ticker_tables(connection, include_views=False):
+    """
+    Returns the names of the per-ticker tables (and, optionally, views) in the database.
+    """
+    types = "('table', 'view')" if include_views else "('table')"
+    rows = connection.execute(text(
+        f"SELECT name FROM sqlite_master WHERE type IN {types} AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    )).fetchall()
+    return [row[0] for row in rows if row[0] not in RESERVED_TABLES and PARTITION_SEPARATOR not in row[0]]
+
+# Rows bound per executemany call by the bulk loader
+BULK_BATCH_ROWS = 50000
+
+def sqlite_column_type(dtype):
+    """
+    Maps a pandas dtype to the column type pandas.to_sql would have used.
+    """
+    if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+        return "BIGINT"
+    if pd.api.types.is_float_dtype(dtype):
+        return "FLOAT"
+    return "TEXT"
+
+def bulk_insert(connection, sql, rows, batch_size=BULK_BATCH_ROWS):
+    """
+    Inserts row tuples with the DBAPI cursor's executemany in large batches,
+    bypassing SQLAlchemy's per-row parameter processing.
+    Must be called inside a transaction; returns the number of rows inserted.
+    """
+    cursor = connection.connection.cursor()
+    inserted = 0
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                cursor.executemany(sql, batch)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            inserted += len(batch)
+    finally:
+        cursor.close()
+    return inserted
+
+def bulk_replace_table(connection, table_name, df):
+    """
+    Loads df into a staging table, indexes it and swaps it in place of table_name.
+    Runs inside the caller's transaction, so readers see either the old or the
+    new table and never a missing or half-filled one.
+    """
+    staging = f"{table_name}__staging"
+    columns = ", ".join(f'"{col}" {sqlite_column_type(dtype)}' for col, dtype in df.dtypes.items())
+    placeholders = ", ".join("?" for _ in df.columns)
+
+    begin_transaction(connection)
+    connection.execute(text(f'DROP TABLE IF EXISTS "{staging}"'))
+    connection.execute(text(f'CREATE TABLE "{staging}" ({columns})'))
+    # Missing values are bound as NULL; numeric values come back as Python scalars
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    inserted = bulk_insert(connection, f'INSERT INTO "{staging}" VALUES ({placeholders})', rows)
+
+    connection.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
+    connection.execute(text(f'ALTER TABLE "{staging}" RENAME TO "{table_name}"'))
+    # Building the index once after the load is cheaper than maintaining it row by row
+    if "Date" in df.columns:
+        create_date_index(connection, table_name)
+    return inserted
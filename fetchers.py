@@ -0,0 +1,40 @@
+# fetchers.py
+
+import os
+import pandas as pd
+
+# History Yahoo Finance serves per bar size: the period requested for a full load,
+# and how many days back an incremental request may start
+YAHOO_PERIODS = {"1d": "max", "1m": "7d", "5m": "60d", "15m": "60d", "1h": "730d"}
+YAHOO_LOOKBACK_DAYS = {"1m": 6, "5m": 59, "15m": 59, "1h": 729}
+
+class YahooFetcher:
+    """
+    Downloads price history from Yahoo Finance, daily by default or in bars of
+    the given interval (e.g. "5m").
+    """
+    def __init__(self, interval="1d"):
+        self.interval = interval
+
+    def fetch(self, ticker, start=None):
+        # Imported on first download: yfinance is slow to import and unused by the query pages
+        import yfinance as yf
+        if start is None:
+            return yf.download(ticker, period=YAHOO_PERIODS[self.interval], interval=self.interval, progress=False)
+        return yf.download(ticker, start=start, interval=self.interval, progress=False)
+
+class CsvFetcher:
+    """
+    Reads price history from <directory>/<TICKER>.csv files instead of Yahoo.
+    Used as a local stand-in for yf.download in tests and benchmarks.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, ticker, start=None):
+        path = os.path.join(self.directory, f"{ticker.upper()}.csv")
+        # The first column holds the bar times: Date for daily files, Datetime for intraday ones
+        df = pd.read_csv(path, parse_dates=[0], index_col=0)
+        if start is not None:
+            df = df[df.index >= pd.Timestamp(start)]
+        return df
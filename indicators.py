@@ -0,0 +1,247 @@
+# indicators.py
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import text
+
+from database_utils import INDICATORS_TABLE, table_exists
+from data_querying import get_prices, window_start
+from query_cache import bump_data_version
+
+SMA_WINDOWS = (20, 50, 200)
+EMA_SPANS = (12, 26)
+VOLATILITY_WINDOW = 20
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+
+# Trading days per year, used to annualize volatility
+TRADING_DAYS = 252
+
+# Stored rows that must precede new bars so every rolling window is complete
+WARMUP_ROWS = max(max(SMA_WINDOWS), VOLATILITY_WINDOW + 1)
+
+# Largest growth factor allowed inside one EMA block before the running sum loses precision
+EMA_BLOCK_GROWTH = 50.0
+
+INDICATOR_COLUMNS = (
+    [f"SMA_{window}" for window in SMA_WINDOWS]
+    + [f"EMA_{span}" for span in EMA_SPANS]
+    + ["Log_Return", f"Volatility_{VOLATILITY_WINDOW}", f"RSI_{RSI_PERIOD}", f"ATR_{ATR_PERIOD}", "Drawdown"]
+)
+
+# Recursive state carried between incremental updates
+STATE_COLUMNS = ["Close", "Peak", "RSI_Avg_Gain", "RSI_Avg_Loss"]
+
+# Stored values that seed the recursive indicators of the next bar
+RECURSIVE_COLUMNS = [f"EMA_{span}" for span in EMA_SPANS] + [f"ATR_{ATR_PERIOD}"] + STATE_COLUMNS
+
+CREATE_INDICATORS_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {INDICATORS_TABLE} (
+    "Ticker" TEXT NOT NULL,
+    "Date" TEXT NOT NULL,
+    {", ".join(f'"{col}" REAL' for col in INDICATOR_COLUMNS + STATE_COLUMNS)},
+    PRIMARY KEY ("Ticker", "Date")
+) WITHOUT ROWID
+"""
+
+def sma(values, window):
+    """
+    Simple moving average; the first window - 1 values are NaN.
+    """
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        sums = np.cumsum(np.concatenate([[0.0], values]))
+        out[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return out
+
+def rolling_std(values, window):
+    """
+    Rolling sample standard deviation; the first window - 1 values are NaN.
+    """
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window - 1:] = sliding_window_view(values, window).std(axis=1, ddof=1)
+    return out
+
+def exponential_smoothing(values, alpha, initial):
+    """
+    Computes y[i] = alpha * x[i] + (1 - alpha) * y[i - 1] starting from y[-1] = initial.
+    The recursion is evaluated in closed form over blocks short enough that the
+    (1 - alpha) ** -k weights stay well within float64 range.
+    """
+    out = np.empty(len(values))
+    decay = 1.0 - alpha
+    if decay <= 0.0:
+        out[:] = values
+        return out
+
+    block = max(1, int(EMA_BLOCK_GROWTH / -np.log(decay)))
+    previous = initial
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        steps = np.arange(len(chunk))
+        weighted = np.cumsum(chunk * decay ** -steps)
+        out[start:start + len(chunk)] = decay ** (steps + 1) * previous + alpha * decay ** steps * weighted
+        previous = out[start + len(chunk) - 1]
+    return out
+
+def ema(values, span, initial=None):
+    """
+    Exponential moving average with alpha = 2 / (span + 1), seeded with the first value
+    or with the EMA of the previous bar when continuing a stored series.
+    """
+    if len(values) == 0:
+        return np.empty(0)
+    if initial is None or np.isnan(initial):
+        initial = values[0]
+    return exponential_smoothing(values, 2.0 / (span + 1), initial)
+
+def wilder_average(values, period, initial=None):
+    """
+    Wilder's smoothed average (alpha = 1 / period). Without a previous value the
+    series is seeded with the mean of the first period values and NaN before that.
+    """
+    out = np.full(len(values), np.nan)
+    if initial is not None and not np.isnan(initial):
+        return exponential_smoothing(values, 1.0 / period, initial)
+    if len(values) < period:
+        return out
+    seed = values[:period].mean()
+    out[period - 1] = seed
+    out[period:] = exponential_smoothing(values[period:], 1.0 / period, seed)
+    return out
+
+def log_returns(close, previous_close=np.nan):
+    return np.diff(np.log(close), prepend=np.log(previous_close))
+
+def true_range(high, low, close, previous_close=np.nan):
+    prev = np.concatenate([[previous_close], close[:-1]])
+    ranges = np.vstack([high - low, np.abs(high - prev), np.abs(low - prev)])
+    # The first bar of a series has no previous close and falls back to high - low
+    return np.nanmax(ranges, axis=0)
+
+def compute_indicators(prices, state=None, warmup=0):
+    """
+    Computes every indicator for an OHLC frame indexed by Date.
+    When continuing a stored series, `state` is the last stored indicator row and
+    the first `warmup` rows of `prices` are stored bars that only feed rolling windows.
+    Returns the indicator rows for the bars after the warmup.
+    """
+    state = state if state is not None else {}
+    high = prices["High"].to_numpy(dtype=float)
+    low = prices["Low"].to_numpy(dtype=float)
+    close = prices["Close"].to_numpy(dtype=float)
+    new = slice(warmup, None)
+    previous_close = state.get("Close", np.nan)
+
+    out = {}
+    for window in SMA_WINDOWS:
+        out[f"SMA_{window}"] = sma(close, window)[new]
+    for span in EMA_SPANS:
+        out[f"EMA_{span}"] = ema(close[new], span, state.get(f"EMA_{span}"))
+
+    # Returns over the warmup bars are recomputed so the volatility window is complete
+    returns = log_returns(close)
+    out["Log_Return"] = returns[new]
+    out[f"Volatility_{VOLATILITY_WINDOW}"] = (rolling_std(returns, VOLATILITY_WINDOW) * np.sqrt(TRADING_DAYS))[new]
+
+    changes = np.diff(close[new], prepend=previous_close)
+    gains = np.where(changes > 0, changes, 0.0)
+    losses = np.where(changes < 0, -changes, 0.0)
+    if np.isnan(previous_close):
+        # The first bar of a full series has no change
+        gains, losses = gains[1:], losses[1:]
+    avg_gain = wilder_average(gains, RSI_PERIOD, state.get("RSI_Avg_Gain"))
+    avg_loss = wilder_average(losses, RSI_PERIOD, state.get("RSI_Avg_Loss"))
+    if np.isnan(previous_close):
+        avg_gain = np.concatenate([[np.nan], avg_gain])
+        avg_loss = np.concatenate([[np.nan], avg_loss])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[f"RSI_{RSI_PERIOD}"] = np.where(avg_loss == 0, 100.0, 100.0 - 100.0 / (1.0 + avg_gain / avg_loss))
+    out[f"RSI_{RSI_PERIOD}"][np.isnan(avg_gain)] = np.nan
+
+    ranges = true_range(high[new], low[new], close[new], previous_close)
+    out[f"ATR_{ATR_PERIOD}"] = wilder_average(ranges, ATR_PERIOD, state.get(f"ATR_{ATR_PERIOD}"))
+
+    previous_peak = state.get("Peak", -np.inf)
+    peak = np.maximum.accumulate(np.concatenate([[previous_peak], close[new]]))[1:]
+    out["Drawdown"] = close[new] / peak - 1.0
+
+    out["Close"] = close[new]
+    out["Peak"] = peak
+    out["RSI_Avg_Gain"] = avg_gain
+    out["RSI_Avg_Loss"] = avg_loss
+    return pd.DataFrame(out, index=prices.index[new])
+
+def read_indicator_state(ticker, engine):
+    """
+    Returns the last stored indicator row of the ticker as a dict, or None.
+    """
+    if not table_exists(engine, INDICATORS_TABLE):
+        return None
+    with engine.connect() as connection:
+        row = connection.execute(
+            text(f'SELECT * FROM {INDICATORS_TABLE} WHERE "Ticker" = :ticker ORDER BY "Date" DESC LIMIT 1'),
+            {"ticker": ticker}
+        ).mappings().fetchone()
+    return {key: (np.nan if value is None else value) for key, value in row.items()} if row else None
+
+def write_indicators(ticker, rows, engine, replace=False):
+    """
+    Upserts indicator rows for the ticker, first removing its old rows when replace is True.
+    """
+    columns = ["Ticker", "Date"] + INDICATOR_COLUMNS + STATE_COLUMNS
+    frame = rows.copy()
+    frame.insert(0, "Date", rows.index.strftime('%Y-%m-%d'))
+    frame.insert(0, "Ticker", ticker)
+    frame = frame[columns].astype(object).where(frame[columns].notna(), None)
+
+    quoted = ", ".join(f'"{col}"' for col in columns)
+    insert = text(
+        f"INSERT OR REPLACE INTO {INDICATORS_TABLE} ({quoted}) "
+        f"VALUES ({', '.join(f':p{i}' for i in range(len(columns)))})"
+    )
+    params = [{f"p{i}": value for i, value in enumerate(row)} for row in frame.itertuples(index=False)]
+    with engine.begin() as connection:
+        connection.execute(text(CREATE_INDICATORS_TABLE))
+        if replace:
+            connection.execute(text(f'DELETE FROM {INDICATORS_TABLE} WHERE "Ticker" = :ticker'), {"ticker": ticker})
+        if params:
+            connection.execute(insert, params)
+    bump_data_version(INDICATORS_TABLE)
+    return len(frame)
+
+def update_indicators(ticker, engine, full=False):
+    """
+    Brings the materialized indicators of a ticker up to date with its stored prices.
+    Only bars after the last stored indicator row are computed unless full is True
+    or the stored indicators no longer line up with the price history.
+    Returns the number of indicator rows written.
+    """
+    ticker = ticker.upper()
+    state = None if full else read_indicator_state(ticker, engine)
+
+    # Series too short to have seeded every recursive indicator are simply recomputed
+    if state is not None and any(np.isnan(state[col]) for col in RECURSIVE_COLUMNS):
+        state = None
+
+    if state is not None:
+        last_date = pd.Timestamp(state["Date"])
+        # A backward seek finds where the warmup bars start, then one range query reads
+        # them together with the new bars, so an append never reads the whole history
+        start = window_start(ticker, engine, last_date, WARMUP_ROWS)
+        prices = get_prices(ticker, engine, start=start, columns=["High", "Low", "Close"]) if start is not None else None
+        tail = prices.loc[:last_date] if prices is not None else None
+        if tail is None or tail.empty or tail.index[-1] != last_date or not np.isclose(tail["Close"].iloc[-1], state["Close"]):
+            state = None
+        elif len(prices) == len(tail):
+            return 0
+        else:
+            rows = compute_indicators(prices, state, warmup=len(tail))
+            return write_indicators(ticker, rows, engine)
+
+    prices = get_prices(ticker, engine, columns=["High", "Low", "Close"])
+    if prices.empty:
+        return 0
+    return write_indicators(ticker, compute_indicators(prices), engine, replace=True)
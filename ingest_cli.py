@@ -0,0 +1,160 @@
+# ingest_cli.py
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from database_utils import DEFAULT_DB_PATH, get_engine
+from data_extraction import DEFAULT_WORKERS, DEFAULT_RETRIES, DAILY_INTERVAL
+from intraday import INTRADAY_INTERVALS
+from fetchers import CsvFetcher
+from jobs import create_job_tables, submit_job, run_job, get_job_progress
+
+def read_universe(path):
+    """
+    Reads tickers from a file with one or more comma or whitespace separated
+    tickers per line. Anything after a '#' is a comment.
+    """
+    tickers = []
+    with open(path) as universe:
+        for line in universe:
+            line = line.split("#", 1)[0]
+            tickers.extend(ticker.upper() for ticker in line.replace(",", " ").split())
+    return list(dict.fromkeys(tickers))
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as checkpoint:
+        return json.load(checkpoint)
+
+def save_checkpoint(path, checkpoint):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as out:
+        json.dump(checkpoint, out)
+    os.replace(tmp_path, path)
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def resumable_job(engine, checkpoint, tickers):
+    """
+    Returns the job id from the checkpoint if that job is unfinished and for the same universe.
+    """
+    if checkpoint is None:
+        return None
+    progress = get_job_progress(engine, checkpoint["job_id"])
+    if progress is None or progress["status"] == "done":
+        return None
+    if list(progress["tickers"]["ticker"]) != tickers:
+        print("Universe changed since the checkpoint was written; starting a new run.", file=sys.stderr)
+        return None
+    if checkpoint.get("pid") not in (None, os.getpid()) and process_alive(checkpoint["pid"]):
+        raise RuntimeError(f"Job {checkpoint['job_id']} is still running in another process.")
+    return checkpoint["job_id"]
+
+def database_size(engine, db_path):
+    """
+    Returns the bytes the database occupies. Committed pages stay in the -wal file
+    until a checkpoint, so one is run first; whatever readers keep in the WAL is
+    counted as well.
+    """
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    wal_path = f"{db_path}-wal"
+    return os.path.getsize(db_path) + (os.path.getsize(wal_path) if os.path.exists(wal_path) else 0)
+
+def build_summary(progress, started, duration, db_bytes_before, db_bytes_after):
+    tickers = progress["tickers"]
+    failed = tickers[tickers["status"] == "failed"]
+    return {
+        "job_id": progress["id"],
+        "status": progress["status"],
+        "started_at": started,
+        "duration_seconds": duration,
+        "tickers": len(tickers),
+        "succeeded": int((~tickers["status"].isin(["failed", "pending"])).sum()),
+        "failed": len(failed),
+        "rows_written": int(tickers["rows"].fillna(0).sum()),
+        "bytes_written": int(tickers["bytes"].fillna(0).sum()),
+        "database_bytes_before": db_bytes_before,
+        "database_bytes_after": db_bytes_after,
+        "failures": dict(zip(failed["ticker"], failed["error"])),
+        "results": json.loads(tickers.to_json(orient="records")),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest a universe of tickers without the Streamlit app.")
+    parser.add_argument("universe", help="File listing the tickers to ingest")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to the SQLite database")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent downloads")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="Download attempts per ticker")
+    parser.add_argument("--full", action="store_true", help="Reload full history instead of refreshing incrementally")
+    parser.add_argument("--interval", default=DAILY_INTERVAL, choices=[DAILY_INTERVAL] + list(INTRADAY_INTERVALS),
+                        help="Bar size to ingest; intraday bars are stored in monthly partitions")
+    parser.add_argument("--no-indicators", action="store_true", help="Skip updating materialized indicators")
+    parser.add_argument("--columnar-dir", help="Also mirror written tickers to this directory")
+    parser.add_argument("--source-dir", help="Read <TICKER>.csv files from this directory instead of Yahoo Finance")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <universe>.checkpoint.json)")
+    parser.add_argument("--summary", help="Write the JSON summary to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    tickers = read_universe(args.universe)
+    if not tickers:
+        parser.error(f"No tickers found in {args.universe}")
+
+    checkpoint_path = args.checkpoint or f"{args.universe}.checkpoint.json"
+    engine = get_engine(args.db)
+    create_job_tables(engine)
+
+    options = {
+        "incremental": not args.full,
+        "max_workers": args.workers,
+        "retries": args.retries,
+        "indicators": not args.no_indicators,
+    }
+    if args.columnar_dir:
+        options["columnar_dir"] = args.columnar_dir
+    if args.interval != DAILY_INTERVAL:
+        options["interval"] = args.interval
+
+    job_id = resumable_job(engine, load_checkpoint(checkpoint_path), tickers)
+    if job_id is None:
+        # Created as running so a JobRunner in the app does not pick it up as well
+        job_id = submit_job(engine, tickers, status="running", **options)
+        print(f"Started job {job_id} for {len(tickers)} tickers.", file=sys.stderr)
+    else:
+        print(f"Resuming job {job_id}.", file=sys.stderr)
+    save_checkpoint(checkpoint_path, {"job_id": job_id, "universe": os.path.abspath(args.universe), "pid": os.getpid()})
+
+    started = time.time()
+    db_bytes_before = database_size(engine, args.db)
+    fetcher = CsvFetcher(args.source_dir) if args.source_dir else None
+    run_job(engine, job_id, fetcher=fetcher, **options)
+    duration = time.time() - started
+
+    summary = build_summary(
+        get_job_progress(engine, job_id), started, duration, db_bytes_before, database_size(engine, args.db)
+    )
+    if args.summary:
+        with open(args.summary, "w") as out:
+            json.dump(summary, out, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+
+    # Only a fully finished run clears the checkpoint; failures are retried by a new run
+    if summary["status"] == "done":
+        os.remove(checkpoint_path)
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# instrumentation.py
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Finished spans kept in memory for the performance panel
+RECENT_SPANS = 1000
+
+# Exporters enabled through the environment: STOCKS_METRICS_LOG=1 prints one line per span,
+# STOCKS_METRICS_FILE=<path> keeps a Prometheus text file up to date
+METRICS_LOG = os.environ.get("STOCKS_METRICS_LOG")
+METRICS_FILE = os.environ.get("STOCKS_METRICS_FILE")
+
+# Minimum seconds between rewrites of the Prometheus text file
+PROMETHEUS_WRITE_INTERVAL = 5.0
+
+class LogExporter:
+    """
+    Prints every finished span as a single key=value line.
+    """
+    def export(self, record, metrics):
+        fields = " ".join(f"{key}={value}" for key, value in record.items() if key not in ("name", "seconds", "started_at"))
+        print(f"span {record['name']} {record['seconds'] * 1000:.1f}ms {fields}".rstrip())
+
+class PrometheusFileExporter:
+    """
+    Writes span totals and counters in the Prometheus text format, for a
+    node_exporter textfile collector or any scraper that reads the file.
+    """
+    def __init__(self, path, interval=PROMETHEUS_WRITE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._last_write = 0.0
+
+    def export(self, record, metrics):
+        now = time.monotonic()
+        if now - self._last_write >= self.interval:
+            self._last_write = now
+            self.write(metrics)
+
+    def write(self, metrics):
+        lines = ["# TYPE stocks_span_seconds summary"]
+        for name, stats in sorted(metrics.span_totals().items()):
+            lines.append(f'stocks_span_seconds_sum{{span="{name}"}} {stats["seconds"]:.6f}')
+            lines.append(f'stocks_span_seconds_count{{span="{name}"}} {stats["count"]}')
+        for name, value in sorted(metrics.counters().items()):
+            lines.append(f"# TYPE stocks_{name}_total counter")
+            lines.append(f"stocks_{name}_total {value}")
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as out:
+            out.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+
+class Metrics:
+    """
+    Process-wide registry of timed spans and counters. Spans nested on the same
+    thread add their duration to the enclosing span's record as <name>_seconds,
+    so a query's record shows where its time went.
+    """
+    def __init__(self, recent=RECENT_SPANS):
+        self._recent = deque(maxlen=recent)
+        self._totals = {}
+        self._counters = {}
+        self._exporters = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add_exporter(self, exporter):
+        with self._lock:
+            self._exporters.append(exporter)
+
+    def remove_exporter(self, exporter):
+        with self._lock:
+            self._exporters.remove(exporter)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """
+        Times the enclosed block. Yields the span's record so the block can add
+        fields such as a row count.
+        """
+        record = {"name": name, "started_at": time.time(), **labels}
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(record)
+        started = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - started
+            stack.pop()
+            if stack:
+                parent = stack[-1]
+                parent[f"{name}_seconds"] = parent.get(f"{name}_seconds", 0.0) + record["seconds"]
+            self._finish(record)
+
+    def _finish(self, record):
+        with self._lock:
+            self._recent.append(record)
+            totals = self._totals.setdefault(record["name"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            totals["count"] += 1
+            totals["seconds"] += record["seconds"]
+            totals["max_seconds"] = max(totals["max_seconds"], record["seconds"])
+            exporters = list(self._exporters)
+        for exporter in exporters:
+            try:
+                exporter.export(record, self)
+            except Exception as e:
+                print(f"Error while exporting span {record['name']}: {e}")
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def span_totals(self):
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._totals.items()}
+
+    def recent_spans(self, name=None, label=None, limit=None):
+        """
+        Returns recent spans, newest first, optionally only those with the given
+        name or carrying the given label.
+        """
+        with self._lock:
+            records = [dict(record) for record in reversed(self._recent)
+                       if (name is None or record["name"] == name) and (label is None or label in record)]
+        if limit is not None:
+            records = records[:limit]
+        df = pd.DataFrame.from_records(records)
+        if not df.empty:
+            df["started_at"] = pd.to_datetime(df["started_at"], unit="s")
+        return df
+
+    def summary(self):
+        """
+        Returns count, total, mean and max seconds per span name.
+        """
+        totals = self.span_totals()
+        df = pd.DataFrame.from_dict(totals, orient="index", columns=["count", "seconds", "max_seconds"])
+        df["mean_seconds"] = df["seconds"] / df["count"]
+        return df.rename_axis("span").sort_values("seconds", ascending=False)
+
+    def reset(self):
+        with self._lock:
+            self._recent.clear()
+            self._totals.clear()
+            self._counters.clear()
+
+metrics = Metrics()
+if METRICS_LOG:
+    metrics.add_exporter(LogExporter())
+if METRICS_FILE:
+    metrics.add_exporter(PrometheusFileExporter(METRICS_FILE))
+
+def span(name, **labels):
+    return metrics.span(name, **labels)
+
+def increment(name, value=1):
+    metrics.increment(name, value)
@@ -0,0 +1,351 @@
+# intraday.py
+#
+# Storage for intraday bars. Each ticker and bar size is split into one table per
+# month ("AAPL@5m@2024-06"), listed in INTRADAY_PARTITIONS_TABLE with the range of
+# bars it holds, so reads only open the months a date range touches. Queries refer
+# to all partitions of a ticker as "AAPL@5m".
+
+import argparse
+import re
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+from database_utils import INTRADAY_PARTITIONS_TABLE, PARTITION_SEPARATOR, create_sqlite_engine, get_read_engine, bulk_insert
+from query_cache import STRING_LITERAL_PATTERN, bump_data_version
+
+# Bar sizes that can be ingested besides daily bars, with their length in seconds
+INTRADAY_INTERVALS = {"1m": 60, "5m": 300, "15m": 900, "1h": 3600}
+
+# Days bars of each size are kept before whole months of them are rolled up into
+# the next coarser size; bar sizes without a policy are kept indefinitely
+RETENTION_POLICIES = {
+    "1m": (30, "5m"),
+    "5m": (90, "15m"),
+    "15m": (365, "1h"),
+}
+
+# Columns of a partition table. Datetime is the bar's start time in UTC as
+# 'YYYY-MM-DD HH:MM:SS', so it sorts and compares like the daily Date column.
+BAR_COLUMNS = ["Datetime", "Open", "High", "Low", "Close", "Volume"]
+
+CREATE_PARTITIONS_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {INTRADAY_PARTITIONS_TABLE} (
+    ticker TEXT NOT NULL,
+    interval TEXT NOT NULL,
+    month TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    first_bar TEXT,
+    last_bar TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (ticker, interval, month)
+)
+"""
+
+# Clustered on Datetime, so a range within a partition is a single seek
+CREATE_PARTITION = """
+CREATE TABLE IF NOT EXISTS "{table}" (
+    "Datetime" TEXT PRIMARY KEY,
+    "Open" REAL,
+    "High" REAL,
+    "Low" REAL,
+    "Close" REAL,
+    "Volume" INTEGER
+) WITHOUT ROWID
+"""
+
+INTRADAY_REFERENCE_PATTERN = re.compile(
+    rf'"?\b(\w+){PARTITION_SEPARATOR}({"|".join(INTRADAY_INTERVALS)})\b"?(?!{PARTITION_SEPARATOR})', re.IGNORECASE
+)
+
+# A whole WHERE conjunct comparing Datetime with a literal. Literals are replaced by
+# their positions ('0', '1', ...) before matching, so their text cannot match SQL.
+DATETIME_BOUND_PATTERN = re.compile(r"""(?:\w+\.)?"?Datetime"?\s*(>=|<=|>|<|=)\s*'(\d+)'""", re.IGNORECASE)
+DATETIME_BETWEEN_PATTERN = re.compile(r"""(?:\w+\.)?"?Datetime"?\s+BETWEEN\s+'(\d+)'\s+AND\s+'(\d+)'""", re.IGNORECASE)
+
+# Constructs under which a Datetime comparison does not bound the rows read: negation,
+# alternatives, conditional expressions and subqueries (any second SELECT)
+UNPRUNABLE_PATTERN = re.compile(r"\b(?:NOT|OR|CASE|IIF|EXISTS|UNION|EXCEPT|INTERSECT)\b|\bSELECT\b.*\bSELECT\b", re.IGNORECASE | re.DOTALL)
+WHERE_CLAUSE_PATTERN = re.compile(r"\bWHERE\b(.*?)(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bHAVING\b|\bWINDOW\b|\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL)
+
+def series_name(ticker, interval):
+    return f"{ticker}{PARTITION_SEPARATOR}{interval}"
+
+def partition_name(ticker, interval, month):
+    return f"{ticker}{PARTITION_SEPARATOR}{interval}{PARTITION_SEPARATOR}{month}"
+
+def prepare_intraday_data(df):
+    """
+    Turns a frame of intraday bars returned by a fetcher into the layout stored in partitions.
+    """
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = df.columns.get_level_values(0)
+
+    df = df.reset_index()
+    df = df.rename(columns={df.columns[0]: "Datetime"})
+    times = pd.to_datetime(df["Datetime"])
+    # Yahoo reports bars in the exchange's time zone; partitions hold UTC
+    times = times.dt.tz_convert("UTC") if times.dt.tz is not None else times
+    df["Datetime"] = times.dt.strftime('%Y-%m-%d %H:%M:%S')
+
+    df.columns = [col.replace(" ", "_") for col in df.columns]
+    return df
+
+def partitions_table_exists(connection):
+    return connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": INTRADAY_PARTITIONS_TABLE}
+    ).first() is not None
+
+def partition_tables(connection, ticker, interval, start=None, end=None):
+    """
+    Returns the partition tables of a ticker's bars, oldest first, skipping months
+    that hold no bars between start and end ('YYYY-MM-DD[ HH:MM:SS]' strings).
+    """
+    if not partitions_table_exists(connection):
+        return []
+    conditions = ["ticker = :ticker", "interval = :interval"]
+    params = {"ticker": ticker.upper(), "interval": interval}
+    if start is not None:
+        conditions.append("last_bar >= :start")
+        params["start"] = start
+    if end is not None:
+        conditions.append("first_bar <= :end")
+        params["end"] = end
+    rows = connection.execute(
+        text(f"SELECT table_name FROM {INTRADAY_PARTITIONS_TABLE} WHERE {' AND '.join(conditions)} ORDER BY month"),
+        params
+    )
+    return [row[0] for row in rows]
+
+def intraday_rows(connection, name):
+    """
+    Returns the bars stored under a series ("AAPL@5m") or partition ("AAPL@5m@2024-06")
+    name according to the partition registry, or None when it lists nothing by that name.
+    """
+    if not partitions_table_exists(connection):
+        return None
+    ticker, interval, *month = name.split(PARTITION_SEPARATOR)
+    conditions = ["ticker = :ticker", "interval = :interval"] + (["month = :month"] if month else [])
+    return connection.execute(
+        text(f"SELECT SUM(rows) FROM {INTRADAY_PARTITIONS_TABLE} WHERE {' AND '.join(conditions)}"),
+        {"ticker": ticker.upper(), "interval": interval.lower(), "month": month[0] if month else None}
+    ).scalar()
+
+def last_bar(engine, ticker, interval):
+    """
+    Returns the start time of the most recent stored bar, or None when nothing is stored.
+    """
+    with engine.connect() as connection:
+        if not partitions_table_exists(connection):
+            return None
+        return connection.execute(
+            text(f"SELECT MAX(last_bar) FROM {INTRADAY_PARTITIONS_TABLE} WHERE ticker = :ticker AND interval = :interval"),
+            {"ticker": ticker.upper(), "interval": interval}
+        ).scalar()
+
+def union_partitions(tables, start=None, end=None):
+    """
+    Builds a SELECT over the given partitions; an empty list gives an empty result.
+    """
+    columns = ", ".join(f'"{col}"' for col in BAR_COLUMNS)
+    if not tables:
+        return f"SELECT {', '.join(f'NULL AS {col}' for col in BAR_COLUMNS)} LIMIT 0"
+    conditions = []
+    if start is not None:
+        conditions.append(f""""Datetime" >= '{start}'""")
+    if end is not None:
+        conditions.append(f""""Datetime" <= '{end}'""")
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return " UNION ALL ".join(f'SELECT {columns} FROM "{table}"{where}' for table in tables)
+
+def write_bars(connection, ticker, interval, df):
+    """
+    Upserts bars into the monthly partitions they fall in and refreshes those
+    partitions' entries. Returns the months written.
+    """
+    connection.execute(text(CREATE_PARTITIONS_TABLE))
+    df = df.reindex(columns=BAR_COLUMNS).dropna(subset=["Datetime"])
+    df["Volume"] = df["Volume"].astype("Int64")
+    now = time.time()
+    months = []
+    for month, bars in df.groupby(df["Datetime"].str[:7], sort=True):
+        table = partition_name(ticker, interval, month)
+        connection.execute(text(CREATE_PARTITION.format(table=table)))
+        bulk_insert(
+            connection,
+            f'INSERT OR REPLACE INTO "{table}" ({", ".join(BAR_COLUMNS)}) VALUES ({", ".join("?" for _ in BAR_COLUMNS)})',
+            bars.astype(object).where(bars.notna(), None).itertuples(index=False, name=None)
+        )
+        connection.execute(
+            text(
+                f"INSERT OR REPLACE INTO {INTRADAY_PARTITIONS_TABLE} "
+                f"(ticker, interval, month, table_name, rows, first_bar, last_bar, updated_at) "
+                f'SELECT :ticker, :interval, :month, :table, COUNT(*), MIN("Datetime"), MAX("Datetime"), :now FROM "{table}"'
+            ),
+            {"ticker": ticker, "interval": interval, "month": month, "table": table, "now": now}
+        )
+        months.append(month)
+    return months
+
+def store_intraday_bars(engine, ticker, interval, df):
+    """
+    Upserts downloaded intraday bars for the ticker. Bars are never deleted by
+    a download, so history older than Yahoo's window keeps accumulating.
+    """
+    with engine.begin() as connection:
+        write_bars(connection, ticker, interval, df)
+    bump_data_version(series_name(ticker, interval))
+    return len(df)
+
+def read_intraday(ticker, interval, engine, start=None, end=None):
+    """
+    Returns a ticker's bars between start and end (inclusive, UTC) indexed by
+    Datetime, reading only the partitions that overlap the range.
+    """
+    start = pd.Timestamp(start).strftime('%Y-%m-%d %H:%M:%S') if start is not None else None
+    end = pd.Timestamp(end).strftime('%Y-%m-%d %H:%M:%S') if end is not None else None
+    with get_read_engine(engine).connect() as connection:
+        tables = partition_tables(connection, ticker, interval, start, end)
+        query = f'SELECT * FROM ({union_partitions(tables, start, end)}) ORDER BY "Datetime"'
+        df = pd.read_sql_query(text(query), connection)
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.pop("Datetime")), name="Datetime")
+    return df
+
+def datetime_bounds(query):
+    """
+    Returns the tightest Datetime range implied by the query's WHERE clause.
+    Only conjuncts that are a bare comparison of Datetime with a literal count,
+    and nothing is pruned when the query negates, branches or nests a SELECT,
+    since a comparison there does not bound the rows that are read.
+    """
+    literals = []
+
+    def mask(match):
+        literals.append(match.group(0)[1:-1].replace("''", "'"))
+        return f"'{len(literals) - 1}'"
+
+    masked = STRING_LITERAL_PATTERN.sub(mask, query)
+    where = WHERE_CLAUSE_PATTERN.search(masked)
+    if where is None or UNPRUNABLE_PATTERN.search(masked):
+        return None, None
+
+    comparisons = []
+    # BETWEEN's AND is not a conjunction, so BETWEEN conditions are taken out first
+    for low, high in DATETIME_BETWEEN_PATTERN.findall(where.group(1)):
+        comparisons += [(">=", literals[int(low)]), ("<=", literals[int(high)])]
+    conjuncts = re.split(r"\bAND\b", DATETIME_BETWEEN_PATTERN.sub("1", where.group(1)), flags=re.IGNORECASE)
+    for conjunct in conjuncts:
+        match = DATETIME_BOUND_PATTERN.fullmatch(conjunct.strip().lstrip("(").rstrip(")").strip())
+        if match:
+            comparisons.append((match.group(1), literals[int(match.group(2))]))
+
+    start = end = None
+    for op, value in comparisons:
+        if op in (">", ">=", "="):
+            start = value if start is None else max(start, value)
+        if op in ("<", "<=", "="):
+            end = value if end is None else min(end, value)
+    return start, end
+
+def expand_intraday_query(query, connection):
+    """
+    Rewrites references such as "AAPL@5m" into common table expressions over the
+    ticker's partitions. When the query reads a single series once, literal
+    Datetime comparisons in its WHERE clause prune the months that cannot match; SQLite
+    pushes the comparisons themselves down into each partition's primary key.
+    """
+    references = sorted({(ticker.upper(), interval.lower()) for ticker, interval in INTRADAY_REFERENCE_PATTERN.findall(query)})
+    if not references:
+        return query
+
+    start = end = None
+    # A series read twice, e.g. joined with itself, may be bounded differently each time
+    if len(INTRADAY_REFERENCE_PATTERN.findall(query)) == 1:
+        start, end = datetime_bounds(query)
+
+    ctes = ", ".join(
+        f'"{series_name(ticker, interval)}" AS ({union_partitions(partition_tables(connection, ticker, interval, start, end))})'
+        for ticker, interval in references
+    )
+    # Bare references are quoted so they parse as names
+    query = INTRADAY_REFERENCE_PATTERN.sub(lambda m: f'"{series_name(m.group(1).upper(), m.group(2).lower())}"', query)
+    existing = re.match(r"\s*WITH(\s+RECURSIVE)?\s", query, re.IGNORECASE)
+    if existing:
+        return f"WITH{existing.group(1) or ''} {ctes}, {query[existing.end():]}"
+    return f"WITH {ctes} {query}"
+
+def roll_up_partition(connection, ticker, interval, month, target):
+    """
+    Aggregates one month of bars into bars of the target size and drops the
+    partition. Days that already have bars of the target size keep them.
+    """
+    table = partition_name(ticker, interval, month)
+    bars = pd.read_sql_query(text(f'SELECT * FROM "{table}" ORDER BY "Datetime"'), connection)
+    buckets = pd.to_datetime(bars["Datetime"]).dt.floor(f"{INTRADAY_INTERVALS[target]}s")
+    rolled = bars.groupby(buckets).agg(
+        Open=("Open", "first"), High=("High", "max"), Low=("Low", "min"), Close=("Close", "last"), Volume=("Volume", "sum")
+    )
+    rolled.index = rolled.index.strftime('%Y-%m-%d %H:%M:%S')
+    rolled = rolled.rename_axis("Datetime").reset_index()
+
+    target_table = partition_name(ticker, target, month)
+    stored_days = set()
+    if target_table in partition_tables(connection, ticker, target):
+        stored_days = {
+            row[0] for row in connection.execute(text(f'SELECT DISTINCT substr("Datetime", 1, 10) FROM "{target_table}"'))
+        }
+    rolled = rolled[~rolled["Datetime"].str[:10].isin(stored_days)]
+    if not rolled.empty:
+        write_bars(connection, ticker, target, rolled)
+
+    connection.execute(text(f'DROP TABLE "{table}"'))
+    connection.execute(
+        text(f"DELETE FROM {INTRADAY_PARTITIONS_TABLE} WHERE ticker = :ticker AND interval = :interval AND month = :month"),
+        {"ticker": ticker, "interval": interval, "month": month}
+    )
+    return len(rolled)
+
+def apply_retention(engine, ticker=None, now=None, policies=RETENTION_POLICIES):
+    """
+    Rolls up every month of bars that is entirely older than its bar size's
+    retention period, for one ticker or all of them. Finer sizes are handled
+    first, so a month can cascade through several sizes in one pass.
+    Returns one (ticker, interval, month, target, rows written) tuple per partition rolled up.
+    """
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now(tz="UTC").tz_localize(None)
+    rolled = []
+    with engine.begin() as connection:
+        if not partitions_table_exists(connection):
+            return rolled
+        for interval in INTRADAY_INTERVALS:
+            if interval not in policies:
+                continue
+            days, target = policies[interval]
+            cutoff = (now - pd.Timedelta(days=days)).strftime('%Y-%m')
+            conditions = "interval = :interval AND month < :cutoff" + (" AND ticker = :ticker" if ticker else "")
+            due = connection.execute(
+                text(f"SELECT ticker, month FROM {INTRADAY_PARTITIONS_TABLE} WHERE {conditions} ORDER BY ticker, month"),
+                {"interval": interval, "cutoff": cutoff, "ticker": ticker.upper() if ticker else None}
+            ).fetchall()
+            for due_ticker, month in due:
+                rows = roll_up_partition(connection, due_ticker, interval, month, target)
+                rolled.append((due_ticker, interval, month, target, rows))
+    for due_ticker, interval, _, target, _ in rolled:
+        bump_data_version(series_name(due_ticker, interval), series_name(due_ticker, target))
+    return rolled
+
+def main():
+    parser = argparse.ArgumentParser(description="Roll up intraday bars older than their retention period.")
+    parser.add_argument("--db", default="stocks.db", help="Path to the SQLite database")
+    parser.add_argument("tickers", nargs="*", help="Tickers to process (default: all)")
+    args = parser.parse_args()
+
+    engine = create_sqlite_engine(args.db)
+    for ticker in [ticker.upper() for ticker in args.tickers] or [None]:
+        for rolled_ticker, interval, month, target, rows in apply_retention(engine, ticker):
+            print(f"Rolled up {rolled_ticker} {interval} bars for {month} into {rows} {target} bars.")
+
+if __name__ == "__main__":
+    main()
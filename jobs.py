@@ -0,0 +1,334 @@
+# jobs.py
+
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+from database_utils import JOBS_TABLE, JOB_TICKERS_TABLE, SCHEDULES_TABLE, get_read_engine
+from data_extraction import extract_and_store_data
+
+# Seconds between checks for queued jobs and due schedules
+POLL_INTERVAL = 2.0
+
+# A running job whose heartbeat is older than this is assumed to belong to a
+# process that died, and is resumed
+STALE_JOB_SECONDS = 300
+
+# Seconds between heartbeats of a running job, however long one ticker takes
+HEARTBEAT_SECONDS = 30
+
+CREATE_JOB_TABLES = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {JOBS_TABLE} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT NOT NULL,
+        options TEXT NOT NULL,
+        schedule_id INTEGER,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        heartbeat_at REAL
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {JOB_TICKERS_TABLE} (
+        job_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        ticker TEXT NOT NULL,
+        status TEXT NOT NULL,
+        rows INTEGER,
+        bytes INTEGER,
+        attempts INTEGER,
+        seconds REAL,
+        error TEXT,
+        updated_at REAL,
+        PRIMARY KEY (job_id, ticker)
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {SCHEDULES_TABLE} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tickers TEXT NOT NULL,
+        options TEXT NOT NULL,
+        interval_seconds REAL NOT NULL,
+        next_run_at REAL NOT NULL,
+        enabled INTEGER NOT NULL DEFAULT 1
+    )
+    """,
+]
+
+# Columns added after the job tables were first released, with their types
+ADDED_JOB_COLUMNS = {JOB_TICKERS_TABLE: {"bytes": "INTEGER"}}
+
+def create_job_tables(engine):
+    with engine.begin() as connection:
+        for statement in CREATE_JOB_TABLES:
+            connection.execute(text(statement))
+        # CREATE TABLE IF NOT EXISTS leaves tables from older versions unchanged
+        for table, columns in ADDED_JOB_COLUMNS.items():
+            existing = {row[1] for row in connection.execute(text(f"PRAGMA table_info({table})"))}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+def submit_job(engine, tickers, schedule_id=None, status="queued", **options):
+    """
+    Queues an ingestion job for the given tickers and returns its id.
+    options are passed on to extract_and_store_data (e.g. incremental=False).
+    Jobs created with status="running" are run by their creator rather than by a JobRunner.
+    """
+    tickers = list(dict.fromkeys(ticker.strip().upper() for ticker in tickers if ticker.strip()))
+    if not tickers:
+        raise ValueError("An ingestion job needs at least one ticker.")
+    now = time.time()
+    with engine.begin() as connection:
+        job_id = connection.execute(
+            text(f"INSERT INTO {JOBS_TABLE} (status, options, schedule_id, created_at, heartbeat_at) VALUES (:status, :options, :schedule_id, :now, :now)"),
+            {"status": status, "options": json.dumps(options), "schedule_id": schedule_id, "now": now}
+        ).lastrowid
+        connection.execute(
+            text(f"INSERT INTO {JOB_TICKERS_TABLE} (job_id, position, ticker, status, updated_at) VALUES (:job_id, :position, :ticker, 'pending', :now)"),
+            [{"job_id": job_id, "position": i, "ticker": ticker, "now": now} for i, ticker in enumerate(tickers)]
+        )
+    return job_id
+
+def schedule_refresh(engine, tickers, interval_seconds, first_run_at=None, **options):
+    """
+    Registers a recurring ingestion of the given tickers every interval_seconds.
+    """
+    tickers = [ticker.strip().upper() for ticker in tickers if ticker.strip()]
+    with engine.begin() as connection:
+        return connection.execute(
+            text(f"INSERT INTO {SCHEDULES_TABLE} (tickers, options, interval_seconds, next_run_at) VALUES (:tickers, :options, :interval, :next_run_at)"),
+            {
+                "tickers": ",".join(tickers),
+                "options": json.dumps(options),
+                "interval": interval_seconds,
+                "next_run_at": first_run_at if first_run_at is not None else time.time(),
+            }
+        ).lastrowid
+
+def cancel_schedule(engine, schedule_id):
+    with engine.begin() as connection:
+        connection.execute(text(f"UPDATE {SCHEDULES_TABLE} SET enabled = 0 WHERE id = :id"), {"id": schedule_id})
+
+def list_jobs(engine, limit=20):
+    """
+    Returns the most recent jobs with their ticker counts by status.
+    """
+    query = f"""
+        SELECT j.id, j.status, j.created_at, j.started_at, j.finished_at,
+               COUNT(t.ticker) AS tickers,
+               SUM(t.status NOT IN ('pending')) AS processed,
+               SUM(t.status = 'failed') AS failed
+        FROM {JOBS_TABLE} j LEFT JOIN {JOB_TICKERS_TABLE} t ON t.job_id = j.id
+        GROUP BY j.id ORDER BY j.id DESC LIMIT :limit
+    """
+    with get_read_engine(engine).connect() as connection:
+        jobs = pd.read_sql_query(text(query), connection, params={"limit": limit})
+    for col in ("created_at", "started_at", "finished_at"):
+        jobs[col] = pd.to_datetime(jobs[col], unit="s")
+    return jobs
+
+def get_job_progress(engine, job_id):
+    """
+    Returns the job row as a dict, with its per-ticker status frame under "tickers".
+    """
+    reader = get_read_engine(engine)
+    with reader.connect() as connection:
+        job = connection.execute(text(f"SELECT * FROM {JOBS_TABLE} WHERE id = :id"), {"id": job_id}).mappings().fetchone()
+        if job is None:
+            return None
+        tickers = pd.read_sql_query(
+            text(f"SELECT ticker, status, rows, bytes, attempts, seconds, error FROM {JOB_TICKERS_TABLE} WHERE job_id = :id ORDER BY position"),
+            connection,
+            params={"id": job_id}
+        )
+    progress = dict(job)
+    progress["tickers"] = tickers
+    progress["total"] = len(tickers)
+    progress["processed"] = int((tickers["status"] != "pending").sum())
+    progress["failed"] = int((tickers["status"] == "failed").sum())
+    return progress
+
+def record_result(engine, job_id, result):
+    """
+    Stores one ticker's ingestion summary and refreshes the job's heartbeat.
+    """
+    now = time.time()
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                f"UPDATE {JOB_TICKERS_TABLE} SET status = :status, rows = :rows, bytes = :bytes, attempts = :attempts, "
+                f"seconds = :seconds, error = :error, updated_at = :now WHERE job_id = :job_id AND ticker = :ticker"
+            ),
+            {**result, "now": now, "job_id": job_id}
+        )
+        connection.execute(text(f"UPDATE {JOBS_TABLE} SET heartbeat_at = :now WHERE id = :id"), {"now": now, "id": job_id})
+
+def keep_alive(engine, job_id, stop):
+    """
+    Refreshes the job's heartbeat every HEARTBEAT_SECONDS until stop is set, so a
+    job busy with a slow ticker is not mistaken for one whose process died.
+    """
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            with engine.begin() as connection:
+                connection.execute(
+                    text(f"UPDATE {JOBS_TABLE} SET heartbeat_at = :now WHERE id = :id"), {"now": time.time(), "id": job_id}
+                )
+        except Exception as e:
+            print(f"Error refreshing the heartbeat of ingestion job {job_id}: {e}")
+
+def run_job(engine, job_id, fetcher=None, **overrides):
+    """
+    Runs the pending tickers of a job in the calling thread and marks it finished.
+    Tickers that already have a recorded result are skipped, so an interrupted
+    job picks up where it stopped. overrides replace stored job options.
+    """
+    with engine.connect() as connection:
+        options = json.loads(connection.execute(
+            text(f"SELECT options FROM {JOBS_TABLE} WHERE id = :id"), {"id": job_id}
+        ).scalar_one())
+        pending = [row[0] for row in connection.execute(
+            text(f"SELECT ticker FROM {JOB_TICKERS_TABLE} WHERE job_id = :id AND status = 'pending' ORDER BY position"),
+            {"id": job_id}
+        )]
+
+    now = time.time()
+    with engine.begin() as connection:
+        connection.execute(
+            text(f"UPDATE {JOBS_TABLE} SET status = 'running', started_at = COALESCE(started_at, :now), heartbeat_at = :now WHERE id = :id"),
+            {"now": now, "id": job_id}
+        )
+
+    status = "done"
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(
+        target=keep_alive, args=(engine, job_id, stop_heartbeat), name=f"ingest-job-{job_id}-heartbeat", daemon=True
+    )
+    heartbeat.start()
+    try:
+        extract_and_store_data(
+            pending, engine,
+            fetcher=fetcher,
+            on_result=lambda result: record_result(engine, job_id, result),
+            **{**options, **overrides}
+        )
+    except Exception as e:
+        print(f"Error while running ingestion job {job_id}: {e}")
+        status = "failed"
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+
+    with engine.begin() as connection:
+        connection.execute(
+            text(f"UPDATE {JOBS_TABLE} SET status = :status, finished_at = :now WHERE id = :id"),
+            {"status": status, "now": time.time(), "id": job_id}
+        )
+    return status
+
+class JobRunner:
+    """
+    Runs queued ingestion jobs on a background thread, records per-ticker
+    progress in the job tables and submits jobs for due schedules.
+    Jobs left running by a process that stopped are resumed from their
+    pending tickers.
+    """
+    def __init__(self, engine, poll_interval=POLL_INTERVAL, fetcher=None):
+        self.engine = engine
+        self.fetcher = fetcher
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        create_job_tables(self.engine)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-job-runner", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, tickers, **options):
+        job_id = submit_job(self.engine, tickers, **options)
+        self._wake.set()
+        return job_id
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._submit_due_schedules()
+                job_id = self._claim_next_job()
+                if job_id is not None:
+                    self._run_job(job_id)
+                    continue
+            except Exception as e:
+                print(f"Error in ingestion job runner: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _submit_due_schedules(self):
+        now = time.time()
+        with self.engine.begin() as connection:
+            due = connection.execute(
+                text(f"SELECT id, tickers, options, interval_seconds, next_run_at FROM {SCHEDULES_TABLE} WHERE enabled = 1 AND next_run_at <= :now"),
+                {"now": now}
+            ).fetchall()
+            for schedule_id, tickers, options, interval, next_run_at in due:
+                # Skip missed runs instead of queueing one job per missed interval
+                while next_run_at <= now:
+                    next_run_at += interval
+                connection.execute(
+                    text(f"UPDATE {SCHEDULES_TABLE} SET next_run_at = :next_run_at WHERE id = :id"),
+                    {"next_run_at": next_run_at, "id": schedule_id}
+                )
+        for schedule_id, tickers, options, _, _ in due:
+            submit_job(self.engine, tickers.split(","), schedule_id=schedule_id, **json.loads(options))
+
+    def _claim_next_job(self):
+        now = time.time()
+        with self.engine.begin() as connection:
+            row = connection.execute(
+                text(
+                    f"SELECT id FROM {JOBS_TABLE} WHERE status = 'queued' "
+                    f"OR (status = 'running' AND heartbeat_at < :stale) ORDER BY id LIMIT 1"
+                ),
+                {"stale": now - STALE_JOB_SECONDS}
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                text(f"UPDATE {JOBS_TABLE} SET status = 'running', started_at = COALESCE(started_at, :now), heartbeat_at = :now WHERE id = :id"),
+                {"now": now, "id": row[0]}
+            )
+        return row[0]
+
+    def _run_job(self, job_id):
+        run_job(self.engine, job_id, fetcher=self.fetcher)
+
+_runners = {}
+_runners_lock = threading.Lock()
+
+def get_job_runner(engine):
+    """
+    Returns the process-wide job runner for the engine's database, starting it on first use.
+    """
+    key = os.path.abspath(engine.url.database or "")
+    with _runners_lock:
+        if key not in _runners:
+            _runners[key] = JobRunner(engine)
+            _runners[key].start()
+        return _runners[key]
@@ -0,0 +1,129 @@
+# panel.py
+
+import numpy as np
+import pandas as pd
+
+from database_utils import PRICES_TABLE
+from data_querying import get_prices
+from instrumentation import span
+from query_cache import query_cache, make_data_key
+
+# Trading days a price may be carried forward over holidays and missing bars
+DEFAULT_FILL_LIMIT = 5
+
+# Observations per rolling beta estimate (about three months of trading days)
+DEFAULT_BETA_WINDOW = 63
+
+# Overlapping returns required before a correlation is reported
+DEFAULT_MIN_PERIODS = 20
+
+def load_panel(tickers, engine, column="Close", start=None, end=None, fill_limit=DEFAULT_FILL_LIMIT, use_cache=True):
+    """
+    Returns one price column for several tickers as an aligned Date x Ticker frame
+    backed by a single float64 matrix. Rows are the union of the tickers' dates;
+    gaps of up to fill_limit rows are forward-filled (None fills any gap, 0 none),
+    and dates before a ticker's first bar stay NaN.
+    Panels are cached until one of the tickers is rewritten.
+    """
+    tickers = list(dict.fromkeys(ticker.strip().upper() for ticker in tickers if ticker.strip()))
+    if use_cache:
+        description = ("panel", tuple(tickers), column, str(start), str(end), fill_limit)
+        cache_key = make_data_key(description, tickers + [PRICES_TABLE], engine)
+        cached = query_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    with span("panel_build", tickers=len(tickers)) as record:
+        prices = get_prices(tickers, engine, start=start, end=end, columns=[column])
+        dates, rows = np.unique(prices.index.to_numpy(), return_inverse=True)
+        columns = pd.Categorical(prices["Ticker"], categories=tickers).codes
+
+        matrix = np.full((len(dates), len(tickers)), np.nan)
+        matrix[rows, columns] = prices[column].to_numpy(dtype=float)
+        panel = pd.DataFrame(matrix, index=pd.DatetimeIndex(dates, name="Date"), columns=pd.Index(tickers, name="Ticker"))
+        if fill_limit != 0:
+            panel = panel.ffill(limit=fill_limit)
+        record["rows"] = len(panel)
+
+    if use_cache:
+        query_cache.put(cache_key, panel)
+    return panel
+
+def panel_returns(panel, log=False):
+    """
+    Returns the per-period simple (or log) returns of a panel; the first row is dropped.
+    """
+    values = panel.to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.log(values[1:] / values[:-1]) if log else values[1:] / values[:-1] - 1.0
+    return pd.DataFrame(returns, index=panel.index[1:], columns=panel.columns)
+
+def correlation_matrix(returns, min_periods=DEFAULT_MIN_PERIODS):
+    """
+    Pairwise Pearson correlation of the columns of a returns frame, using for each
+    pair only the rows where both are present. Computed with a handful of matrix
+    products instead of one pass per pair.
+    """
+    values = returns.to_numpy(dtype=float)
+    present = ~np.isnan(values)
+    x = np.where(present, values, 0.0)
+    m = present.astype(float)
+
+    n = m.T @ m
+    # sum_x[i, j] is the sum of column i over the rows where both i and j are present
+    sum_x = x.T @ m
+    sum_xx = (x * x).T @ m
+    sum_xy = x.T @ x
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sum_xy - sum_x * sum_x.T / n
+        var_x = sum_xx - sum_x ** 2 / n
+        corr = cov / np.sqrt(var_x * var_x.T)
+    corr[n < max(min_periods, 2)] = np.nan
+    np.fill_diagonal(corr, np.where(np.diag(n) >= max(min_periods, 2), 1.0, np.nan))
+    return pd.DataFrame(np.clip(corr, -1.0, 1.0), index=returns.columns, columns=returns.columns)
+
+def rolling_window_sum(values, window):
+    """
+    Sums each column over a trailing window using cumulative sums.
+    """
+    sums = np.cumsum(np.vstack([np.zeros((1, values.shape[1])), values]), axis=0)
+    out = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        out[window - 1:] = sums[window:] - sums[:-window]
+    return out
+
+def rolling_beta(returns, benchmark, window=DEFAULT_BETA_WINDOW):
+    """
+    Rolling beta of every column of a returns frame against the benchmark column,
+    over a trailing window of rows. A beta is reported only when both series are
+    present on every row of its window.
+    """
+    values = returns.to_numpy(dtype=float)
+    market = returns[benchmark].to_numpy(dtype=float)[:, None]
+    present = ~np.isnan(values) & ~np.isnan(market)
+    x = np.where(present, values, 0.0)
+    y = np.where(present, market, 0.0)
+
+    n = rolling_window_sum(present.astype(float), window)
+    sum_x = rolling_window_sum(x, window)
+    sum_y = rolling_window_sum(y, window)
+    sum_xy = rolling_window_sum(x * y, window)
+    sum_yy = rolling_window_sum(y * y, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        beta = (sum_xy - sum_x * sum_y / n) / (sum_yy - sum_y ** 2 / n)
+    beta[n < window] = np.nan
+    return pd.DataFrame(beta, index=returns.index, columns=returns.columns)
+
+def relative_performance(panel, benchmark=None):
+    """
+    Growth of one unit invested at each ticker's first available price. With a
+    benchmark, each series is divided by the benchmark's growth on the same date.
+    """
+    values = panel.to_numpy(dtype=float)
+    present = ~np.isnan(values)
+    first = np.where(present.any(axis=0), present.argmax(axis=0), 0)
+    base = values[first, np.arange(values.shape[1])]
+    growth = pd.DataFrame(values / base, index=panel.index, columns=panel.columns)
+    if benchmark is not None:
+        growth = growth.div(growth[benchmark], axis=0)
+    return growth
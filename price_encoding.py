@@ -0,0 +1,78 @@
+# price_encoding.py
+
+import numpy as np
+import pandas as pd
+
+# Price columns stored as integers scaled by a per-ticker power of ten
+SCALED_COLUMNS = ["Open", "High", "Low", "Close"]
+
+# Most decimal digits kept for a price; 10 ** 9 keeps prices up to ~9e9 within int64
+MAX_SCALE_DIGITS = 9
+
+# Largest relative error allowed when a price is rounded to its scale. Far below the
+# tolerance incremental refreshes use to compare stored and downloaded prices.
+PRICE_TOLERANCE = 1e-8
+
+# Relative change in Adj_Close / Close treated as a new adjustment (dividend or split)
+ADJUSTMENT_TOLERANCE = 1e-6
+
+def scale_fits(values, scale):
+    """
+    Returns True if every finite value survives rounding to 1 / scale within PRICE_TOLERANCE.
+    """
+    values = np.asarray(values, dtype=float).ravel()
+    values = values[np.isfinite(values) & (values != 0)]
+    error = np.abs(np.round(values * scale) / scale - values)
+    return bool((error <= PRICE_TOLERANCE * np.abs(values)).all())
+
+def choose_scale(df):
+    """
+    Returns the smallest power of ten that stores the frame's prices within PRICE_TOLERANCE.
+    Smaller scales give smaller integers, which SQLite stores in fewer bytes.
+    """
+    values = df.reindex(columns=SCALED_COLUMNS).to_numpy(dtype=float)
+    for digits in range(MAX_SCALE_DIGITS + 1):
+        if scale_fits(values, 10 ** digits):
+            return 10 ** digits
+    return 10 ** MAX_SCALE_DIGITS
+
+def encode_prices(values, scale):
+    """
+    Rounds prices to integers at the given scale; missing prices become None.
+    """
+    values = np.asarray(values, dtype=float)
+    encoded = pd.Series(np.round(values * scale)).astype("Int64")
+    return encoded.astype(object).where(encoded.notna(), None).to_numpy()
+
+def adjustment_events(dates, close, adj_close):
+    """
+    Reduces the Adj_Close / Close ratio of each row to the rows where it changes
+    by more than ADJUSTMENT_TOLERANCE from the factor in force. Returns the event
+    dates and the factor that applies from each date on. Missing factors are kept
+    as NaN events so they decode back to missing values.
+    """
+    dates = np.asarray(dates)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factors = np.asarray(adj_close, dtype=float) / np.asarray(close, dtype=float)
+    factors[~np.isfinite(factors)] = np.nan
+
+    starts = []
+    current = None
+    for i, factor in enumerate(factors.tolist()):
+        if current is None or (np.isnan(factor) != np.isnan(current)) or (
+            not np.isnan(factor) and abs(factor / current - 1.0) > ADJUSTMENT_TOLERANCE
+        ):
+            starts.append(i)
+            current = factor
+    return dates[starts], factors[starts]
+
+def apply_adjustments(dates, close, event_dates, factors):
+    """
+    Rebuilds Adj_Close from Close and the adjustment events that precede each date.
+    """
+    close = np.asarray(close, dtype=float)
+    positions = np.searchsorted(np.asarray(event_dates), np.asarray(dates), side="right") - 1
+    adjusted = np.full(len(close), np.nan)
+    known = positions >= 0
+    adjusted[known] = close[known] * np.asarray(factors, dtype=float)[positions[known]]
+    return adjusted
@@ -0,0 +1,464 @@
+# price_store.py
+
+import argparse
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from catalog import rebuild_catalog
+from database_utils import (
+    PRICES_TABLE, PRICE_SCALES_TABLE, ADJUSTMENTS_TABLE, create_sqlite_engine, table_exists, list_ticker_tables, bulk_insert,
+    begin_transaction
+)
+from price_encoding import ADJUSTMENT_TOLERANCE, SCALED_COLUMNS, scale_fits, choose_scale, encode_prices, adjustment_events, apply_adjustments
+from query_cache import bump_data_version
+
+# Dates in the prices table are stored as whole days since this epoch
+EPOCH = pd.Timestamp("1970-01-01")
+
+# julianday() of EPOCH, used to convert TEXT dates inside SQLite
+EPOCH_JULIAN_DAY = 2440587.5
+
+# Mapping between the per-ticker column names and the prices table columns
+PRICE_COLUMNS = {
+    "Date": "date",
+    "Open": "open",
+    "High": "high",
+    "Low": "low",
+    "Close": "close",
+    "Adj_Close": "adj_close",
+    "Volume": "volume",
+}
+
+CREATE_PRICES_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {PRICES_TABLE} (
+    ticker TEXT NOT NULL,
+    date INTEGER NOT NULL,
+    open REAL,
+    high REAL,
+    low REAL,
+    close REAL,
+    adj_close REAL,
+    volume INTEGER,
+    PRIMARY KEY (ticker, date)
+) WITHOUT ROWID
+"""
+
+# The ISO date the ticker views expose as "Date", and an index on it. Without the index,
+# Date filters and joins on the views loop over every row of each ticker. SQLite only
+# prefers the index over the (ticker, date) key once ANALYZE has gathered statistics.
+VIEW_DATE_EXPRESSION = "date({table}date * 86400, 'unixepoch')"
+PRICES_DATE_INDEX = f"idx_{PRICES_TABLE}_iso_date"
+CREATE_PRICES_DATE_INDEX = (
+    f"CREATE INDEX IF NOT EXISTS {PRICES_DATE_INDEX} ON {PRICES_TABLE} (ticker, {VIEW_DATE_EXPRESSION.format(table='')})"
+)
+
+UPSERT_PRICES = (
+    f"INSERT OR REPLACE INTO {PRICES_TABLE} (ticker, {', '.join(PRICE_COLUMNS.values())}) "
+    f"VALUES (?, {', '.join('?' for _ in PRICE_COLUMNS)})"
+)
+
+# Columns of the compact prices table. Prices are integers scaled by the ticker's
+# entry in PRICE_SCALES_TABLE; Adj_Close is rebuilt from the adjustment factors
+# in ADJUSTMENTS_TABLE, which only change on dividend and split dates.
+COMPACT_COLUMNS = {col: long_col for col, long_col in PRICE_COLUMNS.items() if col != "Adj_Close"}
+
+CREATE_COMPACT_TABLES = [
+    f"""
+CREATE TABLE IF NOT EXISTS {PRICES_TABLE} (
+    ticker TEXT NOT NULL,
+    date INTEGER NOT NULL,
+    open INTEGER,
+    high INTEGER,
+    low INTEGER,
+    close INTEGER,
+    volume INTEGER,
+    PRIMARY KEY (ticker, date)
+) WITHOUT ROWID
+""",
+    f"""
+CREATE TABLE IF NOT EXISTS {PRICE_SCALES_TABLE} (
+    ticker TEXT PRIMARY KEY,
+    scale INTEGER NOT NULL
+)
+""",
+    f"""
+CREATE TABLE IF NOT EXISTS {ADJUSTMENTS_TABLE} (
+    ticker TEXT NOT NULL,
+    date INTEGER NOT NULL,
+    factor REAL,
+    PRIMARY KEY (ticker, date)
+) WITHOUT ROWID
+""",
+]
+
+UPSERT_COMPACT_PRICES = (
+    f"INSERT OR REPLACE INTO {PRICES_TABLE} (ticker, {', '.join(COMPACT_COLUMNS.values())}) "
+    f"VALUES (?, {', '.join('?' for _ in COMPACT_COLUMNS)})"
+)
+
+# Bits reserved for the epoch day when (ticker, date) pairs are packed into one integer
+DAY_BITS = 32
+
+UPSERT_ADJUSTMENTS = f"INSERT OR REPLACE INTO {ADJUSTMENTS_TABLE} (ticker, date, factor) VALUES (?, ?, ?)"
+
+def to_epoch_days(dates):
+    """
+    Converts a Series of dates (strings or datetimes) to integer days since EPOCH.
+    """
+    return (pd.to_datetime(dates) - EPOCH).dt.days
+
+def from_epoch_days(days):
+    """
+    Converts integer days since EPOCH back to a DatetimeIndex.
+    """
+    return pd.to_datetime(days, unit="D")
+
+def uses_prices_table(engine):
+    """
+    Returns True if the database has been switched to the consolidated prices table.
+    """
+    return table_exists(engine, PRICES_TABLE)
+
+def stores_in_prices_table(engine, ticker):
+    """
+    Returns True if writes for the ticker should go to the prices table.
+    Tickers that still have their own (unmigrated) table keep using it.
+    """
+    return uses_prices_table(engine) and not table_exists(engine, ticker, include_views=False)
+
+def is_compact(connection):
+    """
+    Returns True if the prices table uses the compact encoding.
+    """
+    return connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": PRICE_SCALES_TABLE}
+    ).first() is not None
+
+def uses_compact_encoding(engine):
+    return table_exists(engine, PRICE_SCALES_TABLE, include_views=False)
+
+def create_prices_date_index(connection):
+    """
+    Creates the index behind the views' Date column on a prices table that lacks
+    it, e.g. one migrated by an earlier version, and gathers its statistics.
+    """
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name AND tbl_name = :table"),
+        {"name": PRICES_DATE_INDEX, "table": PRICES_TABLE}
+    ).first()
+    if not exists:
+        connection.execute(text(CREATE_PRICES_DATE_INDEX))
+        connection.execute(text(f"ANALYZE {PRICES_TABLE}"))
+
+def create_ticker_view(connection, ticker):
+    """
+    Creates a view named after the ticker that exposes its rows with the per-ticker column names.
+    """
+    create_prices_date_index(connection)
+    if is_compact(connection):
+        create_compact_ticker_view(connection, ticker)
+        return
+    columns = ", ".join(f'{long_col} AS "{col}"' for col, long_col in PRICE_COLUMNS.items() if col != "Date")
+    columns = f"""{VIEW_DATE_EXPRESSION.format(table='')} AS "Date", {columns}"""
+    connection.execute(text(
+        f'CREATE VIEW IF NOT EXISTS "{ticker}" AS '
+        f"SELECT {columns} FROM {PRICES_TABLE} WHERE ticker = '{ticker}'"
+    ))
+
+def create_compact_ticker_view(connection, ticker):
+    """
+    Creates a ticker view that decodes the compact prices table.
+    """
+    prices = ", ".join(f'p.{COMPACT_COLUMNS[col]} * 1.0 / s.scale AS "{col}"' for col in SCALED_COLUMNS)
+    factor = (
+        f"(SELECT factor FROM {ADJUSTMENTS_TABLE} a WHERE a.ticker = p.ticker AND a.date <= p.date "
+        f"ORDER BY a.date DESC LIMIT 1)"
+    )
+    connection.execute(text(
+        f'CREATE VIEW IF NOT EXISTS "{ticker}" AS '
+        f"""SELECT {VIEW_DATE_EXPRESSION.format(table='p.')} AS "Date", {prices}, """
+        f'p.close * {factor} / s.scale AS "Adj_Close", p.volume AS "Volume" '
+        f"FROM {PRICES_TABLE} p JOIN {PRICE_SCALES_TABLE} s ON s.ticker = p.ticker WHERE p.ticker = '{ticker}'"
+    ))
+
+def frame_to_rows(ticker, df):
+    """
+    Converts a frame with per-ticker column names into row tuples for UPSERT_PRICES.
+    """
+    df = df.reindex(columns=list(PRICE_COLUMNS))
+    df['Date'] = to_epoch_days(df['Date'])
+    df.insert(0, "ticker", ticker)
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+def read_compact_prices(connection, tickers, start=None, end=None, columns=None):
+    """
+    Reads and decodes rows of the compact prices table for several tickers,
+    optionally limited to a range of epoch days. Returns a frame with Ticker,
+    Date (epoch days) and the requested per-ticker columns, ordered by ticker and date.
+    """
+    columns = list(columns) if columns is not None else [col for col in PRICE_COLUMNS if col != "Date"]
+    params = {f"t{i}": ticker for i, ticker in enumerate(tickers)}
+    conditions = [f"p.ticker IN ({', '.join(':' + name for name in params)})"]
+    if start is not None:
+        conditions.append("p.date >= :start")
+        params["start"] = int(start)
+    if end is not None:
+        conditions.append("p.date <= :end")
+        params["end"] = int(end)
+    where = " AND ".join(conditions)
+
+    cursor = connection.execute(
+        text(
+            f"SELECT p.ticker, p.date, {', '.join('p.' + COMPACT_COLUMNS[col] for col in COMPACT_COLUMNS if col != 'Date')}, s.scale "
+            f"FROM {PRICES_TABLE} p JOIN {PRICE_SCALES_TABLE} s ON s.ticker = p.ticker WHERE {where} ORDER BY p.ticker, p.date"
+        ),
+        params
+    )
+    raw = pd.DataFrame.from_records(cursor.fetchall(), columns=list(cursor.keys()))
+    df = pd.DataFrame({"Ticker": raw["ticker"], "Date": raw["date"].astype("int64")})
+    scale = raw["scale"].to_numpy(dtype=float)
+    for col in columns:
+        if col in SCALED_COLUMNS:
+            df[col] = raw[COMPACT_COLUMNS[col]].to_numpy(dtype=float) / scale
+        elif col == "Volume":
+            df[col] = raw["volume"]
+    if "Adj_Close" in columns:
+        df["Adj_Close"] = decode_adjusted_close(connection, raw, scale, params)
+    return df[["Ticker", "Date"] + columns]
+
+def decode_adjusted_close(connection, raw, scale, params):
+    """
+    Rebuilds Adj_Close for the rows read by read_compact_prices in one vectorized
+    pass over all tickers: (ticker, date) pairs are packed into sortable integers
+    so each row finds the last adjustment at or before it with a single searchsorted.
+    """
+    ticker_params = {name: value for name, value in params.items() if name.startswith("t")}
+    conditions = [f"ticker IN ({', '.join(':' + name for name in ticker_params)})"]
+    if "end" in params:
+        conditions.append("date <= :end")
+        ticker_params["end"] = params["end"]
+    events = pd.DataFrame.from_records(
+        connection.execute(
+            text(f"SELECT ticker, date, factor FROM {ADJUSTMENTS_TABLE} WHERE {' AND '.join(conditions)} ORDER BY ticker, date"),
+            ticker_params
+        ).fetchall(),
+        columns=["ticker", "date", "factor"]
+    )
+    codes = pd.Categorical(pd.concat([raw["ticker"], events["ticker"]])).codes.astype("int64")
+    row_codes, event_codes = codes[:len(raw)], codes[len(raw):]
+    row_keys = (row_codes << DAY_BITS) + raw["date"].to_numpy(dtype="int64")
+    event_keys = (event_codes << DAY_BITS) + events["date"].to_numpy(dtype="int64")
+
+    # Every stored ticker has an event on its first row, so the last event at or
+    # before a row's key always belongs to that row's ticker
+    close = raw["close"].to_numpy(dtype=float) / scale
+    return apply_adjustments(row_keys, close, event_keys, events["factor"].to_numpy(dtype=float))
+
+def write_compact_prices(connection, ticker, df, replace):
+    """
+    Encodes the rows of df into the compact tables. With replace the ticker's
+    stored rows are dropped first and a new scale is chosen; otherwise the rows
+    are merged into its history, which is re-encoded in full when they overlap
+    stored dates or need a finer scale than the stored one.
+    """
+    scale = connection.execute(
+        text(f"SELECT scale FROM {PRICE_SCALES_TABLE} WHERE ticker = :ticker"), {"ticker": ticker}
+    ).scalar()
+    df = df.reindex(columns=list(PRICE_COLUMNS)).copy()
+    df["Date"] = to_epoch_days(df["Date"])
+    df = df.sort_values("Date")
+
+    if not replace and scale is not None:
+        last = connection.execute(
+            text(f"SELECT MAX(date) FROM {PRICES_TABLE} WHERE ticker = :ticker"), {"ticker": ticker}
+        ).scalar()
+        overlaps = last is not None and df["Date"].iloc[0] <= last
+        if overlaps or not scale_fits(df[SCALED_COLUMNS], scale):
+            stored = read_compact_prices(connection, [ticker]).drop(columns="Ticker")
+            stored = stored[~stored["Date"].isin(df["Date"])]
+            df = pd.concat([stored, df]).sort_values("Date")
+            replace = True
+    if replace or scale is None:
+        scale = choose_scale(df)
+
+    first = int(df["Date"].iloc[0])
+    if replace:
+        delete_compact_prices(connection, ticker)
+    connection.execute(
+        text(f"INSERT OR REPLACE INTO {PRICE_SCALES_TABLE} (ticker, scale) VALUES (:ticker, :scale)"),
+        {"ticker": ticker, "scale": scale}
+    )
+
+    encoded = [encode_prices(df[col], scale) for col in SCALED_COLUMNS]
+    volume = df["Volume"].astype("Int64")
+    volume = volume.astype(object).where(volume.notna(), None)
+    bulk_insert(
+        connection, UPSERT_COMPACT_PRICES,
+        zip([ticker] * len(df), df["Date"].tolist(), *encoded, volume.tolist())
+    )
+
+    event_dates, factors = adjustment_events(df["Date"].to_numpy(), df["Close"], df["Adj_Close"])
+    if not replace and len(factors):
+        previous = connection.execute(
+            text(f"SELECT factor FROM {ADJUSTMENTS_TABLE} WHERE ticker = :ticker AND date < :first ORDER BY date DESC LIMIT 1"),
+            {"ticker": ticker, "first": first}
+        ).first()
+        # Appended rows usually continue the factor already in force
+        if previous is not None and same_factor(previous[0], factors[0]):
+            event_dates, factors = event_dates[1:], factors[1:]
+    bulk_insert(
+        connection, UPSERT_ADJUSTMENTS,
+        ((ticker, int(date), None if np.isnan(factor) else float(factor)) for date, factor in zip(event_dates, factors))
+    )
+
+def delete_compact_prices(connection, ticker):
+    for table in (PRICES_TABLE, PRICE_SCALES_TABLE, ADJUSTMENTS_TABLE):
+        connection.execute(text(f"DELETE FROM {table} WHERE ticker = :ticker"), {"ticker": ticker})
+
+def same_factor(stored, factor):
+    if stored is None or np.isnan(factor):
+        return stored is None and np.isnan(factor)
+    return abs(factor / stored - 1.0) <= ADJUSTMENT_TOLERANCE
+
+def replace_ticker_prices(engine, ticker, df):
+    """
+    Replaces every stored row of the ticker with the rows of df in one transaction.
+    """
+    with engine.begin() as connection:
+        if is_compact(connection):
+            delete_compact_prices(connection, ticker)
+            if not df.empty:
+                write_compact_prices(connection, ticker, df, replace=True)
+            create_ticker_view(connection, ticker)
+            return len(df)
+        connection.execute(text(f"DELETE FROM {PRICES_TABLE} WHERE ticker = :ticker"), {"ticker": ticker})
+        if not df.empty:
+            bulk_insert(connection, UPSERT_PRICES, frame_to_rows(ticker, df))
+        create_ticker_view(connection, ticker)
+    return len(df)
+
+def upsert_ticker_prices(engine, ticker, df):
+    """
+    Inserts or overwrites the rows of df for the ticker, keyed on (ticker, date).
+    """
+    if df.empty:
+        return 0
+    with engine.begin() as connection:
+        if is_compact(connection):
+            write_compact_prices(connection, ticker, df, replace=False)
+        else:
+            bulk_insert(connection, UPSERT_PRICES, frame_to_rows(ticker, df))
+        create_ticker_view(connection, ticker)
+    return len(df)
+
+def compact_prices_table(connection):
+    """
+    Converts a plain prices table to the compact encoding in place.
+    Must run inside a transaction opened with begin_transaction, so a failed
+    conversion also restores the renamed table and the dropped views.
+    Returns the number of rows converted per ticker.
+    """
+    if is_compact(connection) or not connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": PRICES_TABLE}
+    ).first():
+        return {}
+    tickers = [row[0] for row in connection.execute(text(f"SELECT DISTINCT ticker FROM {PRICES_TABLE} ORDER BY ticker"))]
+    # Renaming the table would rewrite the views over it, so they are recreated afterwards
+    for ticker in tickers:
+        connection.execute(text(f'DROP VIEW IF EXISTS "{ticker}"'))
+    plain = f"{PRICES_TABLE}_plain"
+    connection.execute(text(f"ALTER TABLE {PRICES_TABLE} RENAME TO {plain}"))
+    # The date index moved with the renamed table; the compact table gets its own
+    connection.execute(text(f"DROP INDEX IF EXISTS {PRICES_DATE_INDEX}"))
+    for statement in CREATE_COMPACT_TABLES:
+        connection.execute(text(statement))
+
+    converted = {}
+    selected = ", ".join(f'{long_col} AS "{col}"' for col, long_col in PRICE_COLUMNS.items())
+    for ticker in tickers:
+        df = pd.read_sql_query(
+            text(f"SELECT {selected} FROM {plain} WHERE ticker = :ticker ORDER BY date"), connection, params={"ticker": ticker}
+        )
+        df["Date"] = from_epoch_days(df["Date"])
+        write_compact_prices(connection, ticker, df, replace=True)
+        create_ticker_view(connection, ticker)
+        converted[ticker] = len(df)
+        print(f"Compacted {len(df)} rows for {ticker}.")
+    connection.execute(text(f"DROP TABLE {plain}"))
+    return converted
+
+def migrate_to_prices_table(engine, tickers=None, compact=False):
+    """
+    Moves per-ticker tables into the consolidated prices table and replaces
+    each of them with a compatibility view of the same name. With compact the
+    prices table uses the compact encoding, converting an existing plain one.
+    Returns the number of rows migrated per ticker.
+    """
+    migrated = {}
+    with engine.begin() as connection:
+        # The migration starts with schema changes, which must roll back with the rest
+        begin_transaction(connection)
+        if compact:
+            compact_prices_table(connection)
+            for statement in CREATE_COMPACT_TABLES:
+                connection.execute(text(statement))
+        else:
+            connection.execute(text(CREATE_PRICES_TABLE))
+        compact = is_compact(connection)
+        for ticker in list_ticker_tables(connection):
+            if tickers is not None and ticker not in tickers:
+                continue
+
+            existing = {row[1] for row in connection.execute(text(f'PRAGMA table_info("{ticker}")'))}
+            if "Date" not in existing:
+                print(f"Skipping {ticker}: not a price table.")
+                continue
+
+            if compact:
+                df = pd.read_sql_query(text(f'SELECT * FROM "{ticker}" WHERE "Date" IS NOT NULL'), connection)
+                if not df.empty:
+                    write_compact_prices(connection, ticker, df, replace=True)
+                rowcount = len(df)
+            else:
+                # Columns missing from older tables (e.g. Adj_Close) are migrated as NULL
+                source = ", ".join(f'"{col}"' if col in existing else "NULL" for col in PRICE_COLUMNS if col != "Date")
+                source = f'CAST(julianday("Date") - {EPOCH_JULIAN_DAY} AS INTEGER), {source}'
+                rowcount = connection.execute(
+                    text(
+                        f"INSERT OR REPLACE INTO {PRICES_TABLE} (ticker, {', '.join(PRICE_COLUMNS.values())}) "
+                        f'SELECT :ticker, {source} FROM "{ticker}" WHERE "Date" IS NOT NULL'
+                    ),
+                    {"ticker": ticker}
+                ).rowcount
+            connection.execute(text(f'DROP TABLE "{ticker}"'))
+            create_ticker_view(connection, ticker)
+            migrated[ticker] = rowcount
+            print(f"Migrated {rowcount} rows for {ticker}.")
+        create_prices_date_index(connection)
+        # Statistics from the full table keep the views' Date index preferred for joins
+        connection.execute(text(f"ANALYZE {PRICES_TABLE}"))
+    bump_data_version()
+    rebuild_catalog(engine)
+    return migrated
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate per-ticker tables into the consolidated prices table.")
+    parser.add_argument("--db", default="stocks.db", help="Path to the SQLite database")
+    parser.add_argument(
+        "--compact", action="store_true",
+        help="Store prices as scaled integers with adjustment events (converts an existing prices table)"
+    )
+    parser.add_argument("tickers", nargs="*", help="Tickers to migrate (default: all)")
+    args = parser.parse_args()
+
+    engine = create_sqlite_engine(args.db)
+    migrate_to_prices_table(engine, [ticker.upper() for ticker in args.tickers] or None, compact=args.compact)
+    if args.compact:
+        # Pages freed by the conversion are only returned to the file system by VACUUM
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("VACUUM"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# query_cache.py
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Default memory budget for cached query results, overridable through the environment
+DEFAULT_MAX_BYTES = int(os.environ.get("QUERY_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Words that can follow a table name and must not be taken for an alias
+SQL_KEYWORDS = {
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "NATURAL", "OUTER", "ON", "USING",
+    "GROUP", "ORDER", "LIMIT", "HAVING", "WINDOW", "UNION", "EXCEPT", "INTERSECT", "AS", "FROM", "SELECT",
+}
+
+# A table and its optional alias after FROM, JOIN or a comma of a FROM list. Intraday
+# series are named ticker@interval ("AAPL@5m"), their partitions ticker@interval@month.
+TABLE_PATTERN = re.compile(
+    r"(?:\bFROM|\bJOIN|,)\s+[\"`\[]?(\w+(?:@[\w-]+)*)[\"`\]]?"
+    rf"(?:\s+(?:AS\s+)?(?!(?:{'|'.join(SQL_KEYWORDS)})\b)(\w+))?",
+    re.IGNORECASE
+)
+
+# Single-quoted SQL string literals, whose whitespace is part of their value
+STRING_LITERAL_PATTERN = re.compile(r"('(?:[^']|'')*')")
+
+_versions = {}
+_global_version = 0
+_versions_lock = threading.Lock()
+
+def bump_data_version(*tables):
+    """
+    Marks the given tables as changed so cached results that read them are no longer used.
+    Called without arguments, invalidates every cached result.
+    """
+    global _global_version
+    with _versions_lock:
+        if not tables:
+            _global_version += 1
+        for table in tables:
+            table = table.upper()
+            _versions[table] = _versions.get(table, 0) + 1
+
+    # Entries keyed on the old versions can never be hit again, so free their memory now
+    if tables:
+        query_cache.discard_tables({table.upper() for table in tables})
+    else:
+        query_cache.clear()
+
+def get_data_version(table):
+    """
+    Returns the current data version of a table.
+    """
+    return _versions.get(table.upper(), 0)
+
+def normalize_query(query):
+    """
+    Normalizes whitespace outside string literals and trailing semicolons so
+    equivalent query text shares a cache entry.
+    """
+    # Odd parts are the literals captured by split
+    parts = STRING_LITERAL_PATTERN.split(query)
+    query = "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts))
+    return query.strip().rstrip(";").strip()
+
+def table_references(query):
+    """
+    Returns (table, alias) pairs for the tables the query reads after FROM, JOIN
+    or a comma; alias is empty when none is given. Commas of a select list also
+    match, which only adds names that are never written to.
+    """
+    return TABLE_PATTERN.findall(query)
+
+def referenced_tables(query):
+    """
+    Returns the table names referenced after FROM, JOIN or a comma in the query.
+    """
+    return sorted({table.upper() for table, _ in table_references(query)})
+
+def make_data_key(description, tables, engine):
+    """
+    Builds a cache key for any result derived from the given tables, so it is
+    invalidated together with cached queries when one of them is rewritten.
+    """
+    versions = tuple((table.upper(), get_data_version(table)) for table in tables)
+    return (str(engine.url), description, versions, _global_version)
+
+def make_cache_key(query, engine):
+    """
+    Builds a cache key from the normalized query and the data versions of the tables it reads.
+    """
+    query = normalize_query(query)
+    return make_data_key(query, referenced_tables(query), engine)
+
+class QueryCache:
+    """
+    Process-wide LRU cache of query results bounded by an approximate byte budget.
+    Cached frames are shared between callers and must not be modified in place.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        size = int(result.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (result, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def discard_tables(self, tables):
+        with self._lock:
+            for key in [key for key in self._entries if any(table in tables for table, _ in key[2])]:
+                self._bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+query_cache = QueryCache()
@@ -0,0 +1,270 @@
+# query_guard.py
+
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from database_utils import CATALOG_TABLE, PARTITION_SEPARATOR, PRICES_TABLE, get_read_engine, table_exists
+from intraday import expand_intraday_query, intraday_rows
+from query_cache import table_references
+
+# Wall-clock budget for a query typed into the app, overridable through the environment
+DEFAULT_QUERY_TIMEOUT = float(os.environ.get("STOCKS_QUERY_TIMEOUT", 30))
+
+# SQLite virtual machine steps between budget and cancellation checks
+PROGRESS_STEPS = 10000
+
+# Estimated rows visited above which a plan is flagged, and above which it is refused
+SCAN_WARN_ROWS = 1_000_000
+SCAN_REJECT_ROWS = 100_000_000
+
+# Queries run in the background by the app; caps how many heavy queries share the CPU
+QUERY_WORKERS = 4
+
+# Pragmas that only report on the schema and may be run from the query box
+READ_ONLY_PRAGMAS = {
+    "table_info", "table_xinfo", "table_list", "index_list", "index_info", "index_xinfo",
+    "foreign_key_list", "database_list", "compile_options",
+}
+
+# Authorizer actions allowed for a read-only query
+READ_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+# Intraday partition names such as AAPL@5m@2024-06 are not plain words
+PLAN_SCAN_PATTERN = re.compile(r"^SCAN ([\w@-]+)(?: AS (\w+))?$")
+
+# A read of one ticker's rows of the prices table through its primary key, as planned
+# for the ticker views (which the compact encoding aliases "p") and ticker = ? filters
+PLAN_TICKER_SEARCH_PATTERN = re.compile(r"^SEARCH (\w+) USING PRIMARY KEY \(ticker=\?(?: AND date.*)?\)$")
+
+# A common table expression, such as an intraday series, evaluated before the query reads it
+PLAN_SUBQUERY_PATTERN = re.compile(r"^(?:MATERIALIZE|CO-ROUTINE) ([\w@-]+)$")
+
+class QueryRejected(Exception):
+    """
+    Raised when a query is not read-only or its plan is too expensive to run.
+    """
+
+class QueryInterrupted(Exception):
+    """
+    Raised when a query is stopped because it ran out of time or was cancelled.
+    """
+
+def authorize_read(action, arg1, arg2, db_name, trigger):
+    if action in READ_ACTIONS:
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_PRAGMA and arg1.lower() in READ_ONLY_PRAGMAS:
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+@contextmanager
+def guarded_connection(connection, timeout=None, cancel=None):
+    """
+    Restricts a SQLAlchemy connection to reading for the duration of the block and
+    stops any statement that runs past `timeout` seconds or once `cancel` (a
+    threading.Event) is set, raising QueryInterrupted.
+    """
+    raw = connection.connection.driver_connection
+    deadline = time.monotonic() + timeout if timeout else None
+    stopped = {}
+
+    def check_budget():
+        if cancel is not None and cancel.is_set():
+            stopped["reason"] = "Query cancelled."
+        elif deadline is not None and time.monotonic() > deadline:
+            stopped["reason"] = f"Query stopped after exceeding its {timeout:g} second budget."
+        return 1 if stopped else 0
+
+    raw.set_authorizer(authorize_read)
+    raw.set_progress_handler(check_budget, PROGRESS_STEPS)
+    try:
+        yield connection
+    except DBAPIError as e:
+        if "reason" in stopped:
+            raise QueryInterrupted(stopped["reason"]) from e
+        if "not authorized" in str(e):
+            raise QueryRejected("Only read-only queries can be run here.") from e
+        raise
+    finally:
+        raw.set_progress_handler(None, PROGRESS_STEPS)
+        raw.set_authorizer(None)
+
+def table_aliases(query):
+    """
+    Maps the names used in the query's FROM and JOIN clauses, aliases included, to table names.
+    """
+    aliases = {}
+    for table, alias in table_references(query):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+def estimate_table_rows(connection, table):
+    """
+    Returns an estimate of the rows in a table: MAX(rowid) for ordinary tables,
+    otherwise the sqlite_stat1 count when ANALYZE has run, otherwise, for the
+    WITHOUT ROWID prices table, the sum of the catalog's row counts. None when
+    unknown; the table is never counted, since that could take as long as the
+    query being assessed.
+    """
+    try:
+        rows = connection.execute(text(f'SELECT MAX(rowid) FROM "{table}"')).scalar()
+        if rows is not None:
+            return int(rows)
+    except Exception:
+        # WITHOUT ROWID tables and views have no rowid
+        pass
+    try:
+        stat = connection.execute(
+            text("SELECT stat FROM sqlite_stat1 WHERE tbl = :table LIMIT 1"), {"table": table}
+        ).scalar()
+        if stat:
+            return int(stat.split()[0])
+    except Exception:
+        # sqlite_stat1 only exists once ANALYZE has run
+        pass
+    if table == PRICES_TABLE:
+        try:
+            return connection.execute(text(f"SELECT SUM(rows) FROM {CATALOG_TABLE} WHERE storage = 'prices'")).scalar()
+        except Exception:
+            # Databases from before the catalog have no catalog table
+            return None
+    return None
+
+def estimate_ticker_rows(connection, ticker=None):
+    """
+    Returns the rows a ticker has in the prices table according to the catalog,
+    or None when the catalog does not list it. Without a ticker, returns the
+    largest catalogued ticker, for ticker = ? filters on prices itself.
+    """
+    try:
+        if ticker is None:
+            return connection.execute(
+                text(f"SELECT MAX(rows) FROM {CATALOG_TABLE} WHERE storage = 'prices'")
+            ).scalar()
+        return connection.execute(
+            text(f"SELECT rows FROM {CATALOG_TABLE} WHERE ticker = :ticker"), {"ticker": ticker.upper()}
+        ).scalar()
+    except Exception:
+        # Databases from before the catalog have no catalog table
+        return None
+
+def assess_query(query, engine, warn_rows=SCAN_WARN_ROWS, reject_rows=SCAN_REJECT_ROWS):
+    """
+    Inspects the query plan and returns the full table scans with their estimated
+    rows, the estimated rows visited and any warnings. Scans nested in the same
+    join multiply, so an accidental cross join is caught before it runs.
+    Raises QueryRejected when the query is not a read-only statement or the
+    estimate exceeds reject_rows.
+    """
+    # The writable engine's single connection may be held by ingestion for minutes
+    engine = get_read_engine(engine)
+    aliases = table_aliases(query)
+    scans = []
+    warnings = []
+    with engine.connect() as connection:
+        try:
+            with guarded_connection(connection):
+                plan = connection.execute(text(f"EXPLAIN QUERY PLAN {expand_intraday_query(query, connection)}")).fetchall()
+        except QueryRejected:
+            raise
+        except Exception as e:
+            raise QueryRejected(f"Query could not be planned: {e}") from e
+
+        # Ticker views are flattened into searches of the prices table that do not
+        # name the view, so they are matched to the views the query reads in order
+        view_names = {row[0].upper() for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'view'"))}
+        views = [table for table, _ in table_references(query) if table.upper() in view_names]
+        # Searches inside correlated subqueries are per-row lookups, e.g. a compact view's adjustment factor
+        correlated = {node for node, _, _, detail in plan if detail.startswith("CORRELATED")}
+        # The partitions a series reads are counted once, as the rows of the series' own scan
+        parents = {node: parent for node, parent, _, _ in plan}
+        series = {node: match.group(1) for node, _, _, detail in plan
+                  if (match := PLAN_SUBQUERY_PATTERN.match(detail)) and PARTITION_SEPARATOR in match.group(1)}
+        series_rows = {}
+
+        for node, parent, _, detail in plan:
+            match = PLAN_SCAN_PATTERN.match(detail)
+            search = PLAN_TICKER_SEARCH_PATTERN.match(detail)
+            ancestor = parent
+            while ancestor and ancestor not in series:
+                ancestor = parents.get(ancestor, 0)
+            if match and ancestor in series:
+                rows = intraday_rows(connection, match.group(1))
+                series_rows[series[ancestor]] = series_rows.get(series[ancestor], 0) + (rows or 0)
+            elif match:
+                name = match.group(2) or match.group(1)
+                table = aliases.get(name, name)
+                if table in series_rows:
+                    rows = series_rows[table]
+                elif PARTITION_SEPARATOR in table:
+                    # Partitions read directly, or a series flattened into the query, are sized by the partition registry
+                    rows = intraday_rows(connection, table)
+                elif table_exists(engine, table, include_views=False):
+                    rows = estimate_table_rows(connection, table)
+                else:
+                    rows = None
+                scans.append({"table": table, "rows": rows, "parent": parent})
+            elif search and parent not in correlated and (
+                aliases.get(search.group(1), search.group(1)) == PRICES_TABLE or (search.group(1) == "p" and views)
+            ):
+                ticker = views.pop(0) if views else None
+                # A search by ticker and exact date reads a single row
+                rows = 1 if "date=?" in detail else estimate_ticker_rows(connection, ticker)
+                scans.append({"table": ticker or PRICES_TABLE, "rows": rows, "parent": parent})
+            elif detail.startswith("USE TEMP B-TREE"):
+                warnings.append(f"Query sorts its rows in a temporary structure ({detail[len('USE TEMP B-TREE '):].lower()}).")
+
+    # Scans under the same plan node are loops of one join; separate subqueries add up
+    joins = {}
+    for scan in scans:
+        if scan["rows"]:
+            joins.setdefault(scan["parent"], []).append(scan)
+    estimated = sum(math.prod(scan["rows"] for scan in join) for join in joins.values())
+
+    if estimated > reject_rows:
+        tables = ", ".join(scan["table"] for scan in max(joins.values(), key=len))
+        raise QueryRejected(
+            f"Query would visit about {estimated:,} rows scanning {tables}. "
+            "Add a join condition or a filter on an indexed column such as Date."
+        )
+    for scan in scans:
+        if scan["rows"] and scan["rows"] > warn_rows:
+            warnings.append(f"Full scan of {scan['table']} (about {scan['rows']:,} rows).")
+    if any(len(join) > 1 for join in joins.values()) and estimated > warn_rows:
+        warnings.append(f"Nested scans visit about {estimated:,} rows.")
+    return {"scans": scans, "estimated_rows": estimated, "warnings": warnings}
+
+_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="query")
+
+class RunningQuery:
+    """
+    A query function running on the shared query pool. func must accept a
+    `cancel` keyword taking a threading.Event that stops it when set.
+    """
+    def __init__(self, func, *args, **kwargs):
+        self.cancel_event = threading.Event()
+        self.started = time.monotonic()
+        self.future = _executor.submit(func, *args, cancel=self.cancel_event, **kwargs)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
@@ -0,0 +1,48 @@
+# conftest.py
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_utils import create_sqlite_engine
+
+def price_history(start="2020-01-01", days=400, seed=0, dividend_day=250):
+    """
+    Returns business-day prices laid out like yf.download, indexed by Date. Adj Close
+    steps down by 2% before dividend_day, as Yahoo reports a dividend.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=days, name="Date")
+    close = np.round(100 * np.cumprod(1 + rng.normal(0, 0.01, days)), 2)
+    factor = np.where(np.arange(days) < dividend_day, 0.98, 1.0)
+    return pd.DataFrame({
+        "Open": np.round(close * (1 + rng.normal(0, 0.002, days)), 2),
+        "High": np.round(close * 1.01, 2),
+        "Low": np.round(close * 0.99, 2),
+        "Close": close,
+        "Adj Close": close * factor,
+        "Volume": rng.integers(1_000, 1_000_000, days),
+    }, index=dates)
+
+class FrameFetcher:
+    """
+    Serves prepared frames in place of Yahoo, from start on when one is given.
+    """
+    def __init__(self, frames):
+        self.frames = frames
+
+    def fetch(self, ticker, start=None):
+        df = self.frames[ticker]
+        return df if start is None else df[df.index >= pd.Timestamp(start)]
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_sqlite_engine(str(tmp_path / "stocks.db"))
+    yield engine
+    engine.dispose()
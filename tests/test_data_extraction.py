@@ -0,0 +1,60 @@
+# test_data_extraction.py
+
+import pandas as pd
+from sqlalchemy import text
+
+from conftest import FrameFetcher, price_history
+from data_extraction import extract_and_store_data, overlap_matches, prepare_downloaded_data
+
+def ingest(engine, frame):
+    return extract_and_store_data(
+        ["AAA"], engine, fetcher=FrameFetcher({"AAA": frame}), retries=1, backoff=0, columnar_dir=None, indicators=False
+    )[0]
+
+def stored_prices(engine):
+    with engine.connect() as connection:
+        return pd.read_sql_query(text('SELECT * FROM "AAA" ORDER BY "Date"'), connection)
+
+def test_overlap_matches_same_prices():
+    stored = prepare_downloaded_data(price_history().iloc[-5:])
+    assert overlap_matches(stored, prepare_downloaded_data(price_history().iloc[-5:]))
+
+def test_overlap_detects_restated_prices():
+    stored = prepare_downloaded_data(price_history().iloc[-5:])
+    restated = price_history().iloc[-5:]
+    restated["Adj Close"] *= 0.5
+    assert not overlap_matches(stored, prepare_downloaded_data(restated))
+
+def test_overlap_detects_new_columns():
+    stored = prepare_downloaded_data(price_history().iloc[-5:])
+    fresh = price_history().iloc[-5:].assign(Dividends=0.0)
+    assert not overlap_matches(stored, prepare_downloaded_data(fresh))
+
+def test_refresh_appends_only_new_rows(engine):
+    history = price_history()
+    assert ingest(engine, history.iloc[:300])["status"] == "replaced"
+
+    result = ingest(engine, history)
+    assert result["status"] == "appended"
+    assert result["rows"] == 100
+    pd.testing.assert_frame_equal(stored_prices(engine), prepare_downloaded_data(history), check_dtype=False)
+
+def test_refresh_reloads_restated_history(engine):
+    history = price_history()
+    ingest(engine, history.iloc[:300])
+
+    # A split restates every earlier adjusted price, including the overlap rows
+    restated = history.copy()
+    restated["Adj Close"] /= 4
+    result = ingest(engine, restated)
+    assert result["status"] == "reloaded"
+    assert result["rows"] == len(restated)
+    pd.testing.assert_frame_equal(stored_prices(engine), prepare_downloaded_data(restated), check_dtype=False)
+
+def test_refresh_without_new_rows_writes_nothing(engine):
+    history = price_history()
+    ingest(engine, history)
+    result = ingest(engine, history)
+    assert result["status"] == "appended"
+    assert result["rows"] == 0
+    assert len(stored_prices(engine)) == len(history)
@@ -0,0 +1,59 @@
+# test_indicators.py
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from conftest import FrameFetcher, price_history
+from data_extraction import extract_and_store_data
+from database_utils import INDICATORS_TABLE
+from indicators import exponential_smoothing, update_indicators
+from price_store import migrate_to_prices_table
+
+def recursive_smoothing(values, alpha, initial):
+    out = []
+    previous = initial
+    for value in values:
+        previous = alpha * value + (1 - alpha) * previous
+        out.append(previous)
+    return np.array(out)
+
+@pytest.mark.parametrize("alpha", [2 / 13, 1 / 14, 0.001])
+def test_exponential_smoothing_matches_recursion(alpha):
+    # 0.001 needs several closed-form blocks for 20000 values
+    values = 100 + np.cumsum(np.random.default_rng(1).normal(0, 1, 20000))
+    np.testing.assert_allclose(exponential_smoothing(values, alpha, 95.0), recursive_smoothing(values, alpha, 95.0), rtol=1e-9)
+
+def test_exponential_smoothing_without_decay_copies_values():
+    values = np.array([1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(exponential_smoothing(values, 1.0, 0.0), values)
+
+def read_indicators(engine):
+    with engine.connect() as connection:
+        return pd.read_sql_query(text(f'SELECT * FROM {INDICATORS_TABLE} WHERE "Ticker" = \'AAA\' ORDER BY "Date"'), connection)
+
+@pytest.mark.parametrize("layout", ["tables", "prices", "compact"])
+def test_update_after_append_matches_full_recompute(engine, layout):
+    history = price_history(days=500)
+    store = lambda frame: extract_and_store_data(
+        ["AAA"], engine, fetcher=FrameFetcher({"AAA": frame}), retries=1, backoff=0, columnar_dir=None, indicators=False
+    )
+    store(history.iloc[:400])
+    if layout != "tables":
+        migrate_to_prices_table(engine, compact=layout == "compact")
+    update_indicators("AAA", engine, full=True)
+
+    store(history)
+    assert update_indicators("AAA", engine) == 100
+    incremental = read_indicators(engine)
+
+    update_indicators("AAA", engine, full=True)
+    pd.testing.assert_frame_equal(incremental, read_indicators(engine), rtol=1e-9)
+
+def test_update_without_new_bars_writes_nothing(engine):
+    extract_and_store_data(
+        ["AAA"], engine, fetcher=FrameFetcher({"AAA": price_history()}), retries=1, backoff=0, columnar_dir=None, indicators=False
+    )
+    assert update_indicators("AAA", engine) == 400
+    assert update_indicators("AAA", engine) == 0
@@ -0,0 +1,91 @@
+# test_intraday.py
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from intraday import (
+    apply_retention, expand_intraday_query, partition_name, partition_tables, prepare_intraday_data, read_intraday,
+    store_intraday_bars
+)
+from query_guard import assess_query
+
+def bars(start, end, interval):
+    index = pd.date_range(start, end, freq=interval, tz="UTC", inclusive="left", name="Datetime")
+    close = np.arange(len(index), dtype=float)
+    return prepare_intraday_data(pd.DataFrame(
+        {"Open": close, "High": close + 1, "Low": close - 1, "Close": close + 0.5, "Volume": 10}, index=index
+    ))
+
+@pytest.fixture
+def series(engine):
+    # Three monthly partitions of 15 minute bars: 2976 + 2976 + 2880 rows
+    store_intraday_bars(engine, "AAA", "15m", bars("2026-07-01", "2026-10-01", "15min"))
+    return engine
+
+def run(engine, query):
+    with engine.connect() as connection:
+        expanded = expand_intraday_query(query, connection)
+        return expanded, connection.execute(text(expanded)).scalar()
+
+def months_read(expanded):
+    return [month for month in ("2026-07", "2026-08", "2026-09") if partition_name("AAA", "15m", month) in expanded]
+
+def test_series_reads_every_partition(series):
+    expanded, count = run(series, 'SELECT COUNT(*) FROM AAA@15m')
+    assert months_read(expanded) == ["2026-07", "2026-08", "2026-09"]
+    assert count == 8832
+
+def test_datetime_filter_reads_matching_partitions(series):
+    expanded, count = run(series, "SELECT COUNT(*) FROM AAA@15m WHERE Datetime >= '2026-09-01' AND Volume > 0")
+    assert months_read(expanded) == ["2026-09"]
+    assert count == 2880
+
+    expanded, count = run(series, "SELECT COUNT(*) FROM AAA@15m WHERE Datetime BETWEEN '2026-07-20' AND '2026-08-10'")
+    assert months_read(expanded) == ["2026-07", "2026-08"]
+    # Datetimes compare as text, so '2026-08-10 00:00:00' sorts after '2026-08-10'
+    assert count == 21 * 96
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT COUNT(*) FROM AAA@15m WHERE NOT Datetime >= '2026-09-01'", 5952),
+    ("SELECT COUNT(*) FROM AAA@15m WHERE Datetime >= '2026-09-01' OR Volume > 0", 8832),
+    ("SELECT COUNT(*) FROM AAA@15m WHERE Close > 0 AND Datetime < '2026-08-01' UNION ALL SELECT 0", 2976),
+    ("SELECT COUNT(*) FROM AAA@15m a JOIN AAA@15m b ON b.Datetime = a.Datetime WHERE a.Datetime >= '2026-09-01'", 2880),
+    ("SELECT COUNT(*) FROM AAA@15m WHERE Volume = '2026-09-01' OR 1", 8832),
+])
+def test_filters_that_cannot_prune_read_every_partition(series, query, expected):
+    expanded, count = run(series, query)
+    assert months_read(expanded) == ["2026-07", "2026-08", "2026-09"]
+    assert count == expected
+
+def test_read_intraday_reads_the_requested_range(series):
+    df = read_intraday("AAA", "15m", series, start="2026-08-31 23:00", end="2026-09-01 01:00")
+    assert df.index[0] == pd.Timestamp("2026-08-31 23:00") and df.index[-1] == pd.Timestamp("2026-09-01 01:00")
+    assert len(df) == 9
+
+def test_plan_estimate_counts_each_partition_once(series):
+    assert assess_query("SELECT COUNT(*) FROM AAA@15m", series)["estimated_rows"] == 8832
+
+def test_retention_rolls_up_old_months(engine):
+    store_intraday_bars(engine, "AAA", "1m", bars("2026-01-01", "2026-01-03", "1min"))
+    store_intraday_bars(engine, "AAA", "1m", bars("2026-03-01", "2026-03-02", "1min"))
+    # A day that already has 5 minute bars keeps them
+    store_intraday_bars(engine, "AAA", "5m", bars("2026-01-02", "2026-01-03", "5min"))
+
+    rolled = apply_retention(engine, now="2026-03-15")
+    assert rolled == [("AAA", "1m", "2026-01", "5m", 288)]
+    with engine.connect() as connection:
+        assert partition_tables(connection, "AAA", "1m") == [partition_name("AAA", "1m", "2026-03")]
+    rolled_up = read_intraday("AAA", "5m", engine)
+    assert len(rolled_up) == 2 * 288
+
+    # The first five minutes of 2026-01-01 are minutes 0 to 4 of the 1 minute bars
+    first = rolled_up.iloc[0]
+    assert (first["Open"], first["High"], first["Low"], first["Close"], first["Volume"]) == (0.0, 5.0, -1.0, 4.5, 50)
+    # Bars stored at 5 minutes were not replaced by the roll-up
+    assert rolled_up.loc["2026-01-02 00:00", "Open"] == 0.0
+
+def test_retention_leaves_recent_months(engine):
+    store_intraday_bars(engine, "AAA", "1m", bars("2026-03-01", "2026-03-02", "1min"))
+    assert apply_retention(engine, now="2026-03-15") == []
@@ -0,0 +1,62 @@
+# test_price_encoding.py
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from conftest import FrameFetcher, price_history
+from data_extraction import extract_and_store_data, prepare_downloaded_data
+from data_querying import get_prices
+from price_encoding import ADJUSTMENT_TOLERANCE, adjustment_events, apply_adjustments, choose_scale, encode_prices
+from price_store import migrate_to_prices_table
+
+def test_adjustment_events_round_trip():
+    history = price_history()
+    dates = np.arange(len(history))
+    event_dates, factors = adjustment_events(dates, history["Close"], history["Adj Close"])
+
+    # One event for the factor in force at the start and one for the dividend
+    np.testing.assert_array_equal(event_dates, [0, 250])
+    np.testing.assert_allclose(factors, [0.98, 1.0])
+    adjusted = apply_adjustments(dates, history["Close"], event_dates, factors)
+    np.testing.assert_allclose(adjusted, history["Adj Close"], rtol=ADJUSTMENT_TOLERANCE)
+
+def test_adjustment_events_keep_missing_factors():
+    close = np.array([10.0, 10.0, 10.0, 10.0])
+    adj_close = np.array([9.0, np.nan, np.nan, 9.0])
+    event_dates, factors = adjustment_events(np.arange(4), close, adj_close)
+    np.testing.assert_array_equal(event_dates, [0, 1, 3])
+    np.testing.assert_allclose(apply_adjustments(np.arange(4), close, event_dates, factors), adj_close)
+
+def test_adjustments_before_first_event_are_missing():
+    adjusted = apply_adjustments(np.array([1, 5]), np.array([10.0, 10.0]), np.array([3]), np.array([0.5]))
+    np.testing.assert_array_equal(adjusted, [np.nan, 5.0])
+
+def test_prices_encode_at_the_smallest_exact_scale():
+    history = price_history()
+    scale = choose_scale(history)
+    assert scale == 100
+    np.testing.assert_array_equal(encode_prices([1.25, np.nan], scale), [125, None])
+
+@pytest.mark.parametrize("via_plain", [False, True])
+def test_compact_prices_read_back_as_stored(engine, via_plain):
+    history = price_history()
+    extract_and_store_data(
+        ["AAA"], engine, fetcher=FrameFetcher({"AAA": history}), retries=1, backoff=0, columnar_dir=None, indicators=False
+    )
+    if via_plain:
+        # Converting an existing plain prices table in place must give the same result
+        migrate_to_prices_table(engine)
+    migrate_to_prices_table(engine, compact=True)
+
+    expected = prepare_downloaded_data(history).set_index("Date")
+    expected.index = pd.DatetimeIndex(pd.to_datetime(expected.index), name="Date")
+    prices = get_prices("AAA", engine)
+    pd.testing.assert_frame_equal(prices, expected, check_dtype=False, check_index_type=False, rtol=ADJUSTMENT_TOLERANCE)
+
+    # The compatibility view decodes the same values
+    with engine.connect() as connection:
+        view = pd.read_sql_query(text('SELECT * FROM "AAA" ORDER BY "Date"'), connection)
+    assert view["Date"].tolist() == prepare_downloaded_data(history)["Date"].tolist()
+    np.testing.assert_allclose(view["Adj_Close"], history["Adj Close"], rtol=ADJUSTMENT_TOLERANCE)